@@ -59,10 +59,13 @@ export const authAPI = {
 
 export const surveyAPI = {
   create: (data) => axiosInstance.post('/surveys/', data),
-  getMySurveys: () => axiosInstance.get('/surveys/'),
+  getMySurveys: (params) => axiosInstance.get('/surveys/', { params }),
   getResults: (surveyId) => axiosInstance.get(`/surveys/${surveyId}/results`),
   deleteSurvey: (id) => axiosInstance.delete(`/surveys/${id}`),
   toggleStatus: (id) => axiosInstance.patch(`/surveys/${id}/status`),
+  // EventSource cannot send the Authorization header: the token goes in the query string
+  resultsStreamUrl: (surveyId) =>
+    `${API_BASE_URL}/surveys/${surveyId}/results/stream?access_token=${encodeURIComponent(localStorage.getItem('token') || '')}`,
 };
 
 export const publicAPI = {
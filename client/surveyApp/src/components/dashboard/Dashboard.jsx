@@ -13,8 +13,13 @@ import {
 } from 'lucide-react';
 import toast from 'react-hot-toast';
 
+// Only the fields rendered by the dashboard cards
+const DASHBOARD_FIELDS = 'title,description,is_active,response_count,created_at';
+
 const Dashboard = () => {
   const [surveys, setSurveys] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [stats, setStats] = useState({
     totalSurveys: 0,
@@ -26,25 +31,31 @@ const Dashboard = () => {
     fetchSurveys();
   }, []);
 
-  // Helper to recalculate stats locally without refetching from API
-  const calculateStats = (data) => {
-    const total = data.length;
-    const active = data.filter(s => s.is_active).length;
-    const responses = data.reduce((sum, s) => sum + (s.response_count || 0), 0);
-    
+  // Totals of every survey (not only the loaded pages), sent with the first page
+  const applyTotals = (totals) => {
     setStats({
-      totalSurveys: total,
-      totalResponses: responses,
-      activeSurveys: active
+      totalSurveys: totals.surveys,
+      totalResponses: totals.responses,
+      activeSurveys: totals.active_surveys
     });
   };
 
+  // Helper to adjust the totals locally without refetching from API
+  const adjustStats = (surveys, responses, active) => {
+    setStats(prev => ({
+      totalSurveys: prev.totalSurveys + surveys,
+      totalResponses: prev.totalResponses + responses,
+      activeSurveys: prev.activeSurveys + active
+    }));
+  };
+
   const fetchSurveys = async () => {
     try {
-      const response = await surveyAPI.getMySurveys();
-      const surveysData = response.data;
+      const response = await surveyAPI.getMySurveys({ fields: DASHBOARD_FIELDS });
+      const surveysData = response.data.surveys;
       setSurveys(surveysData);
-      calculateStats(surveysData);
+      setNextCursor(response.data.next_cursor);
+      applyTotals(response.data.totals);
     } catch (error) {
       toast.error('Failed to load surveys');
     } finally {
@@ -52,6 +63,21 @@ const Dashboard = () => {
     }
   };
 
+  // --- Load the next page (keyset pagination) ---
+  const fetchMoreSurveys = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await surveyAPI.getMySurveys({ fields: DASHBOARD_FIELDS, after: nextCursor });
+      const updatedSurveys = [...surveys, ...response.data.surveys];
+      setSurveys(updatedSurveys);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error('Failed to load surveys');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const formatDate = (dateString) => {
     return new Date(dateString).toLocaleDateString('en-US', {
       year: 'numeric',
@@ -76,9 +102,12 @@ const Dashboard = () => {
       await surveyAPI.deleteSurvey(surveyId);
       
       // Update local state by removing the deleted survey
+      const deleted = surveys.find(s => s._id === surveyId);
       const updatedSurveys = surveys.filter(s => s._id !== surveyId);
       setSurveys(updatedSurveys);
-      calculateStats(updatedSurveys);
+      if (deleted) {
+        adjustStats(-1, -(deleted.response_count || 0), deleted.is_active ? -1 : 0);
+      }
       
       toast.success('Survey deleted successfully');
     } catch (error) {
@@ -99,7 +128,9 @@ const Dashboard = () => {
       );
       
       setSurveys(updatedSurveys);
-      calculateStats(updatedSurveys);
+      if (newStatus !== currentStatus) {
+        adjustStats(0, 0, newStatus ? 1 : -1);
+      }
 
       toast.success(`Survey is now ${newStatus ? 'Active' : 'Closed'}`);
     } catch (error) {
@@ -250,6 +281,14 @@ const Dashboard = () => {
             ))}
           </div>
         )}
+
+        {nextCursor && (
+          <div style={{ display: 'flex', justifyContent: 'center', marginTop: '1.5rem' }}>
+            <button onClick={fetchMoreSurveys} className="btn btn-outline" disabled={loadingMore}>
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
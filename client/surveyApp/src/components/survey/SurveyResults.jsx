@@ -29,6 +29,48 @@ ChartJS.register(
   Legend
 );
 
+// Apply a live 'delta' event (per-question increments) to the results state
+const applyDelta = (results, delta) => {
+  const add = (target = {}, increments = {}) => {
+    const merged = { ...target };
+    Object.entries(increments).forEach(([key, value]) => {
+      merged[key] = (merged[key] || 0) + value;
+    });
+    return merged;
+  };
+
+  return {
+    ...results,
+    total_respondents: results.total_respondents + delta.total_respondents,
+    results: results.results.map((question) => {
+      const q = delta.questions[question.id];
+      if (!q) return question;
+
+      let data = question.data;
+      if (q.counts) {
+        data = add(data, q.counts);
+      }
+      if (q.distribution) {
+        const distribution = add(data.distribution, q.distribution);
+        const values = Object.keys(distribution).map(Number);
+        const count = values.reduce((sum, v) => sum + distribution[v], 0);
+        const total = values.reduce((sum, v) => sum + v * distribution[v], 0);
+        data = {
+          average: Math.round((total / count) * 100) / 100,
+          min: Math.min(...values),
+          max: Math.max(...values),
+          distribution
+        };
+      }
+      if (q.recent_answers) {
+        data = { recent_answers: [...(data.recent_answers || []), ...q.recent_answers].slice(-5) };
+      }
+
+      return { ...question, data, total_answers: question.total_answers + (q.total_answers || 0) };
+    })
+  };
+};
+
 const SurveyResults = () => {
   const { surveyId } = useParams();
   const navigate = useNavigate();
@@ -39,6 +81,23 @@ const SurveyResults = () => {
     fetchResults();
   }, [surveyId]);
 
+  // --- Live updates (Server-Sent Events): snapshot first, then small deltas ---
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return;
+
+    const source = new EventSource(surveyAPI.resultsStreamUrl(surveyId));
+    source.addEventListener('snapshot', (e) => {
+      setResults(JSON.parse(e.data));
+      setLoading(false);
+    });
+    source.addEventListener('delta', (e) => {
+      const delta = JSON.parse(e.data);
+      setResults((current) => (current ? applyDelta(current, delta) : current));
+    });
+
+    return () => source.close();
+  }, [surveyId]);
+
   const fetchResults = async () => {
     try {
       const response = await surveyAPI.getResults(surveyId);
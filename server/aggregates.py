@@ -0,0 +1,280 @@
+"""
+Pre-aggregated survey results.
+
+Every survey owns one document in the ``survey_stats`` collection. It is
+updated atomically ($inc / $min / $max / $push + $slice) each time a response
+is recorded, so GET /results only reads O(questions) data instead of
+rescanning every response.
+
+Counters are keyed by question position and option position, so texts typed
+by survey creators never end up as MongoDB field names:
+
+    {
+        "_id": <survey ObjectId>,
+        "total": 42,                                        # respondents
+        "built": true,                                      # counts every response
+        "q": {
+            "0": {"n": 40, "c": {"0": 25, "1": 15}},               # radio / select / checkbox
+            "1": {"n": 38, "k": 38, "sum": 150, "min": 1, "max": 5,
+                  "dist": {"4": 20, "5": 18}},                     # rating
+            "2": {"n": 12, "recent": ["...", "..."]},              # text
+        }
+    }
+
+``built`` marks a document that accounts for every response: set by
+``create`` for a new survey and by ``rebuild``. A document without it was
+upserted by the first response recorded after the survey already had
+some (surveys older than pre-aggregation): GET /results ignores it and
+computes the results from the raw responses (results_engine.py) until
+``flask rebuild-results`` has run.
+
+If the stats drift from the raw ``responses`` collection (manual edits,
+crash between the two writes...), ``rebuild`` recomputes them from scratch.
+It is exposed as ``flask rebuild-results`` and requires ingestion to be
+paused: a response recorded during the scan would be lost or counted twice.
+"""
+import answer_codec
+from results_engine import RECENT_TEXT_ANSWERS
+
+CHOICE_TYPES = ('radio', 'select')
+
+
+# --- WRITE SIDE ---
+
+def build_update(survey, answers):
+    """
+    Build the MongoDB update document recording one response.
+    ``answers`` are valid and normalized (answer_validation.validate, or
+    answer_codec.answers_of for stored responses).
+    """
+    inc = {'total': 1}
+    mins, maxs, push = {}, {}, {}
+
+    for i, question in enumerate(survey.get('questions', [])):
+        ans = answers.get(str(question.get('id')))
+        if ans is None:
+            continue
+
+        prefix = f'q.{i}'
+        q_type = question.get('type')
+        options = question.get('options') or []
+        inc[f'{prefix}.n'] = 1
+
+        if q_type in CHOICE_TYPES:
+            inc[f'{prefix}.c.{options.index(ans)}'] = 1
+
+        elif q_type == 'checkbox':
+            for item in ans:
+                inc[f'{prefix}.c.{options.index(item)}'] = 1
+
+        elif q_type == 'rating':
+            inc[f'{prefix}.k'] = 1
+            inc[f'{prefix}.sum'] = ans
+            inc[f'{prefix}.dist.{ans}'] = 1
+            mins[f'{prefix}.min'] = ans
+            maxs[f'{prefix}.max'] = ans
+
+        elif q_type == 'text':
+            push[f'{prefix}.recent'] = {'$each': [ans], '$slice': -RECENT_TEXT_ANSWERS}
+
+    update = {'$inc': inc}
+    if mins:
+        update['$min'] = mins
+    if maxs:
+        update['$max'] = maxs
+    if push:
+        update['$push'] = push
+    return update
+
+
+def apply_response(db, survey, answers, update=None):
+    """Atomically fold one response into the survey's stats document."""
+    db.survey_stats.update_one(
+        {'_id': survey['_id']},
+        update or build_update(survey, answers),
+        upsert=True
+    )
+
+
+def merge_updates(updates):
+    """
+    Coalesce several updates built by ``build_update`` for the same survey
+    into one, with the same effect as applying them in order.
+    """
+    merged = {}
+    for update in updates:
+        for op, fields in update.items():
+            target = merged.setdefault(op, {})
+            for path, value in fields.items():
+                if path not in target:
+                    target[path] = dict(value) if op == '$push' else value
+                elif op == '$inc':
+                    target[path] += value
+                elif op == '$min':
+                    target[path] = min(target[path], value)
+                elif op == '$max':
+                    target[path] = max(target[path], value)
+                elif op == '$push':
+                    target[path]['$each'] = target[path]['$each'] + value['$each']
+    return merged
+
+
+def to_delta(survey, update):
+    """
+    Translate an update built by ``build_update`` (or ``merge_updates``) into
+    the increments the results page applies to its snapshot, keyed by
+    question id and option text like GET /results.
+    """
+    questions = survey.get('questions', [])
+    inc = update.get('$inc', {})
+    delta = {"total_respondents": inc.get('total', 0), "questions": {}}
+
+    def question_delta(i):
+        return delta['questions'].setdefault(str(questions[i].get('id')), {})
+
+    for path, value in inc.items():
+        parts = path.split('.')
+        if parts[0] != 'q':
+            continue
+        i, field = int(parts[1]), parts[2]
+        q_delta = question_delta(i)
+        if field == 'n':
+            q_delta['total_answers'] = value
+        elif field == 'c':
+            option = (questions[i].get('options') or [])[int(parts[3])]
+            counts = q_delta.setdefault('counts', {})
+            counts[option] = counts.get(option, 0) + value
+        elif field == 'dist':
+            q_delta.setdefault('distribution', {})[parts[3]] = value
+
+    for path, value in update.get('$push', {}).items():
+        i = int(path.split('.')[1])
+        question_delta(i)['recent_answers'] = value['$each'][-RECENT_TEXT_ANSWERS:]
+
+    return delta
+
+
+def apply_in_memory(doc, update):
+    """Apply an update built by ``build_update`` to a plain dict (used by rebuild)."""
+    for op, fields in update.items():
+        for path, value in fields.items():
+            *parents, leaf = path.split('.')
+            node = doc
+            for part in parents:
+                node = node.setdefault(part, {})
+
+            if op == '$inc':
+                node[leaf] = node.get(leaf, 0) + value
+            elif op == '$min':
+                node[leaf] = value if leaf not in node else min(node[leaf], value)
+            elif op == '$max':
+                node[leaf] = value if leaf not in node else max(node[leaf], value)
+            elif op == '$push':
+                items = node.get(leaf, []) + value['$each']
+                node[leaf] = items[value['$slice']:]
+
+
+def doc_update(doc):
+    """
+    The update adding a whole stats document (or time bucket, see
+    timeseries.py) into another one: the reverse of ``apply_in_memory``.
+    """
+    inc = {'total': doc.get('total', 0)}
+    mins, maxs, push = {}, {}, {}
+
+    for i, acc in doc.get('q', {}).items():
+        prefix = f'q.{i}'
+        for field in ('n', 'k', 'sum'):
+            if field in acc:
+                inc[f'{prefix}.{field}'] = acc[field]
+        for field in ('c', 'dist'):
+            for key, count in acc.get(field, {}).items():
+                inc[f'{prefix}.{field}.{key}'] = count
+        if 'min' in acc:
+            mins[f'{prefix}.min'] = acc['min']
+        if 'max' in acc:
+            maxs[f'{prefix}.max'] = acc['max']
+        if acc.get('recent'):
+            push[f'{prefix}.recent'] = {'$each': acc['recent'], '$slice': -RECENT_TEXT_ANSWERS}
+
+    update = {'$inc': inc}
+    if mins:
+        update['$min'] = mins
+    if maxs:
+        update['$max'] = maxs
+    if push:
+        update['$push'] = push
+    return update
+
+
+def create(db, survey_id):
+    """The (complete) stats document of a survey without responses."""
+    db.survey_stats.insert_one({'_id': survey_id, 'total': 0, 'q': {}, 'built': True})
+
+
+def rebuild(db, survey):
+    """Recompute the stats document of one survey from the raw responses (ingestion paused)."""
+    doc = {'_id': survey['_id'], 'total': 0, 'q': {}, 'built': True}
+
+    cursor = db.responses.find({'survey_id': survey['_id']}, answer_codec.FIELDS).sort('_id', 1)
+    for r in cursor:
+        apply_in_memory(doc, build_update(survey, answer_codec.answers_of(survey, r)))
+
+    db.survey_stats.replace_one({'_id': survey['_id']}, doc, upsert=True)
+    return doc
+
+
+def delete(db, survey_id):
+    db.survey_stats.delete_one({'_id': survey_id})
+
+
+# --- READ SIDE ---
+
+def to_results(survey, doc):
+    """
+    Turn a stats document into the ``results`` list returned by GET /results.
+    Runs in O(questions), whatever the number of responses.
+    """
+    doc = doc or {}
+    per_question = doc.get('q', {})
+    stats = []
+
+    for i, question in enumerate(survey.get('questions', [])):
+        q_type = question.get('type')
+        acc = per_question.get(str(i), {})
+
+        question_stat = {
+            "id": str(question.get('id')),
+            "text": question.get('text'),
+            "type": q_type,
+            "total_answers": acc.get('n', 0),
+            "data": {}
+        }
+
+        if q_type in CHOICE_TYPES or q_type == 'checkbox':
+            options = question.get('options') or []
+            counts = {opt: 0 for opt in options}
+            per_option = acc.get('c', {})
+            for j, opt in enumerate(options):
+                counts[opt] += per_option.get(str(j), 0)
+            question_stat['data'] = counts
+
+        elif q_type == 'rating':
+            if acc.get('k'):
+                question_stat['data'] = {
+                    "average": round(acc['sum'] / acc['k'], 2),
+                    "min": acc['min'],
+                    "max": acc['max'],
+                    "distribution": {int(val): c for val, c in acc.get('dist', {}).items()}
+                }
+            else:
+                question_stat['data'] = {"average": 0, "distribution": {}}
+
+        elif q_type == 'text':
+            question_stat['data'] = {
+                "recent_answers": acc.get('recent', [])
+            }
+
+        stats.append(question_stat)
+
+    return stats, doc.get('total', 0)
@@ -0,0 +1,208 @@
+"""
+Storage format of the answers of a response.
+
+Format 1 (the API shape, as submitted):
+
+    answers: {"<question id>": <value>, ...}
+
+Format 2 (ANSWER_FORMAT = 2), positional by question order:
+
+    v: 2
+    a: [<question 0>, <question 1>, ...]   # trailing unanswered questions omitted
+    extra: {"<id>": <value>}                # answers to ids not in the survey, if any
+
+    radio / select  -> option index
+    checkbox        -> bitmask of the chosen option indexes (up to 53 options)
+    rating          -> int (within answer_validation.RATING_RANGE)
+    text / others   -> the string
+    unanswered      -> null
+
+A value that has no compact form (unknown option, invalid rating, repeated
+checkbox item, non-string text...) is stored as {"x": <value>}, so
+nothing submitted is lost. Decoding gives back the submitted answers, except
+that checkbox items come back in option order and ratings as ints.
+
+Question ids and option texts are no longer repeated in every response, which
+shrinks the ``responses`` collection and every scan of it (see
+benchmarks/answer_encoding.py). Positions refer to the survey's ``questions``
+and ``options`` lists, which never change once the survey is created.
+
+Readers understand both formats: ``decode`` gives back what was stored (used
+by exports), ``answers_of`` the answers fit for stats (see
+answer_validation.py), and ``decode_expr`` decodes inside aggregation
+pipelines. ``migrate`` converts stored responses from one format to the other
+(``flask migrate-answers``).
+"""
+from pymongo import UpdateOne
+
+import answer_validation
+
+CHOICE_TYPES = ('radio', 'select')
+# Masks stay below 2**53, exact as doubles: pipelines test bits with $divide / $mod
+MAX_BITMASK_OPTIONS = 53
+
+# Fields to project wherever answers are read
+FIELDS = {'v': 1, 'a': 1, 'answers': 1}
+
+
+def _raw(value):
+    return {'x': value}
+
+
+def _encode_value(question, ans):
+    q_type = question.get('type')
+    options = question.get('options') or []
+
+    if q_type in CHOICE_TYPES:
+        try:
+            return options.index(ans)
+        except ValueError:
+            return _raw(ans)
+
+    if q_type == 'checkbox':
+        if not isinstance(ans, list) or len(options) > MAX_BITMASK_OPTIONS:
+            return _raw(ans)
+        mask = 0
+        for item in ans:
+            try:
+                mask |= 1 << options.index(item)
+            except ValueError:
+                return _raw(ans)
+        # Repeated items would be collapsed by the bitmask
+        return mask if bin(mask).count('1') == len(ans) else _raw(ans)
+
+    if q_type == 'rating':
+        val = answer_validation.parse_rating(ans)
+        return _raw(ans) if val is answer_validation.INVALID else val
+
+    return ans if isinstance(ans, str) else _raw(ans)
+
+
+def encode(survey, answers, version=2):
+    """Return the fields storing ``answers`` in a response document."""
+    if version == 1 or not isinstance(answers, dict):
+        return {'answers': answers}
+
+    answers = dict(answers)
+    values = []
+    for question in survey.get('questions', []):
+        ans = answers.pop(str(question.get('id')), None)
+        values.append(None if ans is None else _encode_value(question, ans))
+    while values and values[-1] is None:
+        values.pop()
+
+    fields = {'v': 2, 'a': values}
+    if answers:
+        fields['extra'] = answers
+    return fields
+
+
+def _decode_value(question, value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return value.get('x')
+
+    q_type = question.get('type')
+    options = question.get('options') or []
+    if q_type in CHOICE_TYPES:
+        return options[value]
+    if q_type == 'checkbox':
+        return [opt for j, opt in enumerate(options) if value >> j & 1]
+    return value
+
+
+def decode(survey, response):
+    """The answers of a stored response in the API shape, as submitted, whatever its format."""
+    if response.get('v') != 2:
+        return response.get('answers')
+
+    answers = dict(response.get('extra') or {})
+    for question, value in zip(survey.get('questions', []), response.get('a') or []):
+        if value is not None:
+            answers[str(question.get('id'))] = _decode_value(question, value)
+    return answers
+
+
+def answers_of(survey, response):
+    """
+    The valid answers of a stored response in the API shape, normalized like
+    answer_validation.validate. Only responses stored before validation
+    existed (format 1, raw values) need checking.
+    """
+    validator = answer_validation.for_survey(survey)
+    if response.get('v') != 2:
+        return validator.sanitize(response.get('answers'))
+
+    answers = {}
+    for question, value in zip(survey.get('questions', []), response.get('a') or []):
+        if value is None:
+            continue
+        q_id = str(question.get('id'))
+        if isinstance(value, dict):
+            value = validator.clean(q_id, value.get('x'))
+            if value is answer_validation.INVALID:
+                continue
+            answers[q_id] = value
+        else:
+            answers[q_id] = _decode_value(question, value)
+    return answers
+
+
+def decode_expr(question, i):
+    """
+    Aggregation expression evaluating to the API value of question ``i`` of a
+    format 2 response (null when unanswered), for use in $project/$addFields.
+    """
+    options = {'$literal': question.get('options') or []}
+    q_type = question.get('type')
+
+    if q_type in CHOICE_TYPES:
+        decoded = {'$arrayElemAt': [options, '$$c']}
+    elif q_type == 'checkbox':
+        chosen = {'$filter': {
+            'input': {'$range': [0, len(question.get('options') or [])]},
+            'as': 'j',
+            'cond': {'$eq': [{'$mod': [{'$floor': {'$divide': ['$$c', {'$pow': [2, '$$j']}]}}, 2]}, 1]},
+        }}
+        decoded = {'$map': {'input': chosen, 'as': 'j', 'in': {'$arrayElemAt': [options, '$$j']}}}
+    else:
+        decoded = '$$c'
+
+    return {'$let': {
+        'vars': {'c': {'$arrayElemAt': ['$a', i]}},
+        'in': {'$switch': {
+            'branches': [
+                {'case': {'$eq': [{'$type': '$$c'}, 'object']}, 'then': '$$c.x'},
+                {'case': {'$in': [{'$type': '$$c'}, ['int', 'long']]}, 'then': decoded},
+            ],
+            'default': '$$c',
+        }},
+    }}
+
+
+def migrate(db, survey, version=2, batch_size=1000):
+    """Rewrite the stored responses of one survey in ``version``. Returns the number converted."""
+    if version == 2:
+        query = {'survey_id': survey['_id'], 'v': {'$ne': 2}, 'answers': {'$type': 'object'}}
+    else:
+        query = {'survey_id': survey['_id'], 'v': 2}
+
+    converted = 0
+    batch = []
+    for r in db.responses.find(query, {'answers': 1, 'v': 1, 'a': 1, 'extra': 1}).batch_size(batch_size):
+        if version == 2:
+            update = {'$set': encode(survey, r['answers']), '$unset': {'answers': ''}}
+            guard = {'v': {'$ne': 2}}
+        else:
+            update = {'$set': {'answers': decode(survey, r)},
+                      '$unset': {'v': '', 'a': '', 'extra': ''}}
+            guard = {'v': 2}
+        # The guard makes a concurrent or repeated migration a no-op
+        batch.append(UpdateOne({'_id': r['_id'], **guard}, update))
+        if len(batch) == batch_size:
+            converted += db.responses.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        converted += db.responses.bulk_write(batch, ordered=False).modified_count
+    return converted
@@ -0,0 +1,156 @@
+"""
+Validation of submitted answers against the survey's questions.
+
+The ``questions`` of a survey (see QuestionSchema in validation.py) are
+compiled once into an ``AnswerValidator``: option lists are frozen into sets
+and every question gets the check of its type. Compiled validators are kept
+in a bounded LRU keyed by (survey id, survey version), so checking a
+submission costs a few dict / set lookups.
+
+Rules:
+- ``answers`` is an object keyed by question id; unknown ids are rejected
+- radio / select: one of the options
+- checkbox: a list of distinct options
+- rating: an integer in RATING_RANGE, as a number or a string of digits
+  (the web client sends "4"); normalized to an int
+- text: a string of at most MAX_TEXT_LENGTH characters
+- other types: any value
+- null, "" and [] mean unanswered (the web client resets a select to ""):
+  they are dropped before the type check, and fail required questions
+
+``validate`` returns the normalized answers: that is what gets stored and
+aggregated, so the stats code reads answers without re-checking them.
+Responses stored before validation existed go through ``sanitize`` instead
+(see answer_codec.answers_of), which drops the answers that would not pass.
+"""
+from cache import LRUCache
+
+RATING_RANGE = (1, 5)
+MAX_TEXT_LENGTH = 5000
+
+INVALID = object()
+UNANSWERED = (None, '', [])
+
+
+def _choice(options):
+    allowed = frozenset(options)
+
+    def check(ans):
+        return ans if isinstance(ans, str) and ans in allowed else INVALID
+    return check
+
+
+def _checkbox(options):
+    allowed = frozenset(options)
+
+    def check(ans):
+        if not isinstance(ans, list):
+            return INVALID
+        for item in ans:
+            if not isinstance(item, str) or item not in allowed:
+                return INVALID
+        return ans if len(set(ans)) == len(ans) else INVALID
+    return check
+
+
+def parse_rating(ans):
+    """The rating as an int, or INVALID."""
+    if isinstance(ans, str) and ans.isascii() and ans.isdigit():
+        ans = int(ans)
+    elif not isinstance(ans, int) or isinstance(ans, bool):
+        return INVALID
+    return ans if RATING_RANGE[0] <= ans <= RATING_RANGE[1] else INVALID
+
+
+def _text(ans):
+    return ans if isinstance(ans, str) else INVALID
+
+
+def _any(ans):
+    return ans
+
+
+def _compile(question):
+    q_type = question.get('type')
+    options = question.get('options') or []
+    if q_type in ('radio', 'select'):
+        return _choice(options)
+    if q_type == 'checkbox':
+        return _checkbox(options)
+    if q_type == 'rating':
+        return parse_rating
+    if q_type == 'text':
+        return _text
+    return _any
+
+
+def _error(q_id, msg):
+    return {"question": q_id, "msg": msg}
+
+
+class AnswerValidator:
+    def __init__(self, questions):
+        self.checks = {str(q.get('id')): _compile(q) for q in questions}
+        self.required = [str(q.get('id')) for q in questions if q.get('required')]
+
+    def validate(self, answers):
+        """Return (normalized answers, errors); errors is a list of {question, msg}."""
+        if not isinstance(answers, dict):
+            return None, [_error(None, "answers must be an object keyed by question id")]
+
+        clean, errors = {}, []
+        for q_id, ans in answers.items():
+            check = self.checks.get(q_id)
+            if check is None:
+                errors.append(_error(q_id, "Unknown question"))
+                continue
+            if ans in UNANSWERED:
+                continue
+            value = check(ans)
+            if value is INVALID:
+                errors.append(_error(q_id, "Invalid answer for this question"))
+            elif isinstance(value, str) and len(value) > MAX_TEXT_LENGTH:
+                errors.append(_error(q_id, f"Answer longer than {MAX_TEXT_LENGTH} characters"))
+            else:
+                clean[q_id] = value
+
+        for q_id in self.required:
+            if clean.get(q_id) in UNANSWERED:
+                errors.append(_error(q_id, "This question is required"))
+        return clean, errors
+
+    def clean(self, q_id, ans):
+        """The normalized answer, or INVALID (unknown question or unanswered included)."""
+        check = self.checks.get(q_id)
+        return INVALID if check is None or ans in UNANSWERED else check(ans)
+
+    def sanitize(self, answers):
+        """Keep only the answers that pass their question's check, normalized."""
+        if not isinstance(answers, dict):
+            return {}
+        clean = {}
+        for q_id, ans in answers.items():
+            value = self.clean(q_id, ans)
+            if value is not INVALID:
+                clean[q_id] = value
+        return clean
+
+
+# --- COMPILED VALIDATORS CACHE ---
+
+_validators = LRUCache(max_entries=1024, ttl=3600)
+
+
+def for_survey(survey):
+    """The compiled validator of a survey ({_id, questions, version})."""
+    # A survey's questions only change with its version, so entries never go stale
+    key = (str(survey['_id']), survey.get('version', 1))
+    validator = _validators.get(key)
+    if validator is None:
+        validator = AnswerValidator(survey.get('questions', []))
+        _validators.set(key, validator)
+    return validator
+
+
+def init_app(app):
+    _validators.max_entries = app.config.get('VALIDATOR_CACHE_SIZE', 1024)
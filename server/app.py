@@ -1,43 +1,212 @@
+import atexit
+import click
+from bson.objectid import ObjectId
 from flask import Flask, jsonify
 from flask_cors import CORS
-from flask_pymongo import PyMongo
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
+import answer_validation
+import auth_middleware
+import compression
+import json_provider
+import metrics
+import passwords
+import warmup
+from cache import make_cache
+from database import mongo
+from ingest import make_ingest_buffer
+from live import make_live_hub
+from reaper import make_reaper
 
-app = Flask(__name__)
-app.config.from_object(Config)
+def create_app(config=Config):
+    """
+    Build the app. Safe to run before a fork (gunicorn --preload): the MongoDB
+    client is per process (database.py) and background threads start in each
+    worker. Nothing here talks to MongoDB: indexes are created by
+    ``flask ensure-indexes`` and only checked by the warm-up. Shared components are in app.extensions: 'cache', 'live_hub',
+    'ingest_buffer' and 'reaper' (None when disabled).
+    """
+    warmup.mark_boot()
+    app = Flask(__name__)
+    app.config.from_object(config)
+    if app.config['PROXY_COUNT']:
+        # Client IP and scheme from the proxies' headers (login throttling, redirects)
+        proxies = app.config['PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
 
-# CORS Security: Allow only React frontend (port 3000)
-CORS(app, resources={r"/*": {"origins": "*"}}, 
-     allow_headers=["Content-Type", "Authorization"], 
-     methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
-mongo = PyMongo(app)
+    # CORS Security: Allow only React frontend (port 3000). Only the API: never /metrics
+    CORS(app, resources={r"/api/*": {"origins": "*"}}, 
+         allow_headers=["Content-Type", "Authorization"], 
+         methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
+    # Instrumentation first, so request timings include the other hooks
+    metrics.init_app(app)
+    mongo.init_app(app, event_listeners=[metrics.mongo_listener])
+    json_provider.init_app(app)
+    compression.init_app(app)
+    auth_middleware.init_app(app)
+    passwords.init_app(app)
+    answer_validation.init_app(app)
+    live_hub = make_live_hub(app.config, mongo.db)
+    ingest_buffer = make_ingest_buffer(app.config, mongo.db, on_inserted=live_hub.publish_local)
+    if ingest_buffer is not None:
+        atexit.register(ingest_buffer.close)
+    reaper = make_reaper(app.config, mongo.db)
+    if reaper is not None:
+        # Cheap pid check per request; starts the thread once in each worker
+        app.before_request(reaper.ensure_started)
+    app.extensions.update(cache=make_cache(app.config), live_hub=live_hub,
+                          ingest_buffer=ingest_buffer, reaper=reaper)
+
+    register_error_handlers(app)
+
+    # --- Register Blueprints (Routes) ---
+    from routes.auth import auth_bp
+    from routes.survey import survey_bp
+    from routes.public import public_bp
+
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(survey_bp, url_prefix='/api/surveys')
+    app.register_blueprint(public_bp, url_prefix='/api/public')
+
+    register_commands(app)
+
+    if app.config['WARM_UP']:
+        # Before the fork when preloaded: every worker shares the compiled models
+        warmup.compile_models()
+    return app
 
 # --- Global Error Handling ---
-@app.errorhandler(400)
-def bad_request(e):
-    # Returns a JSON error instead of HTML
-    return jsonify({"error": "Invalid request", "details": str(e.description)}), 400
+def register_error_handlers(app):
+    @app.errorhandler(400)
+    def bad_request(e):
+        # Returns a JSON error instead of HTML
+        return jsonify({"error": "Invalid request", "details": str(e.description)}), 400
+
+    @app.errorhandler(404)
+    def not_found(e):
+        return jsonify({"error": "Resource not found"}), 404
+
+    @app.errorhandler(403)
+    def forbidden(e):
+        return jsonify({"error": "Access forbidden"}), 403
+
+    @app.errorhandler(500)
+    def server_error(e):
+        return jsonify({"error": "Internal server error"}), 500
+
+# --- CLI Commands ---
+def register_commands(app):
+    @app.cli.command('rebuild-results')
+    @click.argument('survey_id', required=False)
+    @click.option('--ingest-paused', is_flag=True,
+                  help="Confirm that no response is being recorded for these surveys.")
+    def rebuild_results(survey_id, ingest_paused):
+        """
+        Recompute pre-aggregated results, time buckets and text answers from the raw responses.
+        All of them are replaced wholesale: responses recorded meanwhile would be lost or
+        counted twice, so stop ingestion (the API workers) first.
+        """
+        if not ingest_paused:
+            raise click.UsageError("Stop response ingestion first (the API workers, whose buffers flush "
+                                   "on exit), then pass --ingest-paused.")
+        import aggregates
+        import sampling
+        import text_search
+        import timeseries
+
+        query = {}
+        if survey_id:
+            if not ObjectId.is_valid(survey_id):
+                raise click.BadParameter("Invalid survey ID", param_hint='survey_id')
+            query['_id'] = ObjectId(survey_id)
+
+        count = 0
+        query['deleted_at'] = None
+        for survey in mongo.db.surveys.find(query, {'questions': 1, 'version': 1}):
+            doc = aggregates.rebuild(mongo.db, survey)
+            buckets = timeseries.rebuild(mongo.db, survey, app.config['TIMESERIES_HOURLY_DAYS'])
+            sampling.backfill(mongo.db, survey)
+            text_search.rebuild(mongo.db, survey)
+            click.echo(f"{survey['_id']}: {doc['total']} responses, {buckets} time buckets")
+            count += 1
+        click.echo(f"Rebuilt {count} survey(s).")
+
+    @app.cli.command('compact-timeseries')
+    def compact_timeseries_command():
+        """Fold the old hourly result buckets into daily ones now (see timeseries.py)."""
+        from timeseries import compact
+
+        compacted = compact(mongo.db, app.config['TIMESERIES_HOURLY_DAYS'])
+        click.echo(f"Compacted {compacted} hourly bucket(s).")
+
+    @app.cli.command('migrate-answers')
+    @click.argument('survey_id', required=False)
+    @click.option('--to', 'version', type=click.Choice(['1', '2']), default='2',
+                  help="Target format (1 to roll back).")
+    @click.option('--batch-size', default=1000, show_default=True)
+    def migrate_answers(survey_id, version, batch_size):
+        """Convert stored responses to another answer format (see answer_codec.py)."""
+        import answer_codec
+
+        query = {'deleted_at': None}
+        if survey_id:
+            if not ObjectId.is_valid(survey_id):
+                raise click.BadParameter("Invalid survey ID", param_hint='survey_id')
+            query['_id'] = ObjectId(survey_id)
+
+        total = 0
+        for survey in mongo.db.surveys.find(query, {'questions': 1, 'version': 1}):
+            converted = answer_codec.migrate(mongo.db, survey, int(version), batch_size)
+            if converted:
+                click.echo(f"{survey['_id']}: {converted} responses")
+            total += converted
+        click.echo(f"Converted {total} response(s) to format {version}.")
+
+    @app.cli.command('ensure-indexes')
+    def ensure_indexes_command():
+        """Create the indexes used by the API (idempotent). Run it at deploy, before the workers start."""
+        from indexes import ensure_indexes
+
+        for name in ensure_indexes(mongo.db):
+            click.echo(f"ok: {name}")
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Fail if any query issued by the blueprints resolves to a COLLSCAN."""
+        from indexes import explain_queries
+
+        failed = False
+        for label, stages in explain_queries(mongo.db):
+            status = "COLLSCAN" if 'COLLSCAN' in stages else "ok"
+            failed = failed or status == "COLLSCAN"
+            click.echo(f"{status}: {label} ({' > '.join(stages)})")
+        if failed:
+            raise SystemExit(1)
 
-@app.errorhandler(404)
-def not_found(e):
-    return jsonify({"error": "Resource not found"}), 404
+    @app.cli.command('reap-deleted-surveys')
+    def reap_deleted_surveys_command():
+        """
+        Delete the responses of tombstoned surveys now (instead of the background reaper).
+        Run it again REAPER_SWEEP_DELAY_SECONDS later for the final sweep.
+        """
+        from reaper import reap_all
 
-@app.errorhandler(403)
-def forbidden(e):
-    return jsonify({"error": "Access forbidden"}), 403
+        done = reap_all(mongo.db, app.config['REAPER_BATCH_SIZE'], app.config['REAPER_PAUSE_SECONDS'],
+                        app.config['REAPER_SWEEP_DELAY_SECONDS'])
+        click.echo(f"Finished {done} deletion pass(es).")
 
-@app.errorhandler(500)
-def server_error(e):
-    return jsonify({"error": "Internal server error"}), 500
+    @app.cli.command('replay-ingest-wal')
+    def replay_ingest_wal_command():
+        """Commit the buffered responses left in INGEST_WAL_DIR by crashed workers."""
+        from ingest import replay_orphans
 
-# --- Register Blueprints (Routes) ---
-from routes.auth import auth_bp
-from routes.survey import survey_bp
-from routes.public import public_bp
+        wal_dir = app.config['INGEST_WAL_DIR']
+        if not wal_dir:
+            raise click.UsageError("INGEST_WAL_DIR is not set")
+        click.echo(f"Inserted {replay_orphans(mongo.db, wal_dir)} response(s).")
 
-app.register_blueprint(auth_bp, url_prefix='/api/auth')
-app.register_blueprint(survey_bp, url_prefix='/api/surveys')
-app.register_blueprint(public_bp, url_prefix='/api/public')
+app = create_app()
 
 if __name__ == '__main__':
-    app.run(port=5000)
\ No newline at end of file
+    warmup.warm_up(app)
+    app.run(port=5000)
@@ -0,0 +1,400 @@
+"""
+ASGI entry point: the public survey endpoints on an asyncio event loop.
+
+    uvicorn asgi:app --workers 4        # any ASGI server (not in requirements.txt)
+
+GET /api/public/surveys/<id> and POST /api/public/surveys/<id>/respond are
+served natively with PyMongo's asyncio client (``pymongo.AsyncMongoClient``):
+while one survey taker waits on MongoDB, the worker serves the others,
+instead of holding a thread per request. Routes, JSON bodies, status codes,
+ETag / 304 and auth behave as in routes/public.py, whose helpers are shared.
+
+Every other request goes to the Flask app (the rest of the API), run in a
+pool of ASGI_WSGI_THREADS threads; streamed responses (live results,
+exports) are forwarded chunk by chunk. The published surveys cache, the
+ingest buffer and the live hub are those of the Flask app of the same
+process.
+
+Compare both modes with benchmarks/async_concurrency.py.
+"""
+import asyncio
+import contextvars
+import datetime
+import io
+import json
+import logging
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson.objectid import ObjectId
+from pymongo import AsyncMongoClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from werkzeug.http import http_date, quote_etag
+from werkzeug.sansio.http import is_resource_modified
+
+import aggregates
+import auth_middleware
+import compression
+import metrics
+import text_search
+import timeseries
+import warmup
+from app import app as flask_app
+from cache import public_survey_key
+from ingest import BufferFull
+from json_provider import dumps_bytes
+from reaper import ACTIVE
+from routes.public import AUTH_ERRORS, PUBLIC_SURVEY_PROJECTION, prepare_response, public_entry
+
+logger = logging.getLogger(__name__)
+
+SURVEY_PATH = re.compile(r'^/api/public/surveys/([^/]+)$')
+RESPOND_PATH = re.compile(r'^/api/public/surveys/([^/]+)/respond$')
+
+cache = flask_app.extensions['cache']
+ingest_buffer = flask_app.extensions['ingest_buffer']
+live_hub = flask_app.extensions['live_hub']
+
+_wsgi_pool = ThreadPoolExecutor(max_workers=flask_app.config['ASGI_WSGI_THREADS'],
+                                thread_name_prefix='asgi-wsgi')
+_client = None
+
+
+def get_db():
+    """The asyncio database handle, created inside the running event loop."""
+    global _client
+    if _client is None:
+        _client = AsyncMongoClient(flask_app.config['MONGO_URI'],
+                                   minPoolSize=flask_app.config['MONGO_MIN_POOL_SIZE'],
+                                   event_listeners=[metrics.mongo_listener])
+    return _client.get_default_database()
+
+
+# --- RESPONSES ---
+
+class Response:
+    def __init__(self, body=b'', status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+
+    async def send(self, send, request_headers):
+        headers = dict(self.headers)
+        body = self.body
+        if request_headers.get('origin'):
+            headers['Access-Control-Allow-Origin'] = '*'  # same policy as flask_cors in app.py
+
+        # Same rules as compression.init_app for the Flask routes
+        content_type = headers.get('Content-Type')
+        if body and content_type in compression.COMPRESSIBLE_TYPES:
+            headers['Vary'] = ', '.join(filter(None, [headers.get('Vary'), 'Accept-Encoding']))
+            algorithm = compression.encoding_for(request_headers.get('accept-encoding'), content_type, len(body))
+            if algorithm is not None:
+                body = compression.compress(body, algorithm)
+                headers['Content-Encoding'] = algorithm
+                if 'ETag' in headers:
+                    headers['ETag'] = compression.weak_etag(headers['ETag'])
+        headers['Content-Length'] = str(len(body))
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def json_response(obj, status=200):
+    # Same bytes as flask.jsonify (see json_provider.py)
+    return Response(dumps_bytes(obj), status, {'Content-Type': 'application/json'})
+
+
+# --- AUTH (same rules as auth_middleware.load_auth) ---
+
+def authenticate(headers):
+    """Return (user_id, error): error is None, 'expired' or 'invalid'."""
+    token = auth_middleware.parse_bearer(headers.get('authorization'))
+    if not token:
+        return None, None
+    claims, error = auth_middleware.authenticate(token, flask_app.config['SECRET_KEY'])
+    return (claims['user_id'] if claims else None), error
+
+
+async def load_public_survey(db, survey_id):
+    """Async twin of routes.public.load_public_survey, same cache entries."""
+    key = public_survey_key(survey_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    survey = await db.surveys.find_one({'_id': ObjectId(survey_id), **ACTIVE}, PUBLIC_SURVEY_PROJECTION)
+    if not survey:
+        return None
+    entry = public_entry(survey)
+    cache.set(key, json.dumps(entry))
+    return entry
+
+
+# --- NATIVE ROUTES ---
+
+async def get_public_survey(request_headers, survey_id):
+    user_id, _ = authenticate(request_headers)  # anonymous visitors may view the survey
+
+    if not ObjectId.is_valid(survey_id):
+        return json_response({"error": "Invalid Survey ID"}, 400)
+
+    db = get_db()
+    entry = await load_public_survey(db, survey_id)
+    if not entry:
+        return json_response({"error": "Survey not found"}, 404)
+
+    has_responded = False
+    if user_id:
+        has_responded = await db.responses.find_one(
+            {'survey_id': ObjectId(survey_id), 'user_id': str(user_id)},
+            {'_id': 0, 'user_id': 1}
+        ) is not None
+
+    etag = entry['etag'] + ('-r' if has_responded else '')
+    headers = {
+        'Content-Type': 'application/json',
+        'ETag': quote_etag(etag),
+        'Cache-Control': 'private, no-cache',
+        'Vary': 'Authorization',
+    }
+    last_modified = None
+    if entry['last_modified']:
+        last_modified = datetime.datetime.fromtimestamp(entry['last_modified'], datetime.timezone.utc)
+        headers['Last-Modified'] = http_date(last_modified)
+
+    if not is_resource_modified(
+            http_if_none_match=request_headers.get('if-none-match'),
+            http_if_modified_since=request_headers.get('if-modified-since'),
+            etag=etag, last_modified=last_modified):
+        return Response(b'', 304, headers)
+
+    body = dumps_bytes(dict(entry['payload'], has_responded=has_responded))
+    return Response(body, 200, headers)
+
+
+async def submit_response(request_headers, survey_id, body):
+    user_id, auth_error = authenticate(request_headers)
+    if auth_error:
+        return json_response(AUTH_ERRORS[auth_error], 401)
+    if not user_id:
+        return json_response({"error": "Authentication required"}, 401)
+
+    if not ObjectId.is_valid(survey_id):
+        return json_response({"error": "Invalid ID"}, 400)
+
+    if not request_headers.get('content-type', '').startswith('application/json'):
+        return json_response({"error": "Invalid request", "details": "Expected a JSON body"}, 415)
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return json_response({"error": "Invalid request", "details": "Invalid JSON body"}, 400)
+
+    db = get_db()
+    entry = await load_public_survey(db, survey_id)
+    if not entry:
+        return json_response({"error": "Survey not found"}, 404)
+
+    prepared, error = prepare_response(entry, survey_id, user_id, data,
+                                       flask_app.config['ANSWER_FORMAT'])
+    if error:
+        return json_response(*error)
+    survey, answers, response_doc = prepared
+
+    update = aggregates.build_update(survey, answers)
+    if ingest_buffer is not None:
+        try:
+            # The write-ahead log may fsync: keep it off the event loop
+            await asyncio.to_thread(ingest_buffer.enqueue, response_doc, update)
+        except BufferFull:
+            return json_response({"error": "Too many submissions, please retry shortly"}, 503)
+        return json_response({"message": "Response accepted"}, 202)
+
+    try:
+        await db.responses.insert_one(response_doc)
+    except DuplicateKeyError:
+        return json_response({"error": "You have already responded to this survey"}, 409)
+
+    # The cache may still hold a survey deleted since: count the response only
+    # while the survey is active, else take it back
+    counted = await db.surveys.update_one({'_id': survey['_id'], **ACTIVE}, {'$inc': {'response_count': 1}})
+    if counted.matched_count == 0:
+        await db.responses.delete_one({'_id': response_doc['_id']})
+        cache.delete(public_survey_key(survey_id))
+        return json_response({"error": "Survey not found"}, 404)
+
+    writes = [
+        db.survey_stats.update_one({'_id': survey['_id']}, update, upsert=True),
+        db.survey_timeseries.update_one(
+            timeseries.bucket_filter(survey['_id'], timeseries.bucket_start(response_doc['submitted_at'])),
+            update, upsert=True),
+    ]
+    texts = text_search.documents(response_doc, update)
+    if texts:
+        writes.append(db.text_answers.insert_many(texts, ordered=False))
+    await asyncio.gather(*writes)
+    live_hub.publish_local(response_doc)
+    return json_response({"message": "Response recorded successfully"}, 201)
+
+
+def route(method, path):
+    """(endpoint name, handler, survey id) of a native route, or None."""
+    match = SURVEY_PATH.match(path)
+    if match and method == 'GET':
+        return 'public.get_public_survey', get_public_survey, match.group(1)
+    match = RESPOND_PATH.match(path)
+    if match and method == 'POST':
+        return 'public.submit_response', submit_response, match.group(1)
+    return None
+
+
+# --- WSGI BRIDGE (every other route) ---
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def call_wsgi(scope, body, receive, send):
+    loop = asyncio.get_running_loop()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    # Every step runs in the same context: stream_with_context keeps Flask's
+    # request context (context variables) open between two chunks
+    context = contextvars.copy_context()
+
+    def step(fn, *args):
+        return loop.run_in_executor(_wsgi_pool, context.run, fn, *args)
+
+    result = await step(flask_app, _environ(scope, body), start_response)
+    iterator = iter(result)
+
+    # Stop pulling a stream (live results) as soon as the client goes away
+    disconnected = asyncio.Event()
+
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+    watcher = asyncio.create_task(watch())
+
+    try:
+        response_started = False
+        while not disconnected.is_set():
+            chunk = await step(next, iterator, None)
+            if not response_started:
+                await send({'type': 'http.response.start', 'status': started['status'],
+                            'headers': started['headers']})
+                response_started = True
+            if chunk is None:
+                await send({'type': 'http.response.body', 'body': b''})
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        watcher.cancel()
+        close = getattr(result, 'close', None)
+        if close is not None:
+            await step(close)
+
+
+# --- ASGI APPLICATION ---
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def close_db():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Before the server accepts requests (see warmup.py), then this loop's own client
+            await asyncio.to_thread(warmup.warm_up, flask_app)
+            if flask_app.config['WARM_UP']:
+                try:
+                    await get_db().command('ping')
+                except PyMongoError as e:
+                    logger.warning("Could not connect the asyncio MongoDB client: %s", e)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_db()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive)
+    native = route(scope['method'], scope['path'])
+    if native is None:
+        return await call_wsgi(scope, body, receive, send)
+
+    endpoint, handler, survey_id = native
+    started = time.perf_counter()
+    headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope['headers']}
+    try:
+        if handler is submit_response:
+            response = await handler(headers, survey_id, body)
+        else:
+            response = await handler(headers, survey_id)
+    except Exception:
+        # Same body as the Flask routes' 500 handler (app.register_error_handlers)
+        logger.exception("Unhandled error in %s", endpoint)
+        response = json_response({"error": "Internal server error"}, 500)
+    metrics.observe_request((
+        ('blueprint', 'public'),
+        ('endpoint', endpoint),
+        ('method', scope['method']),
+        ('status', response.status),
+    ), time.perf_counter() - started)
+    await response.send(send, headers)
@@ -0,0 +1,125 @@
+"""
+Authentication context shared by every blueprint.
+
+``load_auth`` runs before each request, reads the Bearer token once and puts
+the result on ``g``:
+
+- ``g.user_id``: the authenticated user id, or None
+- ``g.auth_claims``: the decoded JWT claims, or None
+- ``g.auth_error``: None, 'expired' or 'invalid' (a token was sent but rejected)
+
+Decoded claims are cached in a bounded LRU keyed by the SHA-256 digest of the
+token, until the token's ``exp``, so the HMAC verification runs once per
+distinct token instead of once per request.
+
+The decorators of the blueprints (token_required, anonymous_required...)
+only read ``g``.
+"""
+import hashlib
+import logging
+import time
+
+import jwt
+from flask import request, g, current_app
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class ClaimsCache(LRUCache):
+    """LRU of decoded claims, each entry kept until the token's ``exp``."""
+
+    def __init__(self, max_entries=4096):
+        super().__init__(max_entries=max_entries)
+
+    def set(self, key, claims):
+        super().set(key, claims, ttl=claims['exp'] - time.time())
+
+
+_claims_cache = ClaimsCache()
+
+
+def decode_token(token, secret, cache=_claims_cache):
+    """
+    Verify a JWT and return its claims, using the cache when possible.
+    Raises jwt.ExpiredSignatureError / jwt.InvalidTokenError like jwt.decode.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    claims = cache.get(key)
+    if claims is not None:
+        return claims
+
+    claims = jwt.decode(token, secret, algorithms=['HS256'])
+    if 'user_id' not in claims:
+        raise jwt.InvalidTokenError("Missing user_id claim")
+    # Only tokens that expire are cached (every token issued by /login does)
+    if isinstance(claims.get('exp'), (int, float)):
+        cache.set(key, claims)
+    return claims
+
+
+# --- Rate-limited logging (the hot path must not flood the logs) ---
+
+_last_logged = {}
+_LOG_INTERVAL = 10.0  # seconds between two identical messages
+
+
+def _log_limited(level, key, msg, *args):
+    if not logger.isEnabledFor(level):
+        return
+    now = time.monotonic()
+    if now - _last_logged.get(key, 0) < _LOG_INTERVAL:
+        return
+    _last_logged[key] = now
+    logger.log(level, msg, *args)
+
+
+def parse_bearer(auth_header):
+    """Return the token of an 'Authorization: Bearer <token>' header value, or None."""
+    if not auth_header:
+        return None
+    parts = auth_header.split(" ")
+    if len(parts) != 2 or parts[0].lower() != 'bearer':
+        _log_limited(logging.DEBUG, 'malformed', "Malformed Authorization header")
+        return None
+    return parts[1]
+
+
+def bearer_token():
+    """Return the token of the current request, or None."""
+    auth_header = request.headers.get('Authorization')
+    # EventSource cannot send headers: live streams pass ?access_token=
+    if not auth_header and request.accept_mimetypes.best == 'text/event-stream':
+        return request.args.get('access_token')
+    return parse_bearer(auth_header)
+
+
+def authenticate(token, secret):
+    """Return (claims, error) for a token; error is None, 'expired' or 'invalid'."""
+    try:
+        return decode_token(token, secret), None
+    except jwt.ExpiredSignatureError:
+        _log_limited(logging.DEBUG, 'expired', "Expired token")
+        return None, 'expired'
+    except jwt.InvalidTokenError as e:
+        _log_limited(logging.INFO, 'invalid', "Invalid token: %s", e)
+        return None, 'invalid'
+
+
+def load_auth():
+    g.user_id, g.auth_claims, g.auth_error = None, None, None
+
+    token = bearer_token()
+    if not token:
+        return
+
+    claims, g.auth_error = authenticate(token, current_app.config['SECRET_KEY'])
+    if claims is not None:
+        g.auth_claims = claims
+        g.user_id = claims['user_id']
+
+
+def init_app(app):
+    _claims_cache.max_entries = app.config.get('AUTH_CACHE_SIZE', 4096)
+    app.before_request(load_auth)
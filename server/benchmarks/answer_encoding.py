@@ -0,0 +1,116 @@
+"""
+Size and scan speed of stored responses, answer format 1 vs 2.
+
+Run from server/:
+    python -m benchmarks.answer_encoding --db memory [--responses 20000] [--questions 10]
+    python -m benchmarks.answer_encoding --db mongo --mongo-uri mongodb://localhost:27017/survey_bench
+
+Seeds one survey with responses in format 1 ({question id: value}), measures
+the average BSON size of a response and the time to compute its results from
+the raw responses (results_engine.compute), converts the responses with
+answer_codec.migrate, then measures again. With --db mongo the collection's
+storage size is reported too and results use the $facet pipeline; with
+--db memory (the optional ``mongomock`` package) only the Python single pass
+is measured.
+
+Measured on the seed data (10 questions cycling radio, checkbox, rating,
+text, select; 4 options of 8 characters), BSON bytes per response:
+
+                 answers only    whole document
+    format 1          255              356
+    format 2          138              238       (-46% / -33%)
+
+Text answers are stored as is, so surveys made mostly of free text shrink
+less, and surveys with long option labels shrink more. Aggregation timings
+depend on the server's cache and disks: run with --db mongo on the target
+deployment (the in-memory stand-in only exercises the Python single pass).
+"""
+import argparse
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit
+
+import bson
+
+import answer_codec
+import results_engine
+from benchmarks.seed import seed
+
+DEFAULT_MONGO_URI = 'mongodb://localhost:27017/survey_bench'
+
+
+def measure(db, survey, engine, repeat):
+    sizes = [len(bson.encode(r)) for r in db.responses.find({'survey_id': survey['_id']})]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results_engine.compute(db, survey, engine=engine)
+        timings.append(time.perf_counter() - start)
+
+    report = {
+        'avg_bytes': statistics.mean(sizes),
+        'results_ms': statistics.median(timings) * 1000,
+    }
+    if engine == 'pipeline':
+        report['storage_bytes'] = db.command('collStats', 'responses')['size']
+    return report
+
+
+def print_report(label, report):
+    line = f"{label:<10} {report['avg_bytes']:8.0f} bytes/response  results {report['results_ms']:8.1f} ms"
+    if 'storage_bytes' in report:
+        line += f"  collection {report['storage_bytes'] / 1e6:.1f} MB"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', choices=['memory', 'mongo'], default='memory')
+    parser.add_argument('--mongo-uri', default=DEFAULT_MONGO_URI)
+    parser.add_argument('--responses', type=int, default=20000)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.db == 'memory':
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--db memory requires the 'mongomock' package")
+        db = mongomock.MongoClient().survey_bench
+        engine = 'python'
+    else:
+        from pymongo import MongoClient
+        if 'bench' not in urlsplit(args.mongo_uri).path:
+            sys.exit("Refusing to drop a database whose name does not contain 'bench'")
+        db = MongoClient(args.mongo_uri).get_default_database()
+        engine = 'pipeline'
+
+    def seed_survey(answer_format):
+        db.client.drop_database(db.name)
+        handles = seed(db, 'benchmark-secret', users=args.responses + 1, surveys=1,
+                       questions=args.questions, responses=args.responses,
+                       answer_format=answer_format)
+        return db.surveys.find_one({'_id': bson.ObjectId(handles['survey_ids'][0])})
+
+    survey = seed_survey(1)
+    before = measure(db, survey, engine, args.repeat)
+    print_report("format 1", before)
+
+    if args.db == 'mongo':
+        start = time.perf_counter()
+        converted = answer_codec.migrate(db, survey, 2)
+        print(f"migrated {converted} responses in {time.perf_counter() - start:.2f} s")
+    else:
+        # mongomock's bulk_write does not support current PyMongo: seed the same data again
+        survey = seed_survey(2)
+
+    after = measure(db, survey, engine, args.repeat)
+    print_report("format 2", after)
+    print(f"size: {after['avg_bytes'] / before['avg_bytes'] - 1:+.0%}, "
+          f"results: {after['results_ms'] / before['results_ms'] - 1:+.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Concurrency scaling of the public endpoints: threaded WSGI vs ASGI (asgi.py).
+
+Needs a real MongoDB (PyMongo's asyncio client has no in-memory stand-in).
+Run from server/:
+    python -m benchmarks.async_concurrency --mongo-uri mongodb://localhost:27017/survey_bench
+
+The process is pinned to one CPU core. For each concurrency level, that many
+closed-loop clients send GET /api/public/surveys/<id> (as a logged-in
+respondent) and POST .../respond (a fresh respondent each time):
+
+- wsgi: the Flask app with --threads request threads, like one
+  ``gunicorn -w 1 --threads N`` worker; extra clients queue for a thread.
+- asgi: ``asgi.app`` on one event loop, like one ``uvicorn`` worker.
+
+Both are called in-process, so HTTP parsing is left out for both. Reports
+throughput and p50/p95 latency (queueing included) per mode and level.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+from bson.objectid import ObjectId
+
+from benchmarks.harness import DEFAULT_MONGO_URI, setup_database, summarize
+from benchmarks.seed import make_token
+
+
+def make_requests(handles):
+    """Return a function producing the next (method, path, body, headers) of the mix."""
+    rnd = random.Random(7)
+    survey_ids = handles['survey_ids']
+
+    def next_request():
+        survey_id = rnd.choice(survey_ids)
+        token = make_token(ObjectId(), handles['secret'])
+        headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+        if rnd.random() < 0.5:
+            return 'GET', f'/api/public/surveys/{survey_id}', None, headers
+        body = {'answers': {'1': 'Option A', '3': 4, '4': 'Benchmark answer'}}
+        return 'POST', f'/api/public/surveys/{survey_id}/respond', body, headers
+    return next_request
+
+
+def run_wsgi(app, next_request, concurrency, requests, threads):
+    slots = threading.Semaphore(threads)  # the worker's request threads
+    lock = threading.Lock()
+    latencies, errors, remaining = [], [0], [requests]
+
+    def client():
+        http = app.test_client()
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+                method, path, body, headers = next_request()
+            t0 = time.perf_counter()
+            with slots:
+                resp = http.open(path, method=method, json=body, headers=headers)
+                resp.get_data()
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+                errors[0] += resp.status_code >= 400
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    return latencies, time.perf_counter() - start, None, errors[0]
+
+
+async def _asgi_call(asgi_app, method, path, body, headers):
+    payload = json.dumps(body).encode() if body is not None else b''
+    messages = [{'type': 'http.request', 'body': payload}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'root_path': '',
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        'scheme': 'http', 'http_version': '1.1', 'server': ('bench', 80), 'client': ('127.0.0.1', 0),
+    }
+    await asgi_app(scope, receive, send)
+    return status[0]
+
+
+def run_asgi(asgi_module, next_request, concurrency, requests):
+    latencies, errors, remaining = [], [0], [requests]
+
+    async def client():
+        while remaining[0]:
+            remaining[0] -= 1
+            method, path, body, headers = next_request()
+            t0 = time.perf_counter()
+            status = await _asgi_call(asgi_module.app, method, path, body, headers)
+            latencies.append(time.perf_counter() - t0)
+            errors[0] += status >= 400
+
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await asgi_module.close_db()  # the client is bound to this event loop
+        return elapsed
+
+    elapsed = asyncio.run(main())
+    return latencies, elapsed, None, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mongo-uri', default=DEFAULT_MONGO_URI)
+    parser.add_argument('--concurrency', default='1,8,32,128', help="comma-separated levels")
+    parser.add_argument('--requests', type=int, default=2000, help="per mode and level")
+    parser.add_argument('--threads', type=int, default=8, help="WSGI request threads")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--surveys', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--responses', type=int, default=50, help="per survey")
+    args = parser.parse_args()
+    args.db = 'mongo'
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+    app_module, handles, _ = setup_database(args)
+    import asgi
+
+    next_request = make_requests(handles)
+    print(f"{'mode':<6}{'clients':>8}{'req/s':>10}{'p50':>10}{'p95':>10}{'err':>6}")
+    for level in [int(c) for c in args.concurrency.split(',')]:
+        for mode in ('wsgi', 'asgi'):
+            if mode == 'wsgi':
+                result = run_wsgi(app_module.app, next_request, level, args.requests, args.threads)
+            else:
+                result = run_asgi(asgi, next_request, level, args.requests)
+            s = summarize(*result)
+            print(f"{mode:<6}{level:>8}{s['throughput_rps']:>10.1f}{s['p50_ms']:>10.2f}"
+                  f"{s['p95_ms']:>10.2f}{s['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
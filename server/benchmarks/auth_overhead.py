@@ -0,0 +1,54 @@
+"""
+Per-request authentication overhead, before and after the claims cache.
+
+Run from server/:
+    python -m benchmarks.auth_overhead [--requests 20000] [--users 100]
+
+"before" verifies the token with jwt.decode on every request (the old
+token_required / get_user_id_from_token). "after" goes through
+auth_middleware.decode_token, where each distinct token is verified once.
+"""
+import argparse
+import datetime
+import time
+
+import jwt
+
+from auth_middleware import ClaimsCache, decode_token
+
+SECRET = 'benchmark-secret'
+
+
+def make_tokens(users):
+    exp = datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+    return [jwt.encode({'user_id': f'user-{i}', 'exp': exp}, SECRET, algorithm='HS256')
+            for i in range(users)]
+
+
+def run(label, fn, tokens, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        fn(tokens[i % len(tokens)])
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / requests * 1e6:8.2f} us/request")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=100, help="distinct tokens in rotation")
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.users)
+    cache = ClaimsCache(max_entries=max(args.users, 1))
+
+    before = run("before: jwt.decode", lambda t: jwt.decode(t, SECRET, algorithms=['HS256']),
+                 tokens, args.requests)
+    after = run("after: cached decode_token", lambda t: decode_token(t, SECRET, cache),
+                tokens, args.requests)
+    print(f"speedup: x{before / after:.1f}")
+
+
+if __name__ == '__main__':
+    main()
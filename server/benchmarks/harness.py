@@ -0,0 +1,284 @@
+"""
+Benchmark harness for the Flask API.
+
+Drivers:
+- client (default): drives the real blueprints (auth_bp, survey_bp, public_bp)
+  through app.test_client(), one request at a time. The database is either the
+  in-memory stand-in (--db memory, needs the optional ``mongomock`` package)
+  or a real MongoDB (--db mongo). With --db mongo, the MongoDB round trips of
+  each request are counted through PyMongo command monitoring.
+- http: concurrent load generator against a running server, e.g.
+      gunicorn -w 4 -b 127.0.0.1:8000 app:app
+  started with MONGO_URI pointing at the same database as --mongo-uri.
+
+The benchmark database is dropped and re-seeded on every run; its name must
+contain 'bench'.
+
+Reports p50/p95/p99 latency (ms), throughput (req/s) and Mongo round trips per
+request for each endpoint. --save-baseline writes them to a JSON file;
+--compare reads one back and exits 1 when the p95 of get_results,
+submit_response or get_my_surveys regressed by more than --tolerance.
+
+Run from server/:
+    python -m benchmarks.harness --db memory --requests 200
+    python -m benchmarks.harness --db mongo --save-baseline benchmarks/baseline.json
+    python -m benchmarks.harness --db mongo --compare benchmarks/baseline.json
+    python -m benchmarks.harness --driver http --url http://127.0.0.1:8000 --concurrency 32
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from bson.objectid import ObjectId
+from pymongo import monitoring
+
+WATCHED_ENDPOINTS = ['survey.get_results', 'public.submit_response', 'survey.get_my_surveys']
+DEFAULT_MONGO_URI = 'mongodb://localhost:27017/survey_bench'
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts the MongoDB commands sent by this process."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# --- SCENARIOS ---
+
+def scenarios(handles, rnd):
+    """endpoint -> function returning (method, path, json body, headers)."""
+    from benchmarks.seed import make_token
+
+    owner = {'Authorization': f"Bearer {handles['owner_token']}"}
+    survey_ids = handles['survey_ids']
+
+    def my_surveys():
+        return 'GET', '/api/surveys/', None, owner
+
+    def results():
+        return 'GET', f'/api/surveys/{rnd.choice(survey_ids)}/results', None, owner
+
+    def public_survey():
+        return 'GET', f'/api/public/surveys/{rnd.choice(survey_ids)}', None, {}
+
+    def submit():
+        # A fresh respondent every time: the (survey_id, user_id) index is unique
+        token = make_token(ObjectId(), handles['secret'])
+        body = {'answers': {'1': 'Option A', '3': 4, '4': 'Benchmark answer'}}
+        return ('POST', f'/api/public/surveys/{rnd.choice(survey_ids)}/respond', body,
+                {'Authorization': f'Bearer {token}'})
+
+    def login():
+        body = {'email': handles['owner_email'], 'password': handles['password']}
+        return 'POST', '/api/auth/login', body, {}
+
+    return {
+        'survey.get_my_surveys': my_surveys,
+        'survey.get_results': results,
+        'public.get_public_survey': public_survey,
+        'public.submit_response': submit,
+        'auth.login': login,
+    }
+
+
+# --- DRIVERS ---
+
+def run_client(client, make_request, requests, counter):
+    latencies, round_trips, errors = [], 0, 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        method, path, body, headers = make_request()
+        before = counter.count if counter else 0
+        t0 = time.perf_counter()
+        resp = client.open(path, method=method, json=body, headers=headers)
+        resp.get_data()
+        latencies.append(time.perf_counter() - t0)
+        round_trips += (counter.count - before) if counter else 0
+        errors += resp.status_code >= 400
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed, (round_trips / requests if counter else None), errors
+
+
+def run_http(base_url, make_request, requests, concurrency):
+    url = urlsplit(base_url)
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def one(_):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        method, path, body, headers = make_request()
+        headers = dict(headers, **{'Content-Type': 'application/json'})
+        payload = json.dumps(body) if body is not None else None
+        t0 = time.perf_counter()
+        try:
+            local.conn.request(method, path, body=payload, headers=headers)
+            resp = local.conn.getresponse()
+            resp.read()
+            failed = resp.status >= 400
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            del local.conn
+            failed = True
+        latency = time.perf_counter() - t0
+        with lock:
+            latencies.append(latency)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return latencies, time.perf_counter() - start, None, errors[0]
+
+
+# --- REPORTING ---
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, round_trips, errors):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+        'mongo_round_trips': round(round_trips, 2) if round_trips is not None else None,
+    }
+
+
+def print_report(report):
+    print(f"{'endpoint':<28}{'n':>7}{'err':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'req/s':>10}{'mongo':>8}")
+    for endpoint, s in report.items():
+        trips = '-' if s['mongo_round_trips'] is None else f"{s['mongo_round_trips']:.1f}"
+        print(f"{endpoint:<28}{s['requests']:>7}{s['errors']:>6}{s['p50_ms']:>10.2f}"
+              f"{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['throughput_rps']:>10.1f}{trips:>8}")
+
+
+def compare(report, baseline, tolerance):
+    """Return the list of regressions on the watched endpoints."""
+    regressions = []
+    for endpoint in WATCHED_ENDPOINTS:
+        if endpoint not in report or endpoint not in baseline:
+            continue
+        before, after = baseline[endpoint]['p95_ms'], report[endpoint]['p95_ms']
+        if before and after > before * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {before:.2f} ms -> {after:.2f} ms")
+    return regressions
+
+
+# --- SETUP ---
+
+def setup_database(args):
+    """Point the app at the benchmark database, seed it, return (app module, handles, counter)."""
+    if 'bench' not in urlsplit(args.mongo_uri).path:
+        sys.exit("Refusing to drop a database whose name does not contain 'bench'")
+
+    counter = None
+    os.environ['MONGO_URI'] = args.mongo_uri
+    os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+    if args.db != 'memory':
+        # Must be registered before the app creates its MongoClient
+        counter = CommandCounter()
+        monitoring.register(counter)
+
+    import app as app_module
+    from benchmarks.seed import seed
+    from indexes import ensure_indexes
+
+    if args.db == 'memory':
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--db memory requires the 'mongomock' package")
+        app_module.mongo.db = mongomock.MongoClient().survey_bench
+
+    db = app_module.mongo.db
+    db.client.drop_database(db.name)
+    ensure_indexes(db)
+    handles = seed(db, app_module.app.config['SECRET_KEY'], users=args.users,
+                   surveys=args.surveys, questions=args.questions, responses=args.responses)
+    return app_module, handles, counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the survey API")
+    parser.add_argument('--driver', choices=['client', 'http'], default='client')
+    parser.add_argument('--db', choices=['memory', 'mongo'], default='memory')
+    parser.add_argument('--mongo-uri', default=DEFAULT_MONGO_URI)
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="http driver target")
+    parser.add_argument('--concurrency', type=int, default=16, help="http driver threads")
+    parser.add_argument('--requests', type=int, default=500, help="per endpoint")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--surveys', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--responses', type=int, default=1000, help="per survey")
+    parser.add_argument('--endpoints', help="comma-separated subset to run")
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed p95 slowdown before --compare fails (0.25 = +25%%)")
+    args = parser.parse_args()
+
+    if args.driver == 'http':
+        args.db = 'mongo'  # the server reads the seeded data from MongoDB
+    app_module, handles, counter = setup_database(args)
+
+    rnd = random.Random(1)
+    selected = scenarios(handles, rnd)
+    if args.endpoints:
+        selected = {k: v for k, v in selected.items() if k in args.endpoints.split(',')}
+
+    report = {}
+    for endpoint, make_request in selected.items():
+        # Logins are deliberately expensive (password hashing): run fewer
+        requests = max(1, args.requests // 10) if endpoint == 'auth.login' else args.requests
+        if args.driver == 'client':
+            result = run_client(app_module.app.test_client(), make_request, requests, counter)
+        else:
+            result = run_http(args.url, make_request, requests, args.concurrency)
+        report[endpoint] = summarize(*result)
+
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+JSON encoding time and bytes on the wire of large API responses.
+
+Run from server/ (no database needed):
+    python -m benchmarks.json_compression [--surveys 2000] [--questions 50] [--responses 20000]
+
+Builds two payloads shaped like the API's largest responses, from seed-like
+data: a survey list (GET /api/surveys/?fields=title,questions) and the
+results of one survey (GET /api/surveys/<id>/results). Each is encoded by:
+
+- bson-json: the former path, flask_pymongo's BSONProvider (bson.json_util,
+  relaxed mode) after the handlers' copies converting ObjectIds to strings;
+- json: json_provider with the standard library encoder;
+- orjson: json_provider with orjson (when installed).
+
+then compressed by every algorithm compression.py supports here.
+
+Measured here with the defaults (Python 3.11, orjson 3.8), median of 5:
+
+                     bson-json       json     orjson     gzip -6
+    survey list         254 ms      66 ms      10 ms     2.7 MB -> 49 KB in 15 ms
+    results             1.2 ms     0.4 ms     0.1 ms      15 KB -> 1.9 KB
+
+The seeded surveys all share the same questions, so the list compresses
+far better than real data would; results compress to 10-20% either way.
+Below about a kilobyte, gzip saves less than its headers and CPU cost,
+hence COMPRESS_MIN_SIZE.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import random
+import statistics
+import time
+
+from bson import ObjectId, json_util
+
+import aggregates
+import compression
+import json_provider
+from benchmarks.seed import _answer, _questions
+
+
+def survey_list(count, questions, rnd):
+    owner = ObjectId()
+    now = datetime.datetime.utcnow()
+    return {'surveys': [{
+        '_id': ObjectId(),
+        'title': f'Benchmark survey {i}',
+        'description': 'Seeded',
+        'created_by': owner,
+        'created_at': now - datetime.timedelta(minutes=rnd.randint(0, 10 ** 5)),
+        'is_active': True,
+        'response_count': rnd.randint(0, 10 ** 4),
+        'questions': _questions(questions),
+    } for i in range(count)], 'next_cursor': None}
+
+
+def survey_results(questions, responses, rnd):
+    survey = {'_id': ObjectId(), 'title': 'Benchmark survey', 'created_by': ObjectId(),
+              'created_at': datetime.datetime.utcnow(), 'questions': _questions(questions)}
+    doc = {'total': 0, 'q': {}}
+    for _ in range(responses):
+        answers = {q['id']: _answer(q, rnd) for q in survey['questions']}
+        aggregates.apply_in_memory(doc, aggregates.build_update(survey, answers))
+    results, total = aggregates.to_results(survey, doc)
+    return {'survey_info': survey, 'results': results, 'total_respondents': total}
+
+
+def _stringify_ids(payload):
+    # What the handlers did before json_provider: copy documents with string ids
+    payload = dict(payload)
+    if 'surveys' in payload:
+        payload['surveys'] = [{**s, '_id': str(s['_id']), 'created_by': str(s['created_by'])}
+                              for s in payload['surveys']]
+    if 'survey_info' in payload:
+        info = payload['survey_info']
+        payload['survey_info'] = {**info, '_id': str(info['_id']), 'created_by': str(info['created_by'])}
+    return payload
+
+
+def encoders():
+    found = {
+        'bson-json': lambda p: json_util.dumps(_stringify_ids(p)).encode(),
+        'json': lambda p: json.dumps(p, default=json_provider.default, ensure_ascii=False,
+                                     separators=(',', ':')).encode(),
+    }
+    if json_provider.orjson is not None:
+        found['orjson'] = json_provider.dumps_bytes
+    return found
+
+
+def timed(fn, arg, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        timings.append(time.perf_counter() - start)
+    return result, statistics.median(timings) * 1000
+
+
+def report(label, payload, repeat):
+    print(f"{label}")
+    body = None
+    for name, encode in encoders().items():
+        body, ms = timed(encode, payload, repeat)
+        print(f"  encode {name:<10} {ms:8.1f} ms  {len(body):>10} bytes")
+
+    algorithms = ['gzip'] + (['br'] if compression.brotli is not None else [])
+    for algorithm in algorithms:
+        for level in (1, 6, 9):
+            compressed, ms = timed(lambda b: compression.compress(b, algorithm, level), body, repeat)
+            print(f"  {algorithm:<4} level {level}      {ms:8.1f} ms  {len(compressed):>10} bytes"
+                  f"  ({len(compressed) / len(body):.1%})")
+    # gzip round trip of the last body encoded
+    assert json.loads(gzip.decompress(compression.compress(body, 'gzip'))) == json.loads(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--surveys', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=50)
+    parser.add_argument('--responses', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    report(f"survey list ({args.surveys} surveys, 10 questions each)",
+           survey_list(args.surveys, 10, rnd), args.repeat)
+    report(f"results ({args.questions} questions, {args.responses} responses)",
+           survey_results(args.questions, args.responses, rnd), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
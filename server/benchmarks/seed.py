@@ -0,0 +1,135 @@
+"""
+Seed a database with synthetic users, surveys and responses for benchmarks.
+
+Run from server/ (writes to MONGO_URI, into a database you can throw away):
+    python -m benchmarks.seed --users 1000 --surveys 50 --questions 10 --responses 5000
+
+``seed`` is also used by benchmarks.harness, against either a real MongoDB
+or the in-memory stand-in (the optional ``mongomock`` package).
+"""
+import argparse
+import datetime
+import random
+
+import jwt
+from bson.objectid import ObjectId
+from werkzeug.security import generate_password_hash
+
+import aggregates
+import answer_codec
+import text_search
+import timeseries
+
+PASSWORD = 'benchmark-password'
+QUESTION_TYPES = ['radio', 'checkbox', 'rating', 'text', 'select']
+OPTIONS = ['Option A', 'Option B', 'Option C', 'Option D']
+
+
+def make_token(user_id, secret):
+    exp = datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+    return jwt.encode({'user_id': str(user_id), 'exp': exp}, secret, algorithm='HS256')
+
+
+def _questions(count):
+    questions = []
+    for i in range(count):
+        q_type = QUESTION_TYPES[i % len(QUESTION_TYPES)]
+        question = {'id': str(i + 1), 'text': f'Benchmark question {i + 1}',
+                    'type': q_type, 'required': False, 'options': None}
+        if q_type in ('radio', 'checkbox', 'select'):
+            question['options'] = list(OPTIONS)
+        questions.append(question)
+    return questions
+
+
+def _answer(question, rnd):
+    q_type = question['type']
+    if q_type in ('radio', 'select'):
+        return rnd.choice(OPTIONS)
+    if q_type == 'checkbox':
+        return rnd.sample(OPTIONS, rnd.randint(1, len(OPTIONS)))
+    if q_type == 'rating':
+        return rnd.randint(1, 5)
+    return f'Free text answer {rnd.randint(0, 10 ** 6)}'
+
+
+def seed(db, secret, users=100, surveys=10, questions=8, responses=1000, seed_value=42,
+         answer_format=2):
+    """
+    Fill ``db`` and return the handles the harness needs:
+    {'owner_token', 'owner_email', 'password', 'survey_ids', 'secret'}.
+    ``responses`` is the number of responses per survey (capped by ``users``),
+    stored in ``answer_format`` (see answer_codec.py).
+    """
+    rnd = random.Random(seed_value)
+    now = datetime.datetime.utcnow()
+    # One hash for every user: hashing is not what the seed measures
+    pwhash = generate_password_hash(PASSWORD)
+
+    user_docs = [{
+        '_id': ObjectId(), 'name': f'User {i}', 'email': f'user{i}@bench.example.com',
+        'password': pwhash, 'created_at': now, 'role': 'user'
+    } for i in range(users)]
+    db.users.insert_many(user_docs)
+
+    owner = user_docs[0]
+    survey_docs = []
+    for i in range(surveys):
+        survey_docs.append({
+            '_id': ObjectId(), 'title': f'Benchmark survey {i}', 'description': 'Seeded',
+            'questions': _questions(questions), 'created_by': str(owner['_id']),
+            'created_at': now - datetime.timedelta(minutes=i), 'is_active': True,
+            'response_count': 0
+        })
+    db.surveys.insert_many(survey_docs)
+
+    respondents = user_docs[1:]
+    for survey in survey_docs:
+        count = min(responses, len(respondents))
+        batch = []
+        for user in respondents[:count]:
+            answers = {q['id']: _answer(q, rnd) for q in survey['questions']}
+            batch.append({
+                'survey_id': survey['_id'], 'user_id': str(user['_id']),
+                'submitted_at': now - datetime.timedelta(seconds=rnd.randint(0, 86400)),
+                'r': rnd.random(),
+                **answer_codec.encode(survey, answers, answer_format)
+            })
+            if len(batch) == 1000:
+                db.responses.insert_many(batch)
+                batch = []
+        if batch:
+            db.responses.insert_many(batch)
+        db.surveys.update_one({'_id': survey['_id']}, {'$set': {'response_count': count}})
+        aggregates.rebuild(db, survey)
+        timeseries.rebuild(db, survey)
+        text_search.rebuild(db, survey)
+
+    return {
+        'owner_token': make_token(owner['_id'], secret),
+        'owner_email': owner['email'],
+        'password': PASSWORD,
+        'survey_ids': [str(s['_id']) for s in survey_docs],
+        'secret': secret,
+    }
+
+
+def main():
+    from pymongo import MongoClient
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Seed MONGO_URI with benchmark data")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--surveys', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--responses', type=int, default=500)
+    args = parser.parse_args()
+
+    client = MongoClient(Config.MONGO_URI)
+    db = client.get_default_database()
+    handles = seed(db, Config.SECRET_KEY, args.users, args.surveys, args.questions, args.responses)
+    print(f"Seeded {db.name}: owner {handles['owner_email']}, {len(handles['survey_ids'])} surveys")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Worker boot time and first-request latency, with and without warm-up.
+
+Run from server/:
+    python -m benchmarks.startup --db memory [--runs 5]
+    python -m benchmarks.startup --db mongo --mongo-uri mongodb://localhost:27017/survey_bench
+
+Each run is a new Python process, like a freshly started worker: nothing
+imported yet, no connection open. It builds the app (``import app``, i.e.
+create_app), runs warmup.warm_up, then sends one request to each endpoint
+of benchmarks.harness.scenarios (first requests), then the same requests
+again (steady state). The runs alternate between WARM_UP=false (cold) and
+WARM_UP=true (warm); the medians are reported.
+
+With --db mongo the database is seeded once and every process connects to
+it, so the pool warm-up is real. With --db memory (the optional
+``mongomock`` package) each process seeds its own copy (not timed) and has
+no connections to open, so only the Python side is measured.
+
+Measured here (--db memory, PASSWORD_HASH_WORKERS=2, median of 5 runs):
+
+                              cold        warm
+    create_app              452 ms      449 ms
+    warm-up                   0 ms      230 ms     (almost all spawning the hashing pool)
+    first auth.login        397 ms      156 ms     (steady: 150-159 ms of scrypt)
+    first other request   1.6-4.8 ms  1.5-3.3 ms   (steady: 1.1-3.5 ms)
+
+Preloaded, a gunicorn master pays create_app once for all its workers.
+Connection set-up (mongo_pool) only shows with --db mongo.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_MONGO_URI = 'mongodb://localhost:27017/survey_bench'
+SEED = {'users': 200, 'surveys': 5, 'questions': 10, 'responses': 100}
+
+
+def _timed_requests(client, requests):
+    timings, errors = {}, 0
+    for endpoint, (method, path, body, headers) in requests.items():
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body, headers=headers)
+        timings[endpoint] = (time.perf_counter() - start) * 1000
+        errors += response.status_code >= 400
+        response.close()
+    return timings, errors
+
+
+def child(args):
+    """One worker's life: create the app, warm up, serve first and steady requests."""
+    start = time.perf_counter()
+    import app as app_module
+    created = time.perf_counter()
+
+    from benchmarks.harness import scenarios
+    import warmup
+
+    if args.db == 'memory':
+        import mongomock
+        from benchmarks.seed import seed
+        app_module.mongo.db = mongomock.MongoClient().survey_bench
+        handles = seed(app_module.mongo.db, app_module.app.config['SECRET_KEY'], **SEED)
+    else:
+        handles = json.loads(args.handles)
+
+    warm_start = time.perf_counter()
+    warmup.warm_up(app_module.app)
+    ready = time.perf_counter()
+
+    client = app_module.app.test_client()
+    make_requests = scenarios(handles, random.Random(1))
+    first, errors = _timed_requests(client, {k: make() for k, make in make_requests.items()})
+    steady, more_errors = _timed_requests(client, {k: make() for k, make in make_requests.items()})
+    print(json.dumps({
+        'create_app_ms': (created - start) * 1000,
+        'warm_up_ms': (ready - warm_start) * 1000,
+        'first_ms': first,
+        'steady_ms': steady,
+        'errors': errors + more_errors,
+    }))
+
+
+def run_process(args, warm, handles):
+    env = {**os.environ, 'MONGO_URI': args.mongo_uri, 'WARM_UP': 'true' if warm else 'false'}
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child', '--db', args.db]
+    if handles:
+        command += ['--handles', json.dumps(handles)]
+    output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def seed_mongo(args):
+    from pymongo import MongoClient
+
+    from benchmarks.seed import seed
+    from config import Config
+    from indexes import ensure_indexes
+
+    if 'bench' not in urlsplit(args.mongo_uri).path:
+        sys.exit("Refusing to drop a database whose name does not contain 'bench'")
+    db = MongoClient(args.mongo_uri).get_default_database()
+    db.client.drop_database(db.name)
+    ensure_indexes(db)
+    return seed(db, Config.SECRET_KEY, **SEED)
+
+
+def print_report(runs):
+    modes = list(runs)
+    print(f"{'':<34}" + ''.join(f"{mode:>12}" for mode in modes))
+
+    def row(label, values):
+        print(f"{label:<34}" + ''.join(f"{statistics.median(v):>9.1f} ms" for v in values))
+
+    row("create_app", [[r['create_app_ms'] for r in runs[m]] for m in modes])
+    row("warm-up", [[r['warm_up_ms'] for r in runs[m]] for m in modes])
+    row("boot (create_app + warm-up)",
+        [[r['create_app_ms'] + r['warm_up_ms'] for r in runs[m]] for m in modes])
+    for endpoint in runs[modes[0]][0]['first_ms']:
+        row(f"first {endpoint}", [[r['first_ms'][endpoint] for r in runs[m]] for m in modes])
+        row("  steady", [[r['steady_ms'][endpoint] for r in runs[m]] for m in modes])
+    errors = sum(r['errors'] for m in modes for r in runs[m])
+    if errors:
+        print(f"{errors} request(s) failed: check the database")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', choices=['memory', 'mongo'], default='memory')
+    parser.add_argument('--mongo-uri', default=DEFAULT_MONGO_URI)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--handles', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    if args.db == 'memory':
+        try:
+            import mongomock  # noqa: F401
+        except ImportError:
+            sys.exit("--db memory requires the 'mongomock' package")
+        handles = None
+    else:
+        handles = seed_mongo(args)
+
+    runs = {'cold': [], 'warm': []}
+    for _ in range(args.runs):
+        for mode in runs:
+            runs[mode].append(run_process(args, mode == 'warm', handles))
+    print_report(runs)
+
+
+if __name__ == '__main__':
+    main()
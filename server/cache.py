@@ -0,0 +1,109 @@
+"""
+Pluggable cache for read-mostly payloads (published surveys).
+
+Backends share the same tiny interface (get / set / delete) and store
+strings, so the payloads cached by one backend can be read by another:
+
+- ``LRUCache``: in-process, bounded, with a TTL. Also the local stand-in
+  for the shared backend in tests and development.
+- ``RedisCache``: shared between workers/hosts. Requires the optional
+  ``redis`` package.
+- ``NullCache``: disables caching.
+
+Each gunicorn worker owns its own LRUCache: an invalidation only reaches the
+worker that handled the write, the others serve the old payload until the
+TTL expires. Use the redis backend when that matters.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    def __init__(self, url, ttl=300, prefix='survey:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self._client.set(self.prefix + key, value, ex=self.ttl)
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+def make_cache(config):
+    backend = config.get('CACHE_BACKEND', 'lru')
+    ttl = config.get('CACHE_TTL_SECONDS', 300)
+
+    if backend == 'lru':
+        return LRUCache(max_entries=config.get('CACHE_MAX_ENTRIES', 1024), ttl=ttl)
+    if backend == 'redis':
+        return RedisCache(config['CACHE_URL'], ttl=ttl)
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+
+
+# --- KEYS ---
+
+def public_survey_key(survey_id):
+    return f'public_survey:{survey_id}'
+
+
+def invalidate_survey(cache, survey_id):
+    """Call after any write to a survey document (edit, status, delete)."""
+    cache.delete(public_survey_key(str(survey_id)))
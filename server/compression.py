@@ -0,0 +1,131 @@
+"""
+Negotiated response compression (Accept-Encoding).
+
+Responses of at least COMPRESS_MIN_SIZE bytes with a compressible type
+(JSON, text) are compressed with the first of COMPRESS_ALGORITHMS the client
+accepts: 'gzip' (standard library) and 'br' (needs the optional ``brotli``
+package). Below the threshold compression costs more CPU than it saves on
+the wire.
+
+Streamed JSON (survey lists) is compressed as it streams, whatever its size.
+Left alone: live results (text/event-stream), exports (CSV / NDJSON, they
+have their own ``gzip=1``), responses that already have a Content-Encoding,
+and 304 / empty bodies. A compressed response gets ``Vary: Accept-Encoding``
+and its ETag becomes weak, so If-None-Match keeps working (weak comparison).
+
+The Flask app installs it with ``init_app``; asgi.py calls ``encoding_for``
+/ ``compress`` for its native routes.
+"""
+import gzip
+import zlib
+
+from flask import request
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/plain', 'text/html')
+
+_config = {'algorithms': [], 'min_size': 1024, 'level': 6}
+
+
+def check_algorithms(algorithms):
+    if 'br' in algorithms and brotli is None:
+        raise RuntimeError("COMPRESS_ALGORITHMS=br requires the 'brotli' package")
+    unknown = set(algorithms) - {'br', 'gzip'}
+    if unknown:
+        raise RuntimeError(f"Unknown COMPRESS_ALGORITHMS: {', '.join(sorted(unknown))}")
+
+
+def negotiate(accept_encoding, algorithms):
+    """The first of ``algorithms`` an Accept-Encoding header value accepts, or None."""
+    accepted = parse_accept_header(accept_encoding)
+    for algorithm in algorithms:
+        if accepted[algorithm] > 0:
+            return algorithm
+    return None
+
+
+def compress(body, algorithm, level=None):
+    level = _config['level'] if level is None else level
+    if algorithm == 'br':
+        # Brotli quality 0-11: 11 is far too slow for live responses
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=min(level, 9), mtime=0)
+
+
+def compress_stream(chunks, algorithm, level=None):
+    """Compress a streamed body chunk by chunk."""
+    level = _config['level'] if level is None else level
+    if algorithm == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(min(level, 9), zlib.DEFLATED, 31)  # 31 = gzip container
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = process(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def encoding_for(accept_encoding, mimetype, size=None):
+    """
+    The algorithm to compress a body with, or None. ``size`` is None for a
+    stream (length unknown, always compressed).
+    """
+    if mimetype not in COMPRESSIBLE_TYPES or (size is not None and size < _config['min_size']):
+        return None
+    return negotiate(accept_encoding, _config['algorithms'])
+
+
+def weak_etag(etag):
+    return etag if etag.startswith('W/') else 'W/' + etag
+
+
+def _compress_response(response):
+    if (response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    accept_encoding = request.headers.get('Accept-Encoding')
+
+    if response.is_streamed:
+        # Survey lists: compressed as they stream (never live results, text/event-stream)
+        algorithm = encoding_for(accept_encoding, response.mimetype)
+        if algorithm is not None:
+            response.response = compress_stream(response.response, algorithm)
+            response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        algorithm = encoding_for(accept_encoding, response.mimetype, len(body))
+        if algorithm is not None:
+            response.set_data(compress(body, algorithm))
+
+    if algorithm is not None:
+        response.headers['Content-Encoding'] = algorithm
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = weak_etag(response.headers['ETag'])
+    return response
+
+
+def settings(config):
+    algorithms = [a.strip() for a in config.get('COMPRESS_ALGORITHMS', 'gzip').split(',') if a.strip()]
+    check_algorithms(algorithms)
+    return {
+        'algorithms': algorithms,
+        'min_size': config.get('COMPRESS_MIN_SIZE', 1024),
+        'level': config.get('COMPRESS_LEVEL', 6),
+    }
+
+
+def init_app(app):
+    _config.update(settings(app.config))
+    if _config['algorithms']:
+        app.after_request(_compress_response)
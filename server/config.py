@@ -5,5 +5,72 @@ load_dotenv()
 
 class Config:
     MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/survey_db")
+    # Connections each worker opens before serving (see database.py)
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "4"))
     SECRET_KEY = os.getenv("SECRET_KEY", "super_secret_dev_key") # À changer en prod !
-    JWT_EXPIRATION_HOURS = 24
\ No newline at end of file
+    JWT_EXPIRATION_HOURS = 24
+    # Decoded JWT claims kept in memory (see auth_middleware.py)
+    AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+    # Password hashing (see passwords.py). Changing the method upgrades hashes at next login.
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))  # 0 = inline
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+    PASSWORD_HASH_TIMEOUT = 10  # seconds
+    # Reverse proxies in front of the app whose X-Forwarded-For / -Proto are trusted (0 = none)
+    PROXY_COUNT = int(os.getenv("PROXY_COUNT", "0"))
+    # Failed logins allowed per IP / per email within the window (seconds), shared through redis with CACHE_BACKEND=redis
+    LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+    LOGIN_FAILURE_WINDOW = int(os.getenv("LOGIN_FAILURE_WINDOW", "300"))
+    # 'pipeline' (MongoDB $facet aggregation) or 'python' (single pass over a cursor)
+    RESULTS_ENGINE = os.getenv("RESULTS_ENGINE", "pipeline")
+    # Filtered / cross-tab results (see sampling.py): approximate=1 is honoured from this many responses
+    APPROX_RESULTS_MIN_RESPONSES = int(os.getenv("APPROX_RESULTS_MIN_RESPONSES", "100000"))
+    APPROX_SAMPLE_SIZE = int(os.getenv("APPROX_SAMPLE_SIZE", "5000"))
+    # Response compression (see compression.py): 'gzip', 'br' (needs brotli) or both in order of preference
+    COMPRESS_ALGORITHMS = os.getenv("COMPRESS_ALGORITHMS", "gzip")
+    COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # bytes
+    COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+    # Warm each worker up before it accepts requests (see warmup.py)
+    WARM_UP = os.getenv("WARM_UP", "true").lower() == "true"
+    # Published surveys cache: 'lru' (per process), 'redis' (shared, needs CACHE_URL) or 'none'
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "lru")
+    CACHE_URL = os.getenv("CACHE_URL")
+    CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+    # Storage format of new responses: 2 = compact positional, 1 = {question id: value} (see answer_codec.py)
+    ANSWER_FORMAT = int(os.getenv("ANSWER_FORMAT", "2"))
+    # Compiled answer validators kept in memory (see answer_validation.py)
+    VALIDATOR_CACHE_SIZE = int(os.getenv("VALIDATOR_CACHE_SIZE", "1024"))
+    # Response ingestion: 'sync' (one write per request) or 'buffered' (see ingest.py)
+    INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+    INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))  # seconds
+    INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "10000"))
+    INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))  # per batch, then set aside
+    INGEST_WAL_DIR = os.getenv("INGEST_WAL_DIR")  # unset = no write-ahead log
+    INGEST_WAL_FSYNC = os.getenv("INGEST_WAL_FSYNC", "true").lower() == "true"
+    # Prometheus endpoint (see metrics.py): off by default; set a token unless only the scraper can reach it
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+    # Requests slower than this are logged with their query shapes (see metrics.py)
+    SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "500"))
+    # Live results over SSE (see live.py): 'local' or 'change_stream' (replica set only)
+    LIVE_FEED = os.getenv("LIVE_FEED", "local")
+    LIVE_TICK_SECONDS = float(os.getenv("LIVE_TICK_SECONDS", "1.0"))
+    LIVE_HEARTBEAT_SECONDS = int(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+    LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+    # Open streams per worker process: each holds a thread, keep it well below GUNICORN_THREADS
+    LIVE_MAX_STREAMS = int(os.getenv("LIVE_MAX_STREAMS", "8"))
+    # Time-bucketed results (see timeseries.py): hourly buckets older than this many days are folded into daily ones
+    TIMESERIES_HOURLY_DAYS = int(os.getenv("TIMESERIES_HOURLY_DAYS", "14"))
+    TIMESERIES_COMPACT_INTERVAL = int(os.getenv("TIMESERIES_COMPACT_INTERVAL", "3600"))  # seconds
+    # ASGI mode (see asgi.py): threads running the Flask routes that are not served natively
+    ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "32"))
+    # Background deletion of the responses of deleted surveys (see reaper.py)
+    REAPER_ENABLED = os.getenv("REAPER_ENABLED", "true").lower() == "true"
+    REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "1000"))
+    REAPER_PAUSE_SECONDS = float(os.getenv("REAPER_PAUSE_SECONDS", "0.1"))
+    REAPER_INTERVAL_SECONDS = int(os.getenv("REAPER_INTERVAL_SECONDS", "30"))
+    # Second pass for responses accepted through a cached copy of the survey: longer than CACHE_TTL_SECONDS
+    REAPER_SWEEP_DELAY_SECONDS = int(os.getenv("REAPER_SWEEP_DELAY_SECONDS", str(CACHE_TTL_SECONDS + 60)))
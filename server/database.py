@@ -0,0 +1,150 @@
+"""
+Per-process MongoDB handle.
+
+``mongo.db`` is the application database (the one named in MONGO_URI) of
+the current process. The MongoClient behind it is created on first use in
+each process: a PyMongo client does not survive a fork, so under gunicorn
+--preload each worker opens its own (create_app itself never connects).
+
+Objects built once in create_app and used in every worker (live hub, ingest
+buffer, reaper) keep ``mongo.db`` itself: every attribute access resolves
+to the database of the process it runs in.
+
+The client keeps at least MONGO_MIN_POOL_SIZE connections open;
+``prime_pool`` waits for them (warmup.py) so the first requests of a worker
+do not pay for the TCP / TLS handshakes and authentication.
+"""
+import os
+import threading
+import time
+
+import pymongo
+from pymongo import MongoClient, monitoring
+
+POOL_WARM_UP_TIMEOUT = 5  # seconds
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Counts the open connections of one client."""
+
+    def __init__(self):
+        self.ready = 0
+        self._changed = threading.Condition()
+
+    def wait_for(self, count, timeout):
+        with self._changed:
+            return self._changed.wait_for(lambda: self.ready >= count, timeout)
+
+    def connection_ready(self, event):
+        with self._changed:
+            self.ready += 1
+            self._changed.notify_all()
+
+    def connection_closed(self, event):
+        with self._changed:
+            self.ready -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class ProcessDatabase:
+    """Stand-in for a pymongo Database that resolves to the current process's one."""
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    def __getattr__(self, name):
+        return getattr(self._handle.database(), name)
+
+    def __getitem__(self, name):
+        return self._handle.database()[name]
+
+
+class MongoHandle:
+    def __init__(self):
+        self.uri = None
+        self.options = {}
+        self._proxy = ProcessDatabase(self)
+        self._override = None
+        self._client = None
+        self._database = None
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, **options):
+        self.close()
+        self.uri = app.config['MONGO_URI']
+        self.options = {'minPoolSize': app.config.get('MONGO_MIN_POOL_SIZE', 0), **options}
+
+    @property
+    def db(self):
+        return self._proxy
+
+    @db.setter
+    def db(self, database):
+        # Benchmarks: serve another database (e.g. mongomock) instead of MONGO_URI's
+        self._override = database
+
+    def database(self):
+        if self._override is not None:
+            return self._override
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # The parent's client (if any) belongs to the parent: never close it here
+                    self._listener = PoolListener()
+                    listeners = [*self.options.get('event_listeners', []), self._listener]
+                    self._client = MongoClient(self.uri, **{**self.options, 'event_listeners': listeners})
+                    self._database = self._client.get_default_database()
+                    self._pid = os.getpid()
+        return self._database
+
+    def prime_pool(self, timeout=POOL_WARM_UP_TIMEOUT):
+        """
+        Open the MONGO_MIN_POOL_SIZE connections of this process now. Returns
+        the number of open connections (None when ``db`` was replaced).
+        """
+        database = self.database()
+        if self._override is not None:
+            return None
+        started = time.monotonic()
+        with pymongo.timeout(timeout):  # bounds server selection too
+            database.command('ping')
+        # PyMongo fills minPoolSize in the background, about once per second
+        self._listener.wait_for(self.options['minPoolSize'], max(timeout - (time.monotonic() - started), 0))
+        return self._listener.ready
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._client is not None:
+                self._client.close()
+            self._client = self._database = self._listener = self._pid = None
+
+
+mongo = MongoHandle()
@@ -0,0 +1,125 @@
+"""
+Streaming export of raw survey responses (CSV or NDJSON).
+
+Rows are produced one at a time from a batched, projected cursor, and
+encoded into chunks of EXPORT_CHUNK_ROWS rows, so memory stays constant
+whatever the size of the survey.
+
+Columns are derived from the survey's questions:
+    response_id, user_id, submitted_at, <question>..., with one 0/1 column
+    per option for checkbox questions ("<question> [<option>]").
+Column names are unique, so that NDJSON keys never overwrite each other: a
+name already taken (two questions with the same text, a question named
+"user_id"...) gets the question id appended, "<question> (#<id>)".
+submitted_at is UTC, in ISO 8601 with a Z suffix.
+"""
+import csv
+import io
+import json
+import zlib
+
+import answer_codec
+import json_provider
+
+EXPORT_CHUNK_ROWS = 500
+FIXED_COLUMNS = ['response_id', 'user_id', 'submitted_at']
+
+
+def columns(survey):
+    """Return (header, extractors): one extractor per question, producing its cells."""
+    header = list(FIXED_COLUMNS)
+    taken = set(header)
+    extractors = []
+
+    def unique(name, q_id):
+        suffix = f' (#{q_id})'
+        while name in taken:
+            name += suffix
+        taken.add(name)
+        return name
+
+    for question in survey.get('questions', []):
+        q_id = str(question.get('id'))
+        label = question.get('text') or q_id
+
+        if question.get('type') == 'checkbox':
+            options = question.get('options') or []
+            header.extend(unique(f'{label} [{opt}]', q_id) for opt in options)
+
+            def extract(answers, q_id=q_id, options=options):
+                chosen = answers.get(q_id)
+                chosen = chosen if isinstance(chosen, list) else []
+                return [1 if opt in chosen else 0 for opt in options]
+        else:
+            header.append(unique(label, q_id))
+
+            def extract(answers, q_id=q_id):
+                return [answers.get(q_id)]
+
+        extractors.append(extract)
+
+    return header, extractors
+
+
+def rows(survey, cursor):
+    """Yield one list of cells per response, in the order of ``columns``."""
+    header, extractors = columns(survey)
+    yield header
+    for r in cursor:
+        answers = answer_codec.decode(survey, r)
+        if not isinstance(answers, dict):
+            answers = {}
+        submitted_at = r.get('submitted_at')
+        row = [str(r['_id']), r.get('user_id'), json_provider.default(submitted_at) if submitted_at else None]
+        for extract in extractors:
+            row.extend(extract(answers))
+        yield row
+
+
+def _chunked(iterable, size=EXPORT_CHUNK_ROWS):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def csv_chunks(row_iter):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for chunk in _chunked(row_iter):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def ndjson_chunks(row_iter):
+    """One JSON object per line, keyed by the same column names as the CSV."""
+    header = next(row_iter, None)
+    if header is None:
+        return
+    for chunk in _chunked(row_iter):
+        yield ''.join(
+            json.dumps(dict(zip(header, row)), default=str, ensure_ascii=False) + '\n'
+            for row in chunk
+        )
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'ndjson': (ndjson_chunks, 'application/x-ndjson'),
+}
@@ -0,0 +1,46 @@
+"""
+gunicorn settings, read automatically when gunicorn is started from server/:
+
+    gunicorn app:app --workers 4 --bind 0.0.0.0:5000
+
+The app is preloaded: create_app runs once in the master, and the workers
+fork from it, sharing the imported modules and the compiled validation
+models. Each worker opens its own MongoDB client (database.py) and warms up
+(warmup.py) before it accepts connections.
+
+Workers are threaded (gthread): every open live results stream (live.py)
+holds a thread until the client leaves, and a sync worker would serve
+nothing else meanwhile. GUNICORN_THREADS bounds the concurrent requests,
+streams included, of each worker; LIVE_MAX_STREAMS of them at most serve
+streams. ``-k`` on the command line (e.g. the
+uvicorn worker for asgi:app) takes precedence.
+"""
+import logging
+import os
+
+preload_app = True
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+
+
+def when_ready(server):
+    from config import Config
+    # Each worker only publishes the responses it records itself
+    if server.cfg.workers > 1 and Config.LIVE_FEED == 'local':
+        logging.getLogger('gunicorn.error').warning(
+            "LIVE_FEED=local with %s workers: live streams miss the responses recorded by other "
+            "workers. Use LIVE_FEED=change_stream (replica set) or a single worker.", server.cfg.workers)
+
+
+def post_fork(server, worker):
+    import warmup
+    warmup.mark_boot()
+
+
+def post_worker_init(worker):
+    from flask import Flask
+
+    import warmup
+    # ASGI workers (asgi:app) warm up at lifespan startup instead
+    if isinstance(worker.wsgi, Flask):
+        warmup.warm_up(worker.wsgi)
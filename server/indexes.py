@@ -0,0 +1,144 @@
+"""
+Index bootstrap and query-plan verification.
+
+``ensure_indexes`` is idempotent (create_index is a no-op when the index
+already exists). It only runs as ``flask ensure-indexes``, at deploy time:
+building an index on a large collection is no job for a starting worker.
+``missing_indexes`` only checks, without writing: each worker runs it during
+its warm-up (warmup.py), and a missing unique index is logged as an error
+since duplicates are then accepted.
+
+``explain_queries`` runs explain() on the queries the blueprints issue and
+returns their winning plan stages. ``flask check-query-plans`` prints them and
+exits non-zero when one resolves to a COLLSCAN, so it can run in CI or after
+a migration.
+"""
+import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+# (collection, keys, options)
+INDEXES = [
+    # register / login
+    ('users', [('email', ASCENDING)], {'unique': True, 'name': 'email_unique'}),
+    # get_my_surveys
+    ('surveys', [('created_by', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+     {'name': 'created_by_created_at_id'}),
+    # reaper: surveys waiting for deletion (only tombstones are indexed)
+    ('surveys', [('deletion.status', ASCENDING)],
+     {'name': 'deletion_status',
+      'partialFilterExpression': {'deletion.status': {'$exists': True}}}),
+    # submit_response duplicate check, get_public_survey has_responded
+    ('responses', [('survey_id', ASCENDING), ('user_id', ASCENDING)],
+     {'unique': True, 'name': 'survey_user_unique'}),
+    # export: responses of one survey in submission order, resumable
+    ('responses', [('survey_id', ASCENDING), ('submitted_at', ASCENDING), ('_id', ASCENDING)],
+     {'name': 'survey_submitted_at'}),
+    # results engine / rebuild: responses of one survey in insertion order
+    ('responses', [('survey_id', ASCENDING), ('_id', ASCENDING)],
+     {'name': 'survey_id_order'}),
+    # approximate results: bottom-k sample of a survey's responses (see sampling.py)
+    ('responses', [('survey_id', ASCENDING), ('r', ASCENDING)],
+     {'name': 'survey_sampling_key'}),
+    # text answers: newest first, by term prefix, by keywords (see text_search.py)
+    ('text_answers', [('survey_id', ASCENDING), ('q', ASCENDING), ('submitted_at', DESCENDING),
+                      ('_id', DESCENDING)],
+     {'name': 'survey_question_recent'}),
+    ('text_answers', [('survey_id', ASCENDING), ('q', ASCENDING), ('terms', ASCENDING)],
+     {'name': 'survey_question_terms'}),
+    ('text_answers', [('survey_id', ASCENDING), ('q', ASCENDING), ('text', TEXT)],
+     {'name': 'survey_question_text', 'default_language': 'none'}),
+    # one copy per answer, even when a buffered batch is retried (see ingest.py)
+    ('text_answers', [('response_id', ASCENDING), ('q', ASCENDING)],
+     {'unique': True, 'name': 'response_question_unique'}),
+    # time buckets: one per survey, granularity and start; range reads of get_results
+    ('survey_timeseries', [('survey_id', ASCENDING), ('granularity', ASCENDING), ('start', ASCENDING)],
+     {'unique': True, 'name': 'survey_granularity_start'}),
+    # time bucket compaction: old hourly buckets of every survey
+    ('survey_timeseries', [('granularity', ASCENDING), ('start', ASCENDING)],
+     {'name': 'granularity_start'}),
+]
+
+# Indexes that enforce data integrity rather than speed, as 'collection.name'
+UNIQUE_INDEXES = {f"{collection}.{options['name']}"
+                  for collection, keys, options in INDEXES if options.get('unique')}
+
+
+def ensure_indexes(db):
+    """Create every index the application relies on. Returns their names."""
+    names = []
+    for collection, keys, options in INDEXES:
+        names.append(db[collection].create_index(keys, **options))
+    return names
+
+
+def missing_indexes(db):
+    """The INDEXES that do not exist in the database, as 'collection.name'."""
+    existing, missing = {}, []
+    for collection, keys, options in INDEXES:
+        if collection not in existing:
+            existing[collection] = set(db[collection].index_information())
+        if options['name'] not in existing[collection]:
+            missing.append(f"{collection}.{options['name']}")
+    return missing
+
+
+# --- QUERY PLAN VERIFICATION ---
+
+def _blueprint_queries(db):
+    """The query shapes issued by the blueprints, with placeholder values."""
+    sample_id = ObjectId()
+    sample_user = str(ObjectId())
+
+    return {
+        'auth.register/login: users by email':
+            db.users.find({'email': 'explain@example.com'}).limit(1),
+        'survey.get_my_surveys':
+            db.surveys.find({'created_by': sample_user, 'deleted_at': None}).sort([('created_at', -1), ('_id', -1)]),
+        'survey/public: survey by id':
+            db.surveys.find({'_id': sample_id, 'deleted_at': None}).limit(1),
+        'reaper: surveys waiting for deletion':
+            db.surveys.find({'deletion.status': {'$in': ['pending', 'running']}}).limit(1),
+        'public.get_public_survey: has_responded':
+            db.responses.find({'survey_id': sample_id, 'user_id': sample_user}).limit(1),
+        'survey.get_results / delete_survey: responses of a survey':
+            db.responses.find({'survey_id': sample_id}).sort('_id', 1),
+        'survey.export_responses':
+            db.responses.find({'survey_id': sample_id}).sort([('submitted_at', 1), ('_id', 1)]),
+        'survey.search_text_answers: newest first':
+            db.text_answers.find({'survey_id': sample_id, 'q': 0}).sort([('submitted_at', -1), ('_id', -1)]),
+        'survey.search_text_answers: by prefix':
+            db.text_answers.find({'survey_id': sample_id, 'q': 0, 'terms': {'$regex': '^explain'}}),
+        'survey.search_text_answers: by keywords':
+            db.text_answers.find({'survey_id': sample_id, 'q': 0, '$text': {'$search': 'explain'}}),
+        'survey.get_results: approximate results sample':
+            db.responses.find({'survey_id': sample_id, 'r': {'$gte': 0}}).sort('r', 1).limit(100),
+        'survey.get_results: time buckets of a range':
+            db.survey_timeseries.find({'survey_id': sample_id, 'granularity': {'$in': ['hour', 'day']},
+                                       'start': {'$gte': datetime.datetime(2000, 1, 1)}}).sort('start', 1),
+        'reaper: hourly buckets to compact':
+            db.survey_timeseries.find({'granularity': 'hour',
+                                       'start': {'$lt': datetime.datetime(2000, 1, 1)}}).sort('start', 1),
+    }
+
+
+def _stages(plan):
+    """Yield every stage name found in an explain() plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+def explain_queries(db):
+    """Explain every blueprint query. Returns a list of (label, plan stages)."""
+    plans = []
+    for label, cursor in _blueprint_queries(db).items():
+        explain = cursor.explain()
+        plans.append((label, list(_stages(explain.get('queryPlanner', {}).get('winningPlan', {})))))
+    return plans
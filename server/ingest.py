@@ -0,0 +1,377 @@
+"""
+Batched write pipeline for survey responses (INGEST_MODE = 'buffered').
+
+submit_response validates the request, hands the response to the
+``ResponseBuffer`` of its process and answers 202 right away. A background
+thread commits the buffer when it reaches INGEST_BATCH_SIZE items or every
+INGEST_FLUSH_INTERVAL seconds:
+
+- one ``find`` of the batch's surveys: responses to a survey deleted since
+  they were accepted (the published surveys cache lags behind deletions)
+  are dropped,
+- one ``insert_many(ordered=False)`` for the responses, marked
+  ``ingest_pending: 0``; duplicates are rejected by the unique
+  (survey_id, user_id) index and simply dropped,
+- then the STEPS, each followed by one ``update_many`` recording it on the
+  marker (``ingest_pending: <steps done>``, removed after the last one):
+  - counts: one ``bulk_write`` of ``response_count`` increments, one update
+    per survey,
+  - stats: one ``bulk_write`` of pre-aggregated stats
+    (aggregates.merge_updates), one update per survey,
+  - buckets: one ``bulk_write`` of hourly time buckets
+    (timeseries.bulk_updates), one update per survey and hour,
+  - texts: one ``insert_many`` of the searchable text answers
+    (text_search.documents).
+
+A batch that failed after its insert_many (retried, or replayed from the
+WAL) finds its responses already stored: for a duplicate ``_id`` still
+marked, only the steps its marker does not record are applied; once the
+marker is gone, it is dropped like any other duplicate. A crash between a
+step's write and its marker update applies that one step twice, except for
+text answers, which the unique (response_id, q) index keeps single.
+
+Durability (INGEST_WAL_DIR): every accepted response is appended to a local
+write-ahead segment before it is acknowledged. A segment is deleted once its
+batch is committed. Segments left over by a crashed process are replayed by
+the next process that starts its flusher (or by ``flask replay-ingest-wal``).
+Response ``_id``s are assigned before the WAL write, so a replay never inserts
+a response twice.
+
+A batch whose commit fails is retried at the next flush, ahead of the
+newer ones. After INGEST_MAX_ATTEMPTS failures it is set aside (logged,
+its segment closed but kept for ``flask replay-ingest-wal``) so that it
+cannot hold every later response back and end in BufferFull. Without a WAL,
+its responses are lost. Segment names are unique (pid, time, counter) and created
+exclusively: a new process reusing a crashed one's pid never appends to, or
+deletes, its segments.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import aggregates
+import text_search
+import timeseries
+from reaper import ACTIVE
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class BufferFull(Exception):
+    pass
+
+
+def _insert_ignoring_duplicates(collection, docs):
+    """insert_many(ordered=False). Returns the indexes of the documents rejected as duplicates."""
+    duplicates = set()
+    try:
+        collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get('writeErrors', []):
+            if err.get('code') != DUPLICATE_KEY:
+                raise
+            duplicates.add(err['index'])
+    return duplicates
+
+
+def _per_survey(items):
+    per_survey = {}
+    for it in items:
+        per_survey.setdefault(it['response']['survey_id'], []).append(it['stats'])
+    return per_survey
+
+
+def _apply_counts(db, items):
+    db.surveys.bulk_write([
+        UpdateOne({'_id': survey_id}, {'$inc': {'response_count': len(updates)}})
+        for survey_id, updates in _per_survey(items).items()
+    ], ordered=False)
+
+
+def _apply_stats(db, items):
+    db.survey_stats.bulk_write([
+        UpdateOne({'_id': survey_id}, aggregates.merge_updates(updates), upsert=True)
+        for survey_id, updates in _per_survey(items).items()
+    ], ordered=False)
+
+
+def _apply_buckets(db, items):
+    db.survey_timeseries.bulk_write(timeseries.bulk_updates([
+        (it['response']['survey_id'], it['response']['submitted_at'], it['stats']) for it in items
+    ]), ordered=False)
+
+
+def _apply_texts(db, items):
+    texts = [doc for it in items for doc in text_search.documents(it['response'], it['stats'])]
+    if texts:
+        _insert_ignoring_duplicates(db.text_answers, texts)
+
+
+# The writes following the insert of a batch's responses, in order
+STEPS = (_apply_counts, _apply_stats, _apply_buckets, _apply_texts)
+
+
+def commit(db, items, on_inserted=None):
+    """
+    Write a batch of {'response': doc, 'stats': update} items.
+    ``on_inserted(response)`` is called for every response actually inserted.
+    Returns the number of responses actually inserted.
+    """
+    if not items:
+        return 0
+
+    survey_ids = list({it['response']['survey_id'] for it in items})
+    active = {s['_id'] for s in db.surveys.find({'_id': {'$in': survey_ids}, **ACTIVE}, {'_id': 1})}
+    if len(active) < len(survey_ids):
+        kept = [it for it in items if it['response']['survey_id'] in active]
+        logger.info("Dropped %d response(s) to deleted surveys", len(items) - len(kept))
+        items = kept
+        if not items:
+            return 0
+
+    duplicates = _insert_ignoring_duplicates(
+        db.responses, [{**it['response'], 'ingest_pending': 0} for it in items])
+
+    done = {}  # response _id -> STEPS already applied
+    if duplicates:
+        # Same _id still marked: inserted by an earlier attempt at this batch,
+        # which stopped after done[_id] steps. Any other duplicate (the
+        # (survey_id, user_id) index, or a batch already complete) is dropped.
+        for r in db.responses.find(
+                {'_id': {'$in': [items[i]['response']['_id'] for i in duplicates]},
+                 'ingest_pending': {'$exists': True}},
+                {'ingest_pending': 1}):
+            done[r['_id']] = r['ingest_pending']
+        duplicates = {i for i in duplicates if items[i]['response']['_id'] not in done}
+
+    applied = [it for i, it in enumerate(items) if i not in duplicates]
+
+    for step, apply in enumerate(STEPS):
+        todo = [it for it in applied if done.get(it['response']['_id'], 0) <= step]
+        if not todo:
+            continue
+        apply(db, todo)
+        marker = ({'$unset': {'ingest_pending': ''}} if step == len(STEPS) - 1
+                  else {'$set': {'ingest_pending': step + 1}})
+        db.responses.update_many({'_id': {'$in': [it['response']['_id'] for it in todo]}}, marker)
+
+    # Once written: a live results snapshot read before this includes none of them (see live.py)
+    if on_inserted:
+        for it in applied:
+            on_inserted(it['response'])
+
+    if duplicates:
+        logger.info("Dropped %d duplicate response(s)", len(duplicates))
+    return len(items) - len(duplicates)
+
+
+# --- WRITE-AHEAD LOG ---
+
+class _Segment:
+    """An append-only WAL file, flock'ed by its owner process while in use."""
+
+    def __init__(self, path, fsync):
+        import fcntl
+
+        self.path = path
+        self.fsync = fsync
+        # O_EXCL: never take over an existing segment (e.g. of a crashed process with the same pid)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o600)
+        self._file = os.fdopen(fd, 'a', encoding='utf-8')
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def append(self, item):
+        self._file.write(json_util.dumps(item) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def remove(self):
+        os.remove(self.path)
+        self._file.close()
+
+    def close(self):
+        """Release the segment, left on disk for replay."""
+        self._file.close()
+
+
+def _read_segment(path):
+    items = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json_util.loads(line))
+            except ValueError:
+                # Torn write of the last line during a crash: never acknowledged
+                logger.warning("Skipping corrupt WAL line in %s", path)
+    return items
+
+
+def replay_orphans(db, wal_dir):
+    """Commit the WAL segments that no live process holds. Returns the number inserted."""
+    import fcntl
+
+    inserted = 0
+    for path in sorted(glob.glob(os.path.join(wal_dir, '*.wal'))):
+        with open(path, 'a+', encoding='utf-8') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # owned by a running process
+            try:
+                inserted += commit(db, _read_segment(path))
+            except Exception:
+                # Keep it for the next replay, but do not hold back the other segments
+                logger.exception("Could not replay WAL segment %s", path)
+                continue
+            os.remove(path)
+    return inserted
+
+
+# --- BUFFER ---
+
+class ResponseBuffer:
+    def __init__(self, db, batch_size=500, flush_interval=0.5, max_pending=10000,
+                 wal_dir=None, wal_fsync=True, on_inserted=None, max_attempts=5):
+        self.db = db
+        self.on_inserted = on_inserted
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.wal_dir = wal_dir
+        self.wal_fsync = wal_fsync
+
+        self._items = []
+        self._pending = []  # (segment, items) taken from the buffer but not committed yet
+        self._failures = {}  # id(items) -> failed commits of that batch
+        self._segment = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pid = None
+        self._closed = False
+
+    # Started lazily in the worker process: threads do not survive a fork
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._items, self._pending, self._segment, self._failures = [], [], None, {}
+        if self.wal_dir:
+            os.makedirs(self.wal_dir, exist_ok=True)
+            # Before this process creates (and locks) segments of its own
+            self._replay_orphans()
+            self._segment = self._new_segment()
+        threading.Thread(target=self._run, name='response-flusher', daemon=True).start()
+
+    def ensure_started(self):
+        """Start the flusher of this process now rather than at its first response (warmup.py)."""
+        with self._lock:
+            self._ensure_started()
+
+    def _new_segment(self):
+        self._seq += 1
+        path = os.path.join(self.wal_dir, f'responses-{self._pid}-{time.time_ns()}-{self._seq}.wal')
+        return _Segment(path, self.wal_fsync)
+
+    def enqueue(self, response_doc, stats_update):
+        """Buffer one response. Raises BufferFull when the flusher cannot keep up."""
+        item = {'response': response_doc, 'stats': stats_update}
+        with self._lock:
+            self._ensure_started()
+            if len(self._items) + sum(len(b) for _, b in self._pending) >= self.max_pending:
+                raise BufferFull()
+            if self._segment:
+                self._segment.append(item)
+            self._items.append(item)
+            if len(self._items) >= self.batch_size:
+                self._wakeup.notify()
+
+    def _take_batch(self):
+        with self._lock:
+            if self._items:
+                segment = self._segment
+                if segment:
+                    self._segment = self._new_segment()
+                self._pending.append((segment, self._items))
+                self._items = []
+            return list(self._pending)
+
+    def flush(self):
+        """
+        Commit everything buffered so far. Failed batches stay pending and are
+        retried, up to max_attempts times each.
+        """
+        with self._flush_lock:
+            for segment, items in self._take_batch():
+                try:
+                    commit(self.db, items, self.on_inserted)
+                except Exception:
+                    failures = self._failures[id(items)] = self._failures.get(id(items), 0) + 1
+                    if failures < self.max_attempts:
+                        logger.exception("Response batch commit failed, will retry (%d items)", len(items))
+                        return
+                    logger.exception("Response batch commit failed %d times, setting it aside (%d items, %s)",
+                                     failures, len(items),
+                                     f"kept in {segment.path}" if segment else "lost: no WAL")
+                    if segment:
+                        segment.close()
+                        segment = None
+                self._failures.pop(id(items), None)
+                with self._lock:
+                    self._pending = [p for p in self._pending if p[1] is not items]
+                if segment:
+                    segment.remove()
+
+    def _replay_orphans(self):
+        try:
+            replayed = replay_orphans(self.db, self.wal_dir)
+            if replayed:
+                logger.warning("Replayed %d response(s) from a previous WAL", replayed)
+        except Exception:
+            logger.exception("WAL replay failed")
+
+    def _run(self):
+        while not self._closed:
+            with self._lock:
+                if len(self._items) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+            self.flush()
+
+    def close(self):
+        """Flush what is left (called at interpreter exit)."""
+        self._closed = True
+        if self._pid == os.getpid():
+            self.flush()
+            with self._lock:
+                if self._segment and not self._items and not self._pending:
+                    self._segment.remove()
+                    self._segment = None
+
+
+def make_ingest_buffer(config, db, on_inserted=None):
+    if config.get('INGEST_MODE', 'sync') != 'buffered':
+        return None
+    return ResponseBuffer(
+        db,
+        batch_size=config.get('INGEST_BATCH_SIZE', 500),
+        flush_interval=config.get('INGEST_FLUSH_INTERVAL', 0.5),
+        max_pending=config.get('INGEST_MAX_PENDING', 10000),
+        wal_dir=config.get('INGEST_WAL_DIR'),
+        wal_fsync=config.get('INGEST_WAL_FSYNC', True),
+        on_inserted=on_inserted,
+        max_attempts=config.get('INGEST_MAX_ATTEMPTS', 5),
+    )
@@ -0,0 +1,81 @@
+"""
+JSON provider of the app (``app.json``): jsonify, request.json, the SSE
+and streamed bodies, and the native ASGI routes all go through it.
+
+MongoDB documents are encoded as they come out of PyMongo, in one pass,
+so handlers no longer copy documents to convert their fields:
+
+- ObjectId -> its hex string
+- datetime -> ISO 8601 in UTC, "2024-05-01T12:00:00.123000Z" (PyMongo
+  returns naive UTC datetimes)
+- Decimal128 -> string, UUID -> string
+
+The encoder is orjson when it is installed (optional, several times faster
+on large results), else the standard library; both produce the same JSON
+for what the API returns. Compare them with benchmarks/json_compression.py.
+Unlike flask_pymongo's BSONProvider, request bodies are parsed as plain
+JSON ({"$oid": ...} is not interpreted).
+"""
+import datetime
+import json
+import uuid
+
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _isoformat(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat() + 'Z'
+
+
+def default(value):
+    """Encode the types json / orjson do not know."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return _isoformat(value)
+    if isinstance(value, (Decimal128, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+
+    _loads = orjson.loads
+else:
+    def dumps_bytes(obj):
+        return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode()
+
+    _loads = json.loads
+
+
+class MongoJSONProvider(JSONProvider):
+    encoder = 'orjson' if orjson is not None else 'json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return _loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip of JSONProvider.response
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
+
+
+def init_app(app):
+    # After PyMongo(app), which installs its own BSONProvider
+    app.json = MongoJSONProvider(app)
@@ -0,0 +1,208 @@
+"""
+Live results over Server-Sent Events.
+
+One ``LiveHub`` per process holds a ``Broadcaster`` for every survey that has
+at least one watcher. New answers are folded into the broadcaster's pending
+update (aggregates.build_update), and once per LIVE_TICK_SECONDS the pending
+updates are merged into a single per-question delta
+(aggregates.to_delta) and pushed to every subscriber queue. Bursts therefore
+cost one delta per tick, and no subscriber ever queries MongoDB after its
+initial snapshot.
+
+Feeds (LIVE_FEED):
+- 'local': submit_response / the ingest buffer publish the responses recorded
+  by this process. Enough with a single worker only: gunicorn.conf.py warns
+  when it is used with several.
+- 'change_stream': one MongoDB change stream per process on ``responses``
+  inserts, so owners see responses recorded by any worker or host. Requires
+  a replica set (Atlas clusters are).
+
+Snapshots (``LiveHub.snapshot``) are read while nothing can be published
+for the survey, and a subscriber's deltas only carry the updates published
+after its latest snapshot: the responses are published once written, so
+none is missed or counted twice (but for one written just before the read
+and published just after it).
+
+Each subscriber queue is bounded (LIVE_QUEUE_SIZE). A client too slow to
+drain it gets its queue replaced by a RESYNC marker, and a fresh snapshot
+instead of the deltas it missed.
+
+Every open stream holds a worker thread (gunicorn.conf.py runs threaded
+workers): at most LIVE_MAX_STREAMS are open per process, further ones get
+``TooManyStreams`` (503), so streams never take every thread of a worker.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+from pymongo.errors import PyMongoError
+
+import aggregates
+import answer_codec
+
+logger = logging.getLogger(__name__)
+
+RESYNC = object()
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+class Subscriber:
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.since = None  # sequence number of its snapshot; None = no snapshot yet
+
+    def push(self, delta):
+        try:
+            self.queue.put_nowait(delta)
+        except queue.Full:
+            # Too slow: drop what it has not read, it will get a new snapshot
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait(RESYNC)
+
+
+class Broadcaster:
+    def __init__(self, survey):
+        self.survey = {'_id': survey['_id'], 'questions': survey.get('questions', []),
+                       'version': survey.get('version', 1)}
+        self.subscribers = set()
+        self.pending = []  # (sequence number, update)
+        self.seq = 0
+        # Held by publish, ticks and snapshots; taken after LiveHub._lock, never before
+        self.lock = threading.Lock()
+
+
+class LiveHub:
+    def __init__(self, feed='local', tick=1.0, max_queue=100, max_streams=8, db=None):
+        self.feed = feed
+        self.tick = tick
+        self.max_queue = max_queue
+        self.max_streams = max_streams
+        self.db = db
+        self._broadcasters = {}  # survey id (str) -> Broadcaster
+        self._streams = 0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    # Threads are started lazily in the worker process: they do not survive a fork
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run_ticks, name='live-ticks', daemon=True).start()
+        if self.feed == 'change_stream':
+            threading.Thread(target=self._run_change_stream, name='live-feed', daemon=True).start()
+
+    def ensure_started(self):
+        """Start the threads of this process now rather than at the first subscriber (warmup.py)."""
+        with self._lock:
+            self._ensure_started()
+
+    def subscribe(self, survey):
+        """A new subscriber, without deltas until its first ``snapshot``. Raises TooManyStreams."""
+        subscriber = Subscriber(self.max_queue)
+        with self._lock:
+            self._ensure_started()
+            if self._streams >= self.max_streams:
+                raise TooManyStreams()
+            key = str(survey['_id'])
+            broadcaster = self._broadcasters.get(key)
+            if broadcaster is None:
+                broadcaster = self._broadcasters[key] = Broadcaster(survey)
+            with broadcaster.lock:
+                broadcaster.subscribers.add(subscriber)
+            self._streams += 1
+        return subscriber
+
+    def snapshot(self, survey_id, subscriber, read):
+        """
+        Return ``read()`` (the current results, from MongoDB) and restart the
+        subscriber's deltas right after it. Publishing to the survey waits
+        meanwhile.
+        """
+        broadcaster = self._broadcasters[str(survey_id)]
+        with broadcaster.lock:
+            data = read()
+            subscriber.since = broadcaster.seq
+            # Anything queued is already part of the snapshot
+            with subscriber.queue.mutex:
+                subscriber.queue.queue.clear()
+        return data
+
+    def unsubscribe(self, survey_id, subscriber):
+        """Idempotent: called when the stream's response is closed."""
+        with self._lock:
+            broadcaster = self._broadcasters.get(str(survey_id))
+            if broadcaster is None or subscriber not in broadcaster.subscribers:
+                return
+            with broadcaster.lock:
+                broadcaster.subscribers.discard(subscriber)
+            self._streams -= 1
+            if not broadcaster.subscribers:
+                del self._broadcasters[str(survey_id)]
+
+    def publish(self, response):
+        """Record one new response document. Costs a dict lookup when nobody watches the survey."""
+        broadcaster = self._broadcasters.get(str(response['survey_id']))
+        if broadcaster is None:
+            return
+        answers = answer_codec.answers_of(broadcaster.survey, response)
+        update = aggregates.build_update(broadcaster.survey, answers)
+        with broadcaster.lock:
+            broadcaster.seq += 1
+            broadcaster.pending.append((broadcaster.seq, update))
+
+    def publish_local(self, response):
+        """Called where responses are written; ignored when the change stream is the feed."""
+        if self.feed == 'local':
+            self.publish(response)
+
+    def _run_ticks(self):
+        while True:
+            time.sleep(self.tick)
+            with self._lock:
+                broadcasters = [b for b in self._broadcasters.values() if b.pending]
+
+            for broadcaster in broadcasters:
+                with broadcaster.lock:
+                    updates, broadcaster.pending = broadcaster.pending, []
+                    deltas = {}  # since -> delta: one per distinct snapshot point (usually one)
+                    for subscriber in broadcaster.subscribers:
+                        if subscriber.since is None:
+                            continue  # its snapshot will include these updates
+                        if subscriber.since not in deltas:
+                            newer = [u for seq, u in updates if seq > subscriber.since]
+                            deltas[subscriber.since] = newer and aggregates.to_delta(
+                                broadcaster.survey, aggregates.merge_updates(newer))
+                        if deltas[subscriber.since]:
+                            subscriber.push(deltas[subscriber.since])
+
+    def _run_change_stream(self):
+        pipeline = [
+            {'$match': {'operationType': 'insert'}},
+            {'$project': {'fullDocument.survey_id': 1, 'fullDocument.answers': 1,
+                          'fullDocument.v': 1, 'fullDocument.a': 1}},
+        ]
+        while True:
+            try:
+                with self.db.responses.watch(pipeline) as stream:
+                    for change in stream:
+                        self.publish(change['fullDocument'])
+            except PyMongoError:
+                logger.exception("Live results change stream interrupted, reconnecting")
+                time.sleep(5)
+
+
+def make_live_hub(config, db):
+    return LiveHub(
+        feed=config.get('LIVE_FEED', 'local'),
+        tick=config.get('LIVE_TICK_SECONDS', 1.0),
+        max_queue=config.get('LIVE_QUEUE_SIZE', 100),
+        max_streams=config.get('LIVE_MAX_STREAMS', 8),
+        db=db,
+    )
@@ -0,0 +1,267 @@
+"""
+Hot-path instrumentation, exposed as Prometheus text on /metrics.
+
+- Per request: latency histogram labelled by blueprint, endpoint, method and
+  status.
+- Per MongoDB command (PyMongo command monitoring): count, duration histogram
+  and documents returned, labelled by command name. The commands of the
+  current request are also collected on ``g.mongo`` (count, time, documents,
+  query shapes) and summarized in a ``Server-Timing`` response header.
+- Requests slower than SLOW_REQUEST_MS are logged with the shapes of the
+  queries they ran (collection, command and filter keys; never values).
+- Per worker: boot time and warm-up steps (set by warmup.py), and the
+  latency of the first request it served.
+
+Everything is in-process and lock-protected; each worker exposes its own
+numbers, as with the usual Prometheus multi-target scraping.
+
+/metrics reveals endpoints, traffic and query shapes: it only exists with
+METRICS_ENABLED, and with METRICS_TOKEN set it also requires
+``Authorization: Bearer <METRICS_TOKEN>``. It is never covered by CORS (only
+/api/* is). Instrumentation itself always runs.
+"""
+import hmac
+import bisect
+import logging
+import os
+import threading
+import time
+
+from flask import request, g, current_app
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name, self.help, self.buckets = name, help_text, buckets
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_labels(labels + (("le", repr(bound)),))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_labels(labels + (("le", "+Inf"),))} {series[-1]}')
+                lines.append(f'{self.name}_sum{_labels(labels)} {series[-2]}')
+                lines.append(f'{self.name}_count{_labels(labels)} {series[-1]}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(labels)} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency')
+MONGO_COMMANDS = Counter('mongo_commands_total', 'MongoDB commands sent')
+MONGO_FAILURES = Counter('mongo_command_failures_total', 'MongoDB commands that failed')
+MONGO_LATENCY = Histogram('mongo_command_duration_seconds', 'MongoDB command latency')
+MONGO_DOCUMENTS = Counter('mongo_documents_returned_total', 'Documents returned by MongoDB')
+SLOW_REQUESTS = Counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS')
+WORKER_BOOT = Gauge('worker_boot_seconds', 'Time from worker start to ready, warm-up included')
+WORKER_WARM_UP = Gauge('worker_warm_up_seconds', 'Duration of each warm-up step')
+FIRST_REQUEST = Gauge('worker_first_request_seconds', 'Latency of the first request served by the worker')
+
+REGISTRY = [REQUEST_LATENCY, SLOW_REQUESTS, MONGO_COMMANDS, MONGO_FAILURES, MONGO_LATENCY,
+            MONGO_DOCUMENTS, WORKER_BOOT, WORKER_WARM_UP, FIRST_REQUEST]
+
+_first_request_pid = None
+
+
+def observe_request(labels, seconds):
+    """Record one request's latency (labels: blueprint, endpoint, method, status)."""
+    global _first_request_pid
+    REQUEST_LATENCY.observe(labels, seconds)
+    if _first_request_pid != os.getpid():
+        _first_request_pid = os.getpid()
+        FIRST_REQUEST.set(labels[1:2], seconds)
+        logger.info("First request of worker %s: %s in %.1f ms", os.getpid(), labels[1][1], seconds * 1000)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- MONGODB COMMAND MONITORING ---
+
+class RequestMongoStats:
+    __slots__ = ('commands', 'seconds', 'documents', 'shapes')
+
+    def __init__(self):
+        self.commands, self.seconds, self.documents, self.shapes = 0, 0.0, 0, []
+
+
+_current = threading.local()  # PyMongo calls listeners on the thread issuing the command
+
+
+def _shape(event):
+    """'find responses {survey_id,user_id}': the query without its values."""
+    command = event.command
+    collection = command.get(event.command_name)
+    query = command.get('filter')
+    if query is None and event.command_name == 'aggregate':
+        stages = [next(iter(stage), '?') for stage in command.get('pipeline', [])]
+        return f"aggregate {collection} [{','.join(stages)}]"
+    if query is None:
+        for key in ('updates', 'deletes'):
+            if command.get(key):
+                query = command[key][0].get('q')
+    keys = ','.join(sorted(query)) if isinstance(query, dict) else ''
+    return f'{event.command_name} {collection} {{{keys}}}'
+
+
+def _documents(reply):
+    # find / aggregate / getMore replies; writes report affected counts, not documents
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+    return 0
+
+
+class MongoListener(monitoring.CommandListener):
+    def started(self, event):
+        stats = getattr(_current, 'stats', None)
+        if stats is not None and len(stats.shapes) < 50:
+            stats.shapes.append(_shape(event))
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        documents = _documents(event.reply)
+        labels = (('command', event.command_name),)
+        MONGO_COMMANDS.inc(labels)
+        MONGO_LATENCY.observe(labels, seconds)
+        if documents:
+            MONGO_DOCUMENTS.inc(labels, documents)
+
+        stats = getattr(_current, 'stats', None)
+        if stats is not None:
+            stats.commands += 1
+            stats.seconds += seconds
+            stats.documents += documents
+
+    def failed(self, event):
+        labels = (('command', event.command_name),)
+        MONGO_COMMANDS.inc(labels)
+        MONGO_FAILURES.inc(labels)
+        MONGO_LATENCY.observe(labels, event.duration_micros / 1e6)
+
+
+mongo_listener = MongoListener()
+
+
+# --- FLASK HOOKS ---
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.mongo = _current.stats = RequestMongoStats()
+
+
+def _after_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+
+    observe_request((
+        ('blueprint', request.blueprint or ''),
+        ('endpoint', endpoint),
+        ('method', request.method),
+        ('status', response.status_code),
+    ), elapsed)
+
+    stats = g.mongo
+    response.headers['Server-Timing'] = (
+        f'app;dur={elapsed * 1000:.1f}, '
+        f'mongo;dur={stats.seconds * 1000:.1f};desc="{stats.commands} commands"'
+    )
+
+    if elapsed * 1000 >= current_app.config['SLOW_REQUEST_MS']:
+        SLOW_REQUESTS.inc((('endpoint', endpoint),))
+        logger.warning("Slow request %s %s (%s): %.0f ms, %d Mongo commands (%.0f ms, %d docs): %s",
+                       request.method, request.path, endpoint, elapsed * 1000, stats.commands,
+                       stats.seconds * 1000, stats.documents, '; '.join(stats.shapes))
+    return response
+
+
+def _teardown_request(exc):
+    _current.stats = None
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return current_app.response_class('Unauthorized\n', status=401, mimetype='text/plain',
+                                          headers={'WWW-Authenticate': 'Bearer'})
+    return current_app.response_class(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    if app.config['METRICS_ENABLED']:
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
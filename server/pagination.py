@@ -0,0 +1,64 @@
+"""
+Keyset pagination helpers.
+
+A cursor is the sort key of the last item of a page (e.g. created_at + _id),
+serialized with bson.json_util so datetimes and ObjectIds survive the round
+trip, then base64url-encoded so clients treat it as an opaque string.
+"""
+import base64
+import binascii
+
+from bson import json_util
+from bson.errors import BSONError
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*values):
+    raw = json_util.dumps(list(values)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, types):
+    """
+    Return the sort-key values stored in ``token``, one per entry of
+    ``types`` (a type or tuple of types each, as for isinstance).
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError, binascii.Error, BSONError):
+        raise InvalidCursor("Invalid cursor")
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(isinstance(v, t) for v, t in zip(values, types))):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def parse_limit(raw, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Parse a ``limit`` query parameter, clamped to [1, maximum]."""
+    if raw is None:
+        return default
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    return max(1, min(limit, maximum))
+
+
+def after_filter(after, sort_field, direction=-1):
+    """
+    MongoDB filter selecting documents strictly after ``after`` = [value, _id]
+    for a (sort_field, _id) sort in ``direction`` (-1 = descending).
+    """
+    value, last_id = after
+    op = '$lt' if direction < 0 else '$gt'
+    return {'$or': [
+        {sort_field: {op: value}},
+        {sort_field: value, '_id': {op: last_id}}
+    ]}
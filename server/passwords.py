@@ -0,0 +1,226 @@
+"""
+Password hashing off the request threads, and login throttling.
+
+Hashing (scrypt / pbkdf2) costs tens of milliseconds of CPU while holding the
+GIL. It runs in a small process pool (PASSWORD_HASH_WORKERS) so one login storm
+does not stall every other endpoint of the worker. At most
+PASSWORD_HASH_MAX_PENDING hashes may be queued per process; beyond that,
+``PoolSaturated`` is raised and the route answers 503 right away.
+
+Hash parameters come from PASSWORD_HASH_METHOD (werkzeug method string, e.g.
+'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'). Hashes made with another
+method are upgraded on the next successful login (see ``needs_rehash``).
+
+``LoginThrottle`` counts failed logins per IP and per email and rejects
+further attempts before any hashing happens. The IP is ``request.remote_addr``,
+the client's own once PROXY_COUNT lets ProxyFix read X-Forwarded-For (app.py).
+The counts live in the process, or in redis with CACHE_BACKEND=redis
+(``RedisLoginThrottle``), so that every worker and host shares them.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+# --- Functions run in the pool (module level so they can be pickled) ---
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _check(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt:32768:8:1', salt_length=16, workers=2,
+                 max_pending=32, timeout=10):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        self.method = config.get('PASSWORD_HASH_METHOD', self.method)
+        self.salt_length = config.get('PASSWORD_SALT_LENGTH', self.salt_length)
+        self.timeout = config.get('PASSWORD_HASH_TIMEOUT', self.timeout)
+
+        max_pending = config.get('PASSWORD_HASH_MAX_PENDING', self.max_pending)
+        if max_pending != self.max_pending:
+            self.max_pending = max_pending
+            self._slots = threading.BoundedSemaphore(max_pending)
+
+        workers = config.get('PASSWORD_HASH_WORKERS', self.workers)
+        with self._lock:
+            if workers != self.workers:
+                self.workers = workers
+                # The pool is sized on creation: stop this process's one, the next call starts a new one
+                if self._pool is not None and self._pid == os.getpid():
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                self._pid = None
+
+    def _get_pool(self):
+        # Created lazily in each worker process: a pool does not survive a fork
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def warm_up(self):
+        """Start the pool's processes now (spawned, they take a while) rather than at the first login."""
+        if self.workers:
+            self._get_pool().submit(_check, '', '').result(timeout=self.timeout)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)  # inline (development / tests)
+
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated()
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PoolSaturated()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self._run(_check, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if the hash was made with other parameters than PASSWORD_HASH_METHOD."""
+        return pwhash.split('$', 1)[0] != self.method
+
+
+class LoginThrottle:
+    """
+    Sliding-window count of failed logins, per IP and per email (in-process).
+    """
+
+    def __init__(self, max_failures=5, window=300, max_keys=100000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict()  # key -> [timestamps]
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        stamps = [t for t in self._failures.get(key, []) if now - t < self.window]
+        if stamps:
+            self._failures[key] = stamps
+        else:
+            self._failures.pop(key, None)
+        return stamps
+
+    def retry_after(self, ip, email):
+        """Seconds to wait before the next attempt, or 0 if allowed."""
+        now = time.monotonic()
+        wait = 0
+        with self._lock:
+            for key in (f'ip:{ip}', f'email:{email}'):
+                stamps = self._recent(key, now)
+                if len(stamps) >= self.max_failures:
+                    wait = max(wait, self.window - (now - stamps[0]))
+        return int(wait) + 1 if wait else 0
+
+    def record_failure(self, ip, email):
+        now = time.monotonic()
+        with self._lock:
+            for key in (f'ip:{ip}', f'email:{email}'):
+                self._failures.setdefault(key, []).append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def reset(self, email):
+        with self._lock:
+            self._failures.pop(f'email:{email}', None)
+
+
+class RedisLoginThrottle:
+    """
+    The same sliding window in redis, shared by every worker and host: one
+    sorted set of failure timestamps per key, expiring with the window.
+    """
+
+    def __init__(self, url, max_failures=5, window=300, prefix='login_failures:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        self._client = redis.Redis.from_url(url)
+        self.max_failures = max_failures
+        self.window = window
+        self.prefix = prefix
+
+    def _keys(self, ip, email):
+        return [f'{self.prefix}ip:{ip}', f'{self.prefix}email:{email}']
+
+    def retry_after(self, ip, email):
+        """Seconds to wait before the next attempt, or 0 if allowed."""
+        now = time.time()
+        pipe = self._client.pipeline()
+        for key in self._keys(ip, email):
+            pipe.zremrangebyscore(key, 0, now - self.window)
+            pipe.zcard(key)
+            pipe.zrange(key, 0, 0, withscores=True)
+        results = pipe.execute()
+
+        wait = 0
+        for count, oldest in zip(results[1::3], results[2::3]):
+            if count >= self.max_failures and oldest:
+                wait = max(wait, self.window - (now - oldest[0][1]))
+        return int(wait) + 1 if wait > 0 else 0
+
+    def record_failure(self, ip, email):
+        now = time.time()
+        member = f'{now}:{os.urandom(4).hex()}'  # unique even for simultaneous failures
+        pipe = self._client.pipeline()
+        for key in self._keys(ip, email):
+            pipe.zadd(key, {member: now})
+            pipe.expire(key, self.window)
+        pipe.execute()
+
+    def reset(self, email):
+        self._client.delete(f'{self.prefix}email:{email}')
+
+
+def make_login_throttle(config):
+    options = {'max_failures': config.get('LOGIN_MAX_FAILURES', 5),
+               'window': config.get('LOGIN_FAILURE_WINDOW', 300)}
+    if config.get('CACHE_BACKEND') == 'redis':
+        return RedisLoginThrottle(config['CACHE_URL'], **options)
+    return LoginThrottle(**options)
+
+
+hasher = PasswordHasher()
+
+
+def init_app(app):
+    hasher.configure(app.config)
+    app.extensions['login_throttle'] = make_login_throttle(app.config)
@@ -0,0 +1,221 @@
+"""
+Background cascade deletion of surveys.
+
+DELETE /api/surveys/<id> only writes a tombstone on the survey:
+
+    deleted_at: <date>
+    deletion: {status: 'pending', deleted_responses: 0, last_id: None, lease_until: None}
+
+Every endpoint ignores tombstoned surveys (see ``ACTIVE``). The reaper then
+removes the responses in batches of REAPER_BATCH_SIZE, by ascending _id
+range, pausing REAPER_PAUSE_SECONDS between batches and waiting for a
+majority acknowledgement, so deletion never outruns replication. Their
+copies in ``text_answers`` (see text_search.py) go the same way.
+
+Progress (last_id, deleted_responses) is saved on the tombstone after each
+batch, so a restarted reaper resumes where it stopped. A lease
+(``deletion.lease_until``) makes sure only one worker reaps a given survey at
+a time.
+
+Submissions read the survey through the published surveys cache, so a
+worker may accept responses for up to CACHE_TTL_SECONDS after the deletion.
+Their writes re-check ``ACTIVE`` (the response_count increment, or the
+ingest batch's survey lookup) and are taken back, but one that passed the
+check just before the tombstone can still land after the first pass. When
+the responses are gone the tombstone is therefore marked 'sweeping', and
+REAPER_SWEEP_DELAY_SECONDS later the reaper goes over the survey once more
+(responses, text answers, stats, time buckets) before it shrinks the
+tombstone and marks it 'done'; it stays around to answer
+GET /api/surveys/<id>/deletion.
+
+The reaper runs in a daemon thread of each worker (REAPER_ENABLED), or
+on demand with ``flask reap-deleted-surveys``. The same thread compacts the
+time-bucketed results every TIMESERIES_COMPACT_INTERVAL seconds (see
+timeseries.py).
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+
+from pymongo import ReturnDocument
+from pymongo.write_concern import WriteConcern
+
+import timeseries
+
+logger = logging.getLogger(__name__)
+
+# Filter to add to every lookup of a survey that is not being deleted
+ACTIVE = {'deleted_at': None}
+
+LEASE_SECONDS = 60
+
+
+def tombstone(db, survey_id):
+    """Mark a survey deleted. Returns False if it was already deleted."""
+    result = db.surveys.update_one(
+        {'_id': survey_id, **ACTIVE},
+        {'$set': {
+            'deleted_at': datetime.datetime.utcnow(),
+            'is_active': False,
+            'deletion': {'status': 'pending', 'deleted_responses': 0,
+                         'last_id': None, 'lease_until': None},
+        }}
+    )
+    return result.modified_count == 1
+
+
+def _claim(db):
+    """Lease one survey waiting for deletion (or due for its final sweep), or return None."""
+    now = datetime.datetime.utcnow()
+    waiting = [
+        ({'deletion.status': {'$in': ['pending', 'running']}}, 'running'),
+        ({'deletion.status': 'sweeping', 'deletion.sweep_after': {'$lt': now}}, 'sweeping'),
+    ]
+    for query, status in waiting:
+        survey = db.surveys.find_one_and_update(
+            {
+                **query,
+                '$or': [{'deletion.lease_until': None}, {'deletion.lease_until': {'$lt': now}}],
+            },
+            {'$set': {
+                'deletion.status': status,
+                'deletion.lease_until': now + datetime.timedelta(seconds=LEASE_SECONDS),
+            }},
+            projection={'deletion': 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if survey is not None:
+            return survey
+    return None
+
+
+def _purge(collection, query, batch_size, pause):
+    """Delete every document matching ``query``, batch by batch."""
+    majority = collection.with_options(write_concern=WriteConcern(w='majority'))
+    while True:
+        ids = [d['_id'] for d in collection.find(query, {'_id': 1}).limit(batch_size)]
+        if not ids:
+            return
+        majority.delete_many({'_id': {'$in': ids}})
+        time.sleep(pause)
+
+
+def reap_survey(db, survey, batch_size=1000, pause=0.1, sweep_delay=360):
+    """
+    Delete the responses of one leased survey, batch by batch. The first pass
+    schedules the final sweep, the sweep finishes the tombstone.
+    """
+    responses = db.responses.with_options(write_concern=WriteConcern(w='majority'))
+    survey_id = survey['_id']
+    last_id = survey['deletion'].get('last_id')
+
+    while True:
+        query = {'survey_id': survey_id}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        ids = [r['_id'] for r in db.responses.find(query, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not ids:
+            break
+
+        deleted = responses.delete_many({
+            'survey_id': survey_id, '_id': {'$gte': ids[0], '$lte': ids[-1]}
+        }).deleted_count
+        last_id = ids[-1]
+
+        db.surveys.update_one({'_id': survey_id}, {
+            '$set': {
+                'deletion.last_id': last_id,
+                'deletion.lease_until': datetime.datetime.utcnow()
+                + datetime.timedelta(seconds=LEASE_SECONDS),
+            },
+            '$inc': {'deletion.deleted_responses': deleted},
+        })
+        time.sleep(pause)
+
+    _purge(db.text_answers, {'survey_id': survey_id}, batch_size, pause)
+    db.survey_stats.delete_one({'_id': survey_id})
+    timeseries.delete(db, survey_id)
+
+    if survey['deletion'].get('status') != 'sweeping':
+        db.surveys.update_one({'_id': survey_id}, {
+            '$set': {
+                'deletion.status': 'sweeping',
+                'deletion.last_id': None,
+                'deletion.sweep_after': datetime.datetime.utcnow() + datetime.timedelta(seconds=sweep_delay),
+            },
+            '$unset': {'deletion.lease_until': ''},
+        })
+        return
+    db.surveys.update_one({'_id': survey_id}, {
+        '$set': {'deletion.status': 'done', 'deletion.completed_at': datetime.datetime.utcnow()},
+        '$unset': {'questions': '', 'description': '', 'deletion.lease_until': '',
+                   'deletion.sweep_after': ''},
+    })
+
+
+def reap_all(db, batch_size=1000, pause=0.1, sweep_delay=360):
+    """Reap every survey waiting for deletion or due for its sweep. Returns the number of passes."""
+    done = 0
+    while True:
+        survey = _claim(db)
+        if survey is None:
+            return done
+        reap_survey(db, survey, batch_size, pause, sweep_delay)
+        done += 1
+
+
+class Reaper:
+    def __init__(self, db, batch_size=1000, pause=0.1, interval=30,
+                 hourly_days=14, compact_interval=3600, sweep_delay=360):
+        self.db = db
+        self.batch_size = batch_size
+        self.pause = pause
+        self.sweep_delay = sweep_delay
+        self.interval = interval
+        self.hourly_days = hourly_days
+        self.compact_interval = compact_interval
+        self._next_compaction = 0
+        self._pid = None
+        self._wakeup = threading.Event()
+
+    def ensure_started(self):
+        # Started lazily in each worker process: threads do not survive a fork
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name='survey-reaper', daemon=True).start()
+
+    def wake(self):
+        """Start working right away instead of at the next interval."""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                reap_all(self.db, self.batch_size, self.pause, self.sweep_delay)
+            except Exception:
+                logger.exception("Survey reaper failed, retrying in %ss", self.interval)
+            if time.monotonic() >= self._next_compaction:
+                self._next_compaction = time.monotonic() + self.compact_interval
+                try:
+                    timeseries.compact(self.db, self.hourly_days)
+                except Exception:
+                    logger.exception("Time bucket compaction failed, retrying in %ss", self.compact_interval)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+
+def make_reaper(config, db):
+    if not config.get('REAPER_ENABLED', True):
+        return None
+    return Reaper(
+        db,
+        batch_size=config.get('REAPER_BATCH_SIZE', 1000),
+        pause=config.get('REAPER_PAUSE_SECONDS', 0.1),
+        interval=config.get('REAPER_INTERVAL_SECONDS', 30),
+        hourly_days=config.get('TIMESERIES_HOURLY_DAYS', 14),
+        compact_interval=config.get('TIMESERIES_COMPACT_INTERVAL', 3600),
+        sweep_delay=config.get('REAPER_SWEEP_DELAY_SECONDS', 360),
+    )
@@ -0,0 +1,500 @@
+"""
+Results engine: computes the ``results`` list of GET /results from the raw
+``responses`` collection.
+
+Two interchangeable paths produce exactly the same JSON:
+
+- ``run_pipeline``: one $facet aggregation per survey, built from the
+  ``questions`` schema, so counting happens inside MongoDB and only the
+  totals travel over the wire.
+- ``run_single_pass``: one iteration over a streamed cursor, feeding
+  per-question accumulators. Used when the server rejects the pipeline
+  (old MongoDB versions) or when RESULTS_ENGINE = 'python'.
+
+Both paths feed the same accumulators, which own the formatting rules.
+Answers are validated when submitted (see answer_validation.py): the single
+pass reads them through answer_codec.answers_of, and the pipeline filters
+out the values that would not pass, so the accumulators trust their input.
+
+Both paths also take optional segmentation arguments (GET /results?filter=&by=):
+
+- ``filters`` ({question position: [values]}) keeps the respondents whose
+  answer to every filtered question is one of its values (for a checkbox,
+  includes one of them). The pipeline first matches the encoded ``a.<i>``
+  fields of format 2 responses, next to the survey_id index, so non-matching
+  responses are never decoded.
+- ``by`` (a question position: radio, select, checkbox or rating) splits the
+  totals per answer to that question, one segment per option / rating value.
+  Respondents who did not answer it are left out; with a checkbox, a
+  respondent counts in every segment they chose.
+"""
+from collections import deque
+
+from pymongo.errors import OperationFailure
+
+import answer_codec
+import answer_validation
+
+RECENT_TEXT_ANSWERS = 5
+CURSOR_BATCH_SIZE = 1000
+
+CHOICE_TYPES = ('radio', 'select')
+SEGMENT_TYPES = ('radio', 'select', 'checkbox', 'rating')
+
+
+# --- ACCUMULATORS ---
+
+class ChoiceStat:
+    """radio / select: one count per option."""
+
+    def __init__(self, question):
+        self.n = 0
+        self.counts = {opt: 0 for opt in question.get('options') or []}
+
+    def add(self, ans, count=1):
+        self.n += count
+        self.counts[ans] += count
+
+    def data(self):
+        return dict(self.counts)
+
+
+class CheckboxStat:
+    """checkbox: one count per option."""
+
+    def __init__(self, question):
+        self.n = 0
+        self.counts = {opt: 0 for opt in question.get('options') or []}
+
+    def add(self, ans):
+        self.n += 1
+        for item in ans:
+            self.counts[item] += 1
+
+    def add_item(self, item, count=1):
+        self.counts[item] += count
+
+    def data(self):
+        return dict(self.counts)
+
+
+class RatingStat:
+    """rating: average / min / max / distribution of the answers."""
+
+    def __init__(self, question):
+        self.n = 0
+        self.total = 0
+        self.distribution = {}
+
+    def add(self, ans, count=1):
+        self.n += count
+        self.total += ans * count
+        self.distribution[ans] = self.distribution.get(ans, 0) + count
+
+    def data(self):
+        if not self.n:
+            return {"average": 0, "distribution": {}}
+        return {
+            "average": round(self.total / self.n, 2),
+            "min": min(self.distribution),
+            "max": max(self.distribution),
+            "distribution": self.distribution
+        }
+
+
+class TextStat:
+    """text: the most recent answers only."""
+
+    def __init__(self, question):
+        self.n = 0
+        self.recent = deque(maxlen=RECENT_TEXT_ANSWERS)
+
+    def add(self, ans):
+        self.n += 1
+        self.recent.append(ans)
+
+    def data(self):
+        return {"recent_answers": list(self.recent)}
+
+
+class PlainStat:
+    """Unknown question types: only the number of answers."""
+
+    def __init__(self, question):
+        self.n = 0
+
+    def add(self, ans):
+        self.n += 1
+
+    def data(self):
+        return {}
+
+
+ACCUMULATORS = {
+    'radio': ChoiceStat,
+    'select': ChoiceStat,
+    'checkbox': CheckboxStat,
+    'rating': RatingStat,
+    'text': TextStat,
+}
+
+
+def _new_accumulators(survey):
+    return [
+        (str(q.get('id')), ACCUMULATORS.get(q.get('type'), PlainStat)(q))
+        for q in survey.get('questions', [])
+    ]
+
+
+def _format(survey, accumulators):
+    stats = []
+    for question, (q_id, acc) in zip(survey.get('questions', []), accumulators):
+        stats.append({
+            "id": q_id,
+            "text": question.get('text'),
+            "type": question.get('type'),
+            "total_answers": acc.n,
+            "data": acc.data()
+        })
+    return stats
+
+
+def segment_values(question):
+    """The segments of a ``by`` question, in display order."""
+    if question.get('type') == 'rating':
+        low, high = answer_validation.RATING_RANGE
+        return list(range(low, high + 1))
+    return list(question.get('options') or [])
+
+
+def _format_segments(survey, by, per_segment, segment_totals):
+    segments = []
+    for value in segment_values(survey['questions'][by]):
+        accumulators = per_segment.get(value) or _new_accumulators(survey)
+        segments.append({
+            "value": value,
+            "total_respondents": segment_totals.get(value, 0),
+            "results": _format(survey, accumulators)
+        })
+    return segments
+
+
+def _output(survey, by, per_segment, segment_totals, total):
+    """(stats, total) without ``by``, (segments, total) with it."""
+    if by is None:
+        return _format(survey, per_segment.get(None) or _new_accumulators(survey)), total
+    return _format_segments(survey, by, per_segment, segment_totals), total
+
+
+def parse_segmentation(survey, filters, by):
+    """
+    Validate the ``filter`` (list of "<question id>:<value>") and ``by``
+    (question id) query params. Returns (filters, by) as used by ``compute``:
+    {question position: [values]} and a position or None. Raises ValueError.
+    """
+    questions = survey.get('questions', [])
+    positions = {str(q.get('id')): i for i, q in enumerate(questions)}
+    validator = answer_validation.for_survey(survey)
+
+    parsed = {}
+    for raw in filters:
+        q_id, sep, value = raw.partition(':')
+        if not sep or q_id not in positions:
+            raise ValueError(f"Invalid filter {raw!r}: expected <question id>:<value>")
+        i = positions[q_id]
+        q_type = questions[i].get('type')
+        if q_type not in SEGMENT_TYPES:
+            raise ValueError(f"Cannot filter on question {q_id} ({q_type})")
+        # Same normalization as submitted answers ("4" -> 4 for ratings)
+        clean = validator.clean(q_id, [value] if q_type == 'checkbox' else value)
+        if clean is answer_validation.INVALID:
+            raise ValueError(f"Invalid filter {raw!r}: not an answer to question {q_id}")
+        values = parsed.setdefault(i, [])
+        for v in clean if q_type == 'checkbox' else [clean]:
+            if v not in values:
+                values.append(v)
+
+    if by is not None:
+        if by not in positions:
+            raise ValueError(f"Unknown question {by!r}")
+        by = positions[by]
+        if questions[by].get('type') not in SEGMENT_TYPES:
+            raise ValueError("by must be a radio, select, checkbox or rating question")
+    return parsed, by
+
+
+# --- PYTHON SINGLE PASS ---
+
+def _matches(survey, answers, filters):
+    questions = survey['questions']
+    for i, values in filters.items():
+        ans = answers.get(str(questions[i].get('id')))
+        if ans is None:
+            return False
+        if isinstance(ans, list):
+            if not any(item in values for item in ans):
+                return False
+        elif ans not in values:
+            return False
+    return True
+
+
+def run_single_pass(survey, responses, filters=None, by=None):
+    """
+    Compute (stats, total_respondents) in one pass over an iterable of
+    responses; (segments, total_respondents) with ``by``.
+    """
+    per_segment, segment_totals = {}, {}
+    by_id = str(survey['questions'][by].get('id')) if by is not None else None
+    total = 0
+
+    for r in responses:
+        answers = answer_codec.answers_of(survey, r)
+        if filters and not _matches(survey, answers, filters):
+            continue
+
+        if by_id is None:
+            segments = [None]
+        else:
+            ans = answers.get(by_id)
+            if ans is None:
+                continue
+            segments = ans if isinstance(ans, list) else [ans]
+        total += 1
+
+        for segment in segments:
+            segment_totals[segment] = segment_totals.get(segment, 0) + 1
+            accumulators = per_segment.get(segment)
+            if accumulators is None:
+                accumulators = per_segment[segment] = _new_accumulators(survey)
+            for q_id, acc in accumulators:
+                ans = answers.get(q_id)
+                if ans is not None:
+                    acc.add(ans)
+
+    return _output(survey, by, per_segment, segment_totals, total)
+
+
+# --- MONGODB AGGREGATION PIPELINE ---
+
+def _not_null(field):
+    return {'$match': {field: {'$ne': None}}}
+
+
+def _valid_checkbox_expr(field, options):
+    # Same rule as answer_validation: a list of distinct options
+    value = f'${field}'
+    return {'$cond': [
+        {'$isArray': value},
+        {'$and': [
+            {'$setIsSubset': [value, {'$literal': options}]},
+            {'$eq': [{'$size': value}, {'$size': {'$setUnion': [value, []]}}]},
+        ]},
+        False
+    ]}
+
+
+def _valid_checkbox(field, options):
+    return {'$match': {'$expr': _valid_checkbox_expr(field, options)}}
+
+
+def _as_rating(field):
+    return {'$convert': {'input': f'${field}', 'to': 'int', 'onError': None, 'onNull': None}}
+
+
+def _encoded_filter(question, i, values):
+    """Match on the stored format 2 value of question ``i``; format 1 responses pass."""
+    q_type = question.get('type')
+    options = question.get('options') or []
+    if q_type in CHOICE_TYPES:
+        encoded = {'$in': [options.index(v) for v in values]}
+    elif q_type == 'checkbox':
+        if len(options) > answer_codec.MAX_BITMASK_OPTIONS:
+            return None  # stored as {x: [...]}, see answer_codec
+        encoded = {'$bitsAnySet': [options.index(v) for v in values]}
+    else:
+        encoded = {'$in': values}
+    return {'$or': [{'v': 2, f'a.{i}': encoded}, {'v': {'$ne': 2}}]}
+
+
+def _decoded_filter(question, i, values):
+    """Match on the decoded value ``v<i>`` (both formats), valid answers only."""
+    field = f'v{i}'
+    q_type = question.get('type')
+    if q_type == 'checkbox':
+        return {'$and': [{field: {'$in': values}},
+                         {'$expr': _valid_checkbox_expr(field, question.get('options') or [])}]}
+    if q_type == 'rating':
+        # Responses stored before validation may hold the rating as a string
+        return {field: {'$in': values + [str(v) for v in values]}}
+    return {field: {'$in': values}}
+
+
+def _segment_stages(question):
+    """Keep the responses with a valid answer to the ``by`` question, in ``seg``."""
+    q_type = question.get('type')
+    options = question.get('options') or []
+    if q_type in CHOICE_TYPES:
+        return [{'$match': {'seg': {'$in': options}}}]
+    if q_type == 'checkbox':
+        return [_valid_checkbox('seg', options)]
+    low, high = answer_validation.RATING_RANGE
+    return [
+        {'$match': {'seg': {'$type': ['int', 'long', 'string']}}},
+        {'$set': {'seg': _as_rating('seg')}},
+        {'$match': {'seg': {'$gte': low, '$lte': high}}},
+    ]
+
+
+def build_pipeline(survey, filters=None, by=None):
+    """One $facet aggregation computing every question's totals server-side."""
+    questions = survey.get('questions', [])
+    project = {'_id': 0}
+    facets = {'total': [{'$count': 'n'}]}
+
+    # Without ``by`` the facets group by answer only; with it by (segment, answer)
+    prefix = []
+    if by is not None and questions[by].get('type') == 'checkbox':
+        prefix = [{'$unwind': '$seg'}]
+
+    def key(expr):
+        return expr if by is None else {'s': '$seg', 'v': expr}
+
+    def count():
+        return {'$count': 'n'} if by is None else {'$group': {'_id': '$seg', 'n': {'$sum': 1}}}
+
+    for i, question in enumerate(questions):
+        field = f'v{i}'
+        q_type = question.get('type')
+        options = question.get('options') or []
+        # $getField: question ids are user data and may contain '.' or '$'
+        project[field] = {'$cond': [
+            {'$eq': ['$v', 2]},
+            answer_codec.decode_expr(question, i),
+            {'$getField': {'field': str(question.get('id')), 'input': '$answers'}}
+        ]}
+
+        # Each facet only keeps the values answer_validation accepts
+        # (responses stored before validation may hold anything)
+        if q_type in CHOICE_TYPES:
+            facets[f'q{i}'] = prefix + [
+                {'$match': {field: {'$in': options}}},
+                {'$group': {'_id': key(f'${field}'), 'count': {'$sum': 1}}}
+            ]
+
+        elif q_type == 'checkbox':
+            facets[f'q{i}'] = prefix + [_valid_checkbox(field, options), count()]
+            facets[f'q{i}_items'] = prefix + [
+                _valid_checkbox(field, options),
+                {'$unwind': f'${field}'},
+                {'$group': {'_id': key(f'${field}'), 'count': {'$sum': 1}}}
+            ]
+
+        elif q_type == 'rating':
+            low, high = answer_validation.RATING_RANGE
+            rating_key = '_id' if by is None else '_id.v'
+            facets[f'q{i}'] = prefix + [
+                {'$match': {field: {'$type': ['int', 'long', 'string']}}},
+                {'$group': {'_id': key(_as_rating(field)), 'count': {'$sum': 1}}},
+                {'$match': {rating_key: {'$gte': low, '$lte': high}}}
+            ]
+
+        elif q_type == 'text':
+            facets[f'q{i}'] = prefix + [
+                {'$match': {field: {'$type': 'string'}}},
+                {'$group': {
+                    '_id': None if by is None else '$seg',
+                    'n': {'$sum': 1},
+                    'recent': {'$lastN': {'n': RECENT_TEXT_ANSWERS, 'input': f'${field}'}}
+                }}
+            ]
+
+        else:
+            facets[f'q{i}'] = prefix + [_not_null(field), count()]
+
+    match = {'survey_id': survey['_id']}
+    encoded = [_encoded_filter(questions[i], i, values) for i, values in (filters or {}).items()]
+    if any(encoded):
+        match['$and'] = [e for e in encoded if e]
+
+    pipeline = [
+        {'$match': match},
+        {'$sort': {'_id': 1}},
+        {'$replaceWith': {'v': '$v', 'a': '$a', 'answers': {
+            '$cond': [{'$eq': [{'$type': '$answers'}, 'object']}, '$answers', {'$literal': {}}]
+        }}},
+    ]
+    if by is not None:
+        project['seg'] = project[f'v{by}']
+    pipeline.append({'$project': project})
+    if filters:
+        pipeline.append({'$match': {'$and': [
+            _decoded_filter(questions[i], i, values) for i, values in filters.items()
+        ]}})
+    if by is not None:
+        pipeline += _segment_stages(questions[by])
+        facets['segments'] = prefix + [{'$group': {'_id': '$seg', 'n': {'$sum': 1}}}]
+    pipeline.append({'$facet': facets})
+    return pipeline
+
+
+def run_pipeline(db, survey, filters=None, by=None):
+    """
+    Compute (stats, total_respondents) inside MongoDB; (segments,
+    total_respondents) with ``by``.
+    """
+    facet = next(db.responses.aggregate(build_pipeline(survey, filters, by)), {})
+    per_segment = {}
+
+    def accumulator(segment, i):
+        accumulators = per_segment.get(segment)
+        if accumulators is None:
+            accumulators = per_segment[segment] = _new_accumulators(survey)
+        return accumulators[i][1]
+
+    def split(row_id):
+        return (None, row_id) if by is None else (row_id['s'], row_id['v'])
+
+    for i, question in enumerate(survey.get('questions', [])):
+        acc_type = ACCUMULATORS.get(question.get('type'), PlainStat)
+
+        for row in facet.get(f'q{i}', []):
+            if acc_type in (ChoiceStat, RatingStat):
+                segment, value = split(row['_id'])
+                accumulator(segment, i).add(value, row['count'])
+            elif acc_type is TextStat:
+                acc = accumulator(row['_id'], i)
+                acc.n = row['n']
+                acc.recent.extend(row['recent'])
+            else:
+                # $count rows have no _id: no segment
+                accumulator(row.get('_id'), i).n = row['n']
+
+        for row in facet.get(f'q{i}_items', []):
+            segment, value = split(row['_id'])
+            accumulator(segment, i).add_item(value, row['count'])
+
+    segment_totals = {row['_id']: row['n'] for row in facet.get('segments', [])}
+    total = facet['total'][0]['n'] if facet.get('total') else 0
+    return _output(survey, by, per_segment, segment_totals, total)
+
+
+# --- ENTRY POINT ---
+
+def compute(db, survey, engine='pipeline', filters=None, by=None):
+    """
+    Compute (stats, total_respondents) for a survey from the raw responses,
+    or (segments, total_respondents) with ``by``.
+    The pipeline is tried first unless engine='python'.
+    """
+    if engine != 'python':
+        try:
+            return run_pipeline(db, survey, filters, by)
+        except OperationFailure:
+            # e.g. MongoDB < 5.2 ($getField / $lastN unsupported)
+            pass
+
+    cursor = db.responses.find(
+        {'survey_id': survey['_id']}, {'_id': 0, **answer_codec.FIELDS}
+    ).sort('_id', 1).batch_size(CURSOR_BATCH_SIZE)
+    return run_single_pass(survey, cursor, filters, by)
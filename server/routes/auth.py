@@ -1,16 +1,20 @@
-from flask import Blueprint, request, jsonify, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, request, jsonify, current_app, g
 import jwt
+from pymongo.errors import DuplicateKeyError
 import datetime
 from functools import wraps
+from database import mongo
 from validation import UserRegisterSchema, UserLoginSchema, ValidationError
+from passwords import hasher, PoolSaturated
 
 auth_bp = Blueprint('auth', __name__)
 
 def get_db():
-    from app import mongo
     return mongo.db
 
+def get_login_throttle():
+    return current_app.extensions['login_throttle']
+
 # --- Helper Decorator ---
 def anonymous_required(f):
     """
@@ -19,32 +23,14 @@ def anonymous_required(f):
     """
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        
-        # Check for Authorization header
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header and auth_header.startswith('Bearer '):
-                token = auth_header.split(" ")[1]
-        
-        if token:
-            try:
-                # Attempt to decode the token
-                jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-                
-                # If decoding is successful, the user is already authenticated
-                return jsonify({
-                    "error": "You are already logged in.",
-                    "message": "Please logout to access this resource."
-                }), 403
-                
-            except jwt.ExpiredSignatureError:
-                # Token expired, allow them to proceed (to login again)
-                pass
-            except jwt.InvalidTokenError:
-                # Token invalid, allow them to proceed
-                pass
-                
+        # g.user_id is only set for a valid token (see auth_middleware.load_auth);
+        # expired or invalid tokens are allowed to proceed (to login again)
+        if g.user_id:
+            return jsonify({
+                "error": "You are already logged in.",
+                "message": "Please logout to access this resource."
+            }), 403
+
         return f(*args, **kwargs)
     return decorated
 
@@ -59,11 +45,10 @@ def register():
     except ValidationError as e:
         return jsonify({"error": "Invalid data", "details": e.errors()}), 400
 
-    db = get_db()
-    if db.users.find_one({'email': data.email}):
-        return jsonify({"error": "Email already registered"}), 409
-
-    hashed_pw = generate_password_hash(data.password)
+    try:
+        hashed_pw = hasher.hash(data.password)
+    except PoolSaturated:
+        return jsonify({"error": "Server busy, please retry shortly"}), 503
     
     user_doc = {
         'name': data.name,
@@ -73,7 +58,12 @@ def register():
         'role': 'user'
     }
     
-    db.users.insert_one(user_doc)
+    # The unique index on users.email rejects duplicates
+    try:
+        get_db().users.insert_one(user_doc)
+    except DuplicateKeyError:
+        return jsonify({"error": "Email already registered"}), 409
+
     return jsonify({"message": "Account created successfully"}), 201
 
 @auth_bp.route('/login', methods=['POST'])
@@ -84,11 +74,35 @@ def login():
     except ValidationError:
         return jsonify({"error": "Invalid format"}), 400
 
+    # Reject before any hashing when this IP / email has failed too often.
+    # remote_addr is the client's IP behind PROXY_COUNT proxies (ProxyFix, see app.py)
+    login_throttle = get_login_throttle()
+    ip, email = request.remote_addr, data.email.lower()
+    retry_after = login_throttle.retry_after(ip, email)
+    if retry_after:
+        return jsonify({"error": "Too many failed attempts, please retry later"}), 429, \
+            {'Retry-After': str(retry_after)}
+
     db = get_db()
     user = db.users.find_one({'email': data.email})
 
-    if not user or not check_password_hash(user['password'], data.password):
+    try:
+        valid = user is not None and hasher.verify(user['password'], data.password)
+    except PoolSaturated:
+        return jsonify({"error": "Server busy, please retry shortly"}), 503
+
+    if not valid:
+        login_throttle.record_failure(ip, email)
         return jsonify({"error": "Invalid email or password"}), 401
+    login_throttle.reset(email)
+
+    # Transparently upgrade hashes made with older parameters
+    if hasher.needs_rehash(user['password']):
+        try:
+            db.users.update_one({'_id': user['_id']},
+                                {'$set': {'password': hasher.hash(data.password)}})
+        except PoolSaturated:
+            pass  # next login will retry
 
     # Create JWT Token
     token_payload = {
@@ -1,53 +1,92 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+import calendar
 import datetime
-import jwt
+import hashlib
+import json
+import aggregates
+import answer_codec
+import answer_validation
+import sampling
+import text_search
+import timeseries
+from cache import public_survey_key
+from database import mongo
+from ingest import BufferFull
+from reaper import ACTIVE
 
 public_bp = Blueprint('public', __name__)
 
 def get_db():
-    from app import mongo
     return mongo.db
 
+def get_cache():
+    return current_app.extensions['cache']
+
+def get_live_hub():
+    return current_app.extensions['live_hub']
+
+def get_ingest_buffer():
+    return current_app.extensions['ingest_buffer']
+
+# Corps des réponses 401 selon auth_middleware (partagés avec asgi.py)
+AUTH_ERRORS = {'expired': {"error": "Session expired"}, 'invalid': {"error": "Invalid token"}}
+
 def get_user_id_from_token():
     """
-    Récupère l'ID depuis le token JWT.
-    Compatible avec votre token qui utilise 'user_id'.
+    Récupère l'ID depuis le contexte d'authentification (auth_middleware.load_auth).
+    Retourne (user_id, None), (None, None) sans token, ou (None, réponse 401).
     """
-    auth_header = request.headers.get('Authorization')
-    
-    # DEBUG: Voir si le token arrive bien au serveur
-    if not auth_header:
-        print("DEBUG: Aucun header Authorization reçu.")
-        return None, None
-    
-    try:
-        parts = auth_header.split(" ")
-        if len(parts) != 2 or parts[0].lower() != 'bearer':
-             print(f"DEBUG: Header malformé: {auth_header}")
-             return None, None
-             
-        token = parts[1]
-        
-        # Décodage
-        payload = jwt.decode(
-            token, 
-            current_app.config['SECRET_KEY'], 
-            algorithms=["HS256"]
-        )
-        
-        # Votre token utilise 'user_id', on le récupère ici
-        user_id = payload.get('user_id')
-        
-        print(f"DEBUG: Token décodé avec succès. User ID: {user_id}")
-        return user_id, None
+    if g.auth_error:
+        return None, (jsonify(AUTH_ERRORS[g.auth_error]), 401)
+    return g.user_id, None
 
-    except jwt.ExpiredSignatureError:
-        print("DEBUG: Token expiré")
-        return None, (jsonify({"error": "Session expired"}), 401)
-    except jwt.InvalidTokenError as e:
-        print(f"DEBUG: Token invalide: {str(e)}")
-        return None, (jsonify({"error": "Invalid token"}), 401)
+
+# Champs du sondage exposés publiquement (pas de is_active, response_count...)
+PUBLIC_SURVEY_PROJECTION = {'title': 1, 'description': 1, 'questions': 1, 'created_by': 1,
+                            'created_at': 1, 'updated_at': 1, 'version': 1}
+
+def load_public_survey(db, survey_id):
+    """
+    Public payload of a survey (without the per-user has_responded flag),
+    read through the cache. Returns None if the survey does not exist.
+    """
+    cache = get_cache()
+    key = public_survey_key(survey_id)
+
+    cached = cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    survey = db.surveys.find_one({'_id': ObjectId(survey_id), **ACTIVE}, PUBLIC_SURVEY_PROJECTION)
+    if not survey:
+        return None
+
+    entry = public_entry(survey)
+    cache.set(key, json.dumps(entry))
+    return entry
+
+def public_entry(survey):
+    """Cache entry {payload, etag, version, last_modified} of a survey document."""
+    payload = {
+        "_id": str(survey['_id']),
+        "title": survey.get('title'),
+        "description": survey.get('description'),
+        "questions": survey.get('questions', []),
+        "created_by": str(survey.get('created_by'))
+    }
+    body = json.dumps(payload, sort_keys=True)
+    modified = survey.get('updated_at') or survey.get('created_at')
+
+    entry = {
+        "payload": payload,
+        "etag": hashlib.sha1(body.encode()).hexdigest(),
+        "version": survey.get('version', 1),
+        # pymongo returns naive UTC datetimes
+        "last_modified": calendar.timegm(modified.utctimetuple()) if modified else None
+    }
+    return entry
 
 
 @public_bp.route('/surveys/<survey_id>', methods=['GET'])
@@ -60,30 +99,35 @@ def get_public_survey(survey_id):
         return jsonify({"error": "Invalid Survey ID"}), 400
     
     db = get_db()
-    survey = db.surveys.find_one({'_id': ObjectId(survey_id)})
+    entry = load_public_survey(db, survey_id)
     
-    if not survey:
+    if not entry:
         return jsonify({"error": "Survey not found"}), 404
     
-    # Logique pour vérifier si l'utilisateur a déjà répondu
+    # Jamais mis en cache: requête couverte par l'index (survey_id, user_id)
     has_responded = False
     if user_id:
-         existing_response = db.responses.find_one({
-             'survey_id': ObjectId(survey_id),
-             'user_id': str(user_id) 
-         })
-         if existing_response:
-             has_responded = True
-    
-    public_data = {
-        "_id": str(survey['_id']),
-        "title": survey.get('title'),
-        "description": survey.get('description'),
-        "questions": survey.get('questions', []),
-        "created_by": str(survey.get('created_by')),
-        "has_responded": has_responded
-    }
-    return jsonify(public_data), 200
+        has_responded = db.responses.find_one(
+            {'survey_id': ObjectId(survey_id), 'user_id': str(user_id)},
+            {'_id': 0, 'user_id': 1}
+        ) is not None
+
+    # L'ETag dépend aussi de has_responded, qui fait partie du corps
+    response = current_app.response_class(mimetype='application/json')
+    response.set_etag(entry['etag'] + ('-r' if has_responded else ''))
+    if entry['last_modified']:
+        response.last_modified = entry['last_modified']
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+
+    # 304 sans corps si le client a déjà cette version
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    public_data = dict(entry['payload'], has_responded=has_responded)
+    response.set_data(current_app.json.dumps(public_data))
+    return response
 
 
 @public_bp.route('/surveys/<survey_id>/respond', methods=['POST'])
@@ -99,34 +143,78 @@ def submit_response(survey_id):
         return jsonify({"error": "Invalid ID"}), 400
         
     data = request.json
-    answers = data.get('answers')
 
     db = get_db()
-    survey = db.surveys.find_one({'_id': ObjectId(survey_id)})
+    # Même cache que get_public_survey: pas d'aller-retour Mongo dans le cas courant
+    entry = load_public_survey(db, survey_id)
     
-    if not survey:
+    if not entry:
         return jsonify({"error": "Survey not found"}), 404
 
-    # Bloquer le créateur
-    if str(user_id) == str(survey.get('created_by')):
-        return jsonify({"error": "You cannot submit a response to your own survey."}), 403
-
-    # Bloquer les doublons
-    existing_response = db.responses.find_one({
-        'survey_id': ObjectId(survey_id),
-        'user_id': str(user_id)
-    })
-    if existing_response:
+    prepared, error = prepare_response(entry, survey_id, user_id, data,
+                                       current_app.config['ANSWER_FORMAT'])
+    if error:
+        return jsonify(error[0]), error[1]
+    survey, answers, response_doc = prepared
+
+    # Mode 'buffered': écriture groupée en arrière-plan (voir ingest.py),
+    # les doublons sont écartés par l'index unique au moment du flush
+    ingest_buffer = get_ingest_buffer()
+    if ingest_buffer is not None:
+        try:
+            ingest_buffer.enqueue(response_doc, aggregates.build_update(survey, answers))
+        except BufferFull:
+            return jsonify({"error": "Too many submissions, please retry shortly"}), 503
+        return jsonify({"message": "Response accepted"}), 202
+
+    # Bloquer les doublons: l'index unique (survey_id, user_id) fait la vérification
+    try:
+        db.responses.insert_one(response_doc)
+    except DuplicateKeyError:
         return jsonify({"error": "You have already responded to this survey"}), 409
 
+    # Le cache a pu servir un sondage supprimé depuis: le compteur n'est
+    # incrémenté que s'il est toujours actif, sinon la réponse est retirée
+    counted = db.surveys.update_one({'_id': survey['_id'], **ACTIVE}, {'$inc': {'response_count': 1}})
+    if counted.matched_count == 0:
+        db.responses.delete_one({'_id': response_doc['_id']})
+        get_cache().delete(public_survey_key(survey_id))
+        return jsonify({"error": "Survey not found"}), 404
+
+    update = aggregates.build_update(survey, answers)
+    aggregates.apply_response(db, survey, answers, update)
+    timeseries.record(db, survey['_id'], response_doc['submitted_at'], update)
+    text_search.record(db, response_doc, update)
+    get_live_hub().publish_local(response_doc)
+
+    return jsonify({"message": "Response recorded successfully"}), 201
+
+def prepare_response(entry, survey_id, user_id, data, answer_format):
+    """
+    Vérifie une soumission et construit le document à insérer.
+    Retourne ((survey, answers, response_doc), None) ou (None, (corps, statut)).
+    """
+    # Bloquer le créateur
+    if str(user_id) == entry['payload']['created_by']:
+        return None, ({"error": "You cannot submit a response to your own survey."}, 403)
+
+    survey = {'_id': ObjectId(survey_id), 'questions': entry['payload']['questions'],
+              'version': entry.get('version', 1)}
+
+    # Validateur compilé une fois par version du sondage (voir answer_validation.py)
+    answers = data.get('answers') if isinstance(data, dict) else None
+    answers, errors = answer_validation.for_survey(survey).validate(answers)
+    if errors:
+        return None, ({"error": "Invalid answers", "details": errors}, 400)
+
     response_doc = {
-        'survey_id': ObjectId(survey_id),
+        '_id': ObjectId(),
+        'survey_id': survey['_id'],
         'user_id': str(user_id),
-        'answers': answers,
-        'submitted_at': datetime.datetime.utcnow()
+        'submitted_at': datetime.datetime.utcnow(),
+        # Clé d'échantillonnage des résultats approchés (voir sampling.py)
+        'r': sampling.sampling_key()
     }
-
-    db.responses.insert_one(response_doc)
-    db.surveys.update_one({'_id': ObjectId(survey_id)}, {'$inc': {'response_count': 1}})
-
-    return jsonify({"message": "Response recorded successfully"}), 201
\ No newline at end of file
+    # Format compact par défaut (voir answer_codec.py)
+    response_doc.update(answer_codec.encode(survey, answers, answer_format))
+    return (survey, answers, response_doc), None
@@ -1,36 +1,45 @@
-from flask import Blueprint, request, jsonify, g, current_app
+from flask import Blueprint, request, jsonify, g, current_app, Response, stream_with_context
 from functools import wraps
-import jwt
 from bson.objectid import ObjectId
 import datetime
+import queue
 from validation import SurveyCreateSchema, ValidationError
+from pagination import InvalidCursor, parse_limit, decode_cursor, encode_cursor, after_filter
+import aggregates
+import answer_codec
+import export
+from live import RESYNC, TooManyStreams
+from reaper import ACTIVE, tombstone
+from cache import invalidate_survey
+from database import mongo
+import results_engine
+import sampling
+import text_search
+import timeseries
 
 survey_bp = Blueprint('survey', __name__)
 
 def get_db():
-    from app import mongo
     return mongo.db
 
+def get_cache():
+    return current_app.extensions['cache']
+
+def get_reaper():
+    return current_app.extensions['reaper']
+
+def get_live_hub():
+    return current_app.extensions['live_hub']
+
 # --- Security Middleware (Decorator) ---
 def token_required(f):
+    # The token itself is verified once per request by auth_middleware.load_auth
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        # Expecting header: Authorization: Bearer <TOKEN>
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header.startswith("Bearer "):
-                token = auth_header.split(" ")[1]
-        
-        if not token:
+        if not g.user_id:
+            if g.auth_error:
+                return jsonify({'error': 'Invalid or expired token'}), 401
             return jsonify({'error': 'Missing token'}), 401
-        
-        try:
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            g.user_id = data['user_id'] # Store ID in global context 'g'
-        except:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-            
         return f(*args, **kwargs)
     return decorated
 
@@ -48,123 +57,335 @@ def create_survey():
         'created_by': g.user_id,
         'created_at': datetime.datetime.utcnow(),
         'is_active': True,
-        'response_count': 0
+        'response_count': 0,
+        # Bump whenever questions change: compiled answer validators are keyed by it
+        'version': 1
     })
 
     db = get_db()
     res = db.surveys.insert_one(survey_doc)
-    return jsonify({"message": "Survey created", "id": str(res.inserted_id)}), 201
+    aggregates.create(db, res.inserted_id)
+    return jsonify({"message": "Survey created", "id": res.inserted_id}), 201
+
+# Fields returned by the survey list; 'questions' only when asked for explicitly
+SURVEY_LIST_FIELDS = {'title', 'description', 'is_active', 'response_count',
+                      'created_at', 'created_by', 'questions'}
+SURVEY_SUMMARY_FIELDS = SURVEY_LIST_FIELDS - {'questions'}
 
 @survey_bp.route('/', methods=['GET'])
 @token_required
 def get_my_surveys():
+    """
+    Paginated list of the user's surveys, newest first.
+    Query params: limit, after (cursor from the previous page's next_cursor),
+    fields (comma-separated, defaults to every field except questions).
+    The first page also carries the totals of every survey of the user.
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        after = request.args.get('after')
+        after = decode_cursor(after, (datetime.datetime, ObjectId)) if after else None
+    except InvalidCursor:
+        return jsonify({"error": "Invalid cursor"}), 400
+    except ValueError as e:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(e)}), 400
+
+    fields = SURVEY_SUMMARY_FIELDS
+    if request.args.get('fields'):
+        fields = {f.strip() for f in request.args['fields'].split(',')} & SURVEY_LIST_FIELDS
+    # _id and created_at are always returned: they make up the cursor
+    projection = dict.fromkeys(fields | {'created_at'}, 1)
+
+    query = {'created_by': g.user_id, **ACTIVE}
+    if after:
+        query.update(after_filter(after, 'created_at'))
+
     db = get_db()
-    cursor = db.surveys.find({'created_by': g.user_id}).sort("created_at", -1)
-    
-    surveys = []
-    for s in cursor:
-        s['_id'] = str(s['_id'])
-        surveys.append(s)
-    return jsonify(surveys), 200
+    cursor = (db.surveys.find(query, projection)
+              .sort([('created_at', -1), ('_id', -1)])
+              .limit(limit + 1))
+    dumps = current_app.json.dumps
+
+    def generate():
+        # Stream {"surveys": [...], "next_cursor": ...} one survey at a time
+        yield '{"surveys":['
+        last, count, next_cursor = None, 0, None
+        for s in cursor:
+            if count == limit:
+                # limit + 1 documents were fetched: there is another page
+                next_cursor = encode_cursor(*last)
+                break
+            last = (s['created_at'], s['_id'])
+            yield (',' if count else '') + dumps(s)
+            count += 1
+
+        yield '],"next_cursor":' + dumps(next_cursor)
+        if not after:
+            yield ',"totals":' + dumps(survey_totals(db, g.user_id))
+        yield '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
+
+def survey_totals(db, user_id):
+    """Counts over every active survey of a user, one $group on the created_by index."""
+    totals = next(db.surveys.aggregate([
+        {'$match': {'created_by': user_id, **ACTIVE}},
+        {'$group': {
+            '_id': None,
+            'surveys': {'$sum': 1},
+            'active_surveys': {'$sum': {'$cond': ['$is_active', 1, 0]}},
+            'responses': {'$sum': '$response_count'},
+        }},
+    ]), None)
+    if totals is None:
+        return {'surveys': 0, 'active_surveys': 0, 'responses': 0}
+    del totals['_id']
+    return totals
 
 @survey_bp.route('/<survey_id>/results', methods=['GET'])
 @token_required
 def get_results(survey_id):
+    """
+    All-time results, or with any of from / to / granularity=hour|day the
+    results of that time range, per bucket and in total (see timeseries.py).
+
+    filter=<question id>:<value> (repeatable) restricts the results to the
+    matching respondents, by=<question id> splits them per answer to that
+    question (see results_engine.py). approximate=1 estimates those from a
+    sample on surveys past APPROX_RESULTS_MIN_RESPONSES (see sampling.py).
+    """
     if not ObjectId.is_valid(survey_id):
         return jsonify({"error": "Invalid ID"}), 400
         
     db = get_db()
-    survey = db.surveys.find_one({'_id': ObjectId(survey_id)})
+    survey = db.surveys.find_one({'_id': ObjectId(survey_id), **ACTIVE})
     
     if not survey: return jsonify({"error": "Survey not found"}), 404
     if survey['created_by'] != g.user_id:
         return jsonify({"error": "Access denied"}), 403
-        
-    responses = list(db.responses.find({'survey_id': ObjectId(survey_id)}))
-    
-    # --- STATISTICS CALCULATION ---
-    stats = []
 
-    for question in survey.get('questions', []):
-        q_id = str(question.get('id'))
-        q_type = question.get('type')
-        
-        question_stat = {
-            "id": q_id,
-            "text": question.get('text'),
-            "type": q_type,
-            "total_answers": 0,
-            "data": {} 
-        }
-
-        # Extract specific answers for this question
-        raw_answers = [
-            r.get('answers', {}).get(q_id) 
-            for r in responses 
-            if r.get('answers', {}).get(q_id) is not None
-        ]
-        
-        question_stat['total_answers'] = len(raw_answers)
-
-        # A: Radio / Select
-        if q_type in ['radio', 'select']:
-            counts = {opt: 0 for opt in question.get('options', [])}
-            for ans in raw_answers:
-                if ans in counts:
-                    counts[ans] += 1
-                else:
-                    counts["Other"] = counts.get("Other", 0) + 1
-            question_stat['data'] = counts
-
-        # B: Checkbox
-        elif q_type == 'checkbox':
-            counts = {opt: 0 for opt in question.get('options', [])}
-            for ans_list in raw_answers:
-                if isinstance(ans_list, list):
-                    for item in ans_list:
-                        if item in counts:
-                            counts[item] += 1
-            question_stat['data'] = counts
-
-        # C: Rating
-        elif q_type == 'rating':
-            numeric_answers = []
-            distribution = {}
-            for ans in raw_answers:
-                try:
-                    val = int(ans)
-                    numeric_answers.append(val)
-                    distribution[val] = distribution.get(val, 0) + 1
-                except (ValueError, TypeError):
-                    continue
-            
-            if numeric_answers:
-                average = sum(numeric_answers) / len(numeric_answers)
-                question_stat['data'] = {
-                    "average": round(average, 2),
-                    "min": min(numeric_answers),
-                    "max": max(numeric_answers),
-                    "distribution": distribution
-                }
-            else:
-                question_stat['data'] = {"average": 0, "distribution": {}}
-
-        # D: Text
-        elif q_type == 'text':
-            question_stat['data'] = {
-                "recent_answers": raw_answers[-5:] 
-            }
-
-        stats.append(question_stat)
-
-    survey['_id'] = str(survey['_id'])
-    survey['created_by'] = str(survey['created_by'])
+    if request.args.keys() & {'filter', 'by'}:
+        if request.args.keys() & {'from', 'to', 'granularity'}:
+            return jsonify({"error": "Invalid query",
+                            "details": "filter / by cannot be combined with a time range"}), 400
+        return segmented_results(db, survey)
 
-    return jsonify({
+    if request.args.keys() & {'from', 'to', 'granularity'}:
+        try:
+            start, end, granularity = timeseries.parse_range(request.args)
+        except ValueError as e:
+            return jsonify({"error": "Invalid range", "details": str(e)}), 400
+
+        buckets, stats, total_respondents = timeseries.range_results(db, survey, start, end, granularity)
+        return jsonify({
+            "survey_info": survey,
+            "from": start,
+            "to": end,
+            "granularity": granularity,
+            "buckets": buckets,
+            "results": stats,
+            "total_respondents": total_respondents
+        }), 200
+
+    return jsonify(results_payload(db, survey)), 200
+
+def segmented_results(db, survey):
+    """GET /results with filter / by: computed from the responses, or estimated."""
+    try:
+        filters, by = results_engine.parse_segmentation(
+            survey, request.args.getlist('filter'), request.args.get('by'))
+    except ValueError as e:
+        return jsonify({"error": "Invalid query", "details": str(e)}), 400
+
+    config = current_app.config
+    estimate = None
+    if (request.args.get('approximate') in ('1', 'true')
+            and survey.get('response_count', 0) >= config['APPROX_RESULTS_MIN_RESPONSES']):
+        estimate = sampling.approximate_results(db, survey, survey['response_count'],
+                                                config['APPROX_SAMPLE_SIZE'], filters, by)
+    if estimate is not None:
+        results, total_respondents, approximate = estimate
+    else:
+        results, total_respondents = results_engine.compute(
+            db, survey, engine=config['RESULTS_ENGINE'], filters=filters, by=by)
+        approximate = False
+
+    questions = survey.get('questions', [])
+    payload = {
+        "survey_info": survey,
+        "filters": {str(questions[i].get('id')): values for i, values in filters.items()},
+        "approximate": approximate,
+        "total_respondents": total_respondents
+    }
+    if by is None:
+        payload["results"] = results
+    else:
+        payload["by"] = str(questions[by].get('id'))
+        payload["segments"] = results
+    return jsonify(payload), 200
+
+def results_payload(db, survey):
+    """The GET /results body (also the snapshot of the live stream)."""
+    # --- STATISTICS (pre-aggregated, see aggregates.py) ---
+    stats_doc = db.survey_stats.find_one({'_id': survey['_id']})
+    if stats_doc is not None and stats_doc.get('built'):
+        stats, total_respondents = aggregates.to_results(survey, stats_doc)
+    else:
+        # Older surveys: no stats, or only those of the responses recorded
+        # since. Computed from the raw responses until flask rebuild-results
+        stats, total_respondents = results_engine.compute(
+            db, survey, engine=current_app.config['RESULTS_ENGINE'])
+
+    return {
         "survey_info": survey,
         "results": stats,
-        "total_respondents": len(responses)
-    }), 200
+        "total_respondents": total_respondents
+    }
+
+@survey_bp.route('/<survey_id>/results/stream', methods=['GET'])
+@token_required
+def stream_results(survey_id):
+    """
+    Server-Sent Events: a 'snapshot' event (same body as GET /results), then
+    'delta' events with per-question increments as responses come in (see live.py).
+    """
+    if not ObjectId.is_valid(survey_id):
+        return jsonify({"error": "Invalid ID"}), 400
+
+    db = get_db()
+    survey = db.surveys.find_one({'_id': ObjectId(survey_id), **ACTIVE})
+
+    if not survey: return jsonify({"error": "Survey not found"}), 404
+    if survey['created_by'] != g.user_id:
+        return jsonify({"error": "Access denied"}), 403
+
+    hub = get_live_hub()
+    # Subscribe before the snapshot so that no response falls in between
+    try:
+        subscriber = hub.subscribe(survey)
+    except TooManyStreams:
+        return jsonify({"error": "Too many live streams, please retry shortly"}), 503, \
+            {'Retry-After': '30'}
+    heartbeat = current_app.config['LIVE_HEARTBEAT_SECONDS']
+    dumps = current_app.json.dumps
+
+    def event(name, data):
+        return f'event: {name}\ndata: {dumps(data)}\n\n'
+
+    def snapshot():
+        return event('snapshot', hub.snapshot(survey['_id'], subscriber, lambda: results_payload(db, survey)))
+
+    def generate():
+        yield snapshot()
+        while True:
+            try:
+                delta = subscriber.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            yield snapshot() if delta is RESYNC else event('delta', delta)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # let nginx-style proxies pass events through
+    })
+    # Client gone (the next write fails) or server shutting down, even before the first event
+    response.call_on_close(lambda: hub.unsubscribe(survey['_id'], subscriber))
+    return response
+
+@survey_bp.route('/<survey_id>/export', methods=['GET'])
+@token_required
+def export_responses(survey_id):
+    """
+    Stream every response of a survey as CSV or NDJSON (see export.py).
+    Query params: format=csv|ndjson, gzip=1, after=<response_id> to resume
+    an interrupted export after the last row received.
+    """
+    if not ObjectId.is_valid(survey_id):
+        return jsonify({"error": "Invalid ID"}), 400
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return jsonify({"error": "Invalid format", "details": "Use csv or ndjson"}), 400
+
+    db = get_db()
+    survey = db.surveys.find_one({'_id': ObjectId(survey_id), **ACTIVE}, {'created_by': 1, 'questions': 1, 'version': 1})
+
+    if not survey: return jsonify({"error": "Survey not found"}), 404
+    if survey['created_by'] != g.user_id:
+        return jsonify({"error": "Access denied"}), 403
+
+    query = {'survey_id': survey['_id']}
+    after = request.args.get('after')
+    if after:
+        checkpoint = None
+        if ObjectId.is_valid(after):
+            checkpoint = db.responses.find_one(
+                {'_id': ObjectId(after), 'survey_id': survey['_id']}, {'submitted_at': 1})
+        if not checkpoint:
+            return jsonify({"error": "Invalid checkpoint"}), 400
+        query.update(after_filter([checkpoint['submitted_at'], checkpoint['_id']],
+                                  'submitted_at', direction=1))
+
+    cursor = (db.responses.find(query, {'user_id': 1, 'submitted_at': 1, **answer_codec.FIELDS})
+              .sort([('submitted_at', 1), ('_id', 1)])
+              .batch_size(export.EXPORT_CHUNK_ROWS))
+
+    encode, mimetype = export.FORMATS[fmt]
+    row_iter = export.rows(survey, cursor)
+    if after and fmt == 'csv':
+        next(row_iter)  # the client already has the header
+    chunks = encode(row_iter)
+
+    filename = f'survey-{survey_id}.{fmt}'
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = export.gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+@survey_bp.route('/<survey_id>/questions/<question_id>/answers', methods=['GET'])
+@token_required
+def search_text_answers(survey_id, question_id):
+    """
+    Paginated free-text answers to one text question (see text_search.py).
+    Query params: q (keywords ranked by relevance, word* for a prefix;
+    newest first without keywords), limit, after (next_cursor).
+    """
+    if not ObjectId.is_valid(survey_id):
+        return jsonify({"error": "Invalid ID"}), 400
+
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        keywords, prefixes = text_search.parse_query(request.args.get('q', ''))
+        # Ranked by textScore with keywords, else newest first (see text_search.search)
+        first = (int, float) if keywords else datetime.datetime
+        after = request.args.get('after')
+        after = decode_cursor(after, (first, ObjectId)) if after else None
+    except InvalidCursor:
+        return jsonify({"error": "Invalid cursor"}), 400
+    except ValueError as e:
+        return jsonify({"error": "Invalid query parameters", "details": str(e)}), 400
+
+    db = get_db()
+    survey = db.surveys.find_one({'_id': ObjectId(survey_id), **ACTIVE}, {'created_by': 1, 'questions': 1})
+
+    if not survey: return jsonify({"error": "Survey not found"}), 404
+    if survey['created_by'] != g.user_id:
+        return jsonify({"error": "Access denied"}), 403
+
+    questions = survey.get('questions', [])
+    position = next((i for i, q in enumerate(questions) if str(q.get('id')) == question_id), None)
+    if position is None:
+        return jsonify({"error": "Question not found"}), 404
+    if questions[position].get('type') != 'text':
+        return jsonify({"error": "Not a text question"}), 400
+
+    answers, next_cursor = text_search.search(db, survey['_id'], position, keywords, prefixes, limit, after)
+    return jsonify({"answers": answers, "next_cursor": next_cursor}), 200
 
 # ---------------------------------------------------------
 # NEW ROUTES ADDED BELOW (DELETE & TOGGLE STATUS)
@@ -179,7 +400,7 @@ def delete_survey(survey_id):
     db = get_db()
     
     # 1. Check if survey exists
-    survey = db.surveys.find_one({'_id': ObjectId(survey_id)})
+    survey = db.surveys.find_one({'_id': ObjectId(survey_id), **ACTIVE})
 
     if not survey:
         return jsonify({"error": "Survey not found"}), 404
@@ -188,13 +409,48 @@ def delete_survey(survey_id):
     if survey['created_by'] != g.user_id:
         return jsonify({"error": "Unauthorized action"}), 403
 
-    # 3. Delete the survey
-    db.surveys.delete_one({'_id': ObjectId(survey_id)})
-    
-    # 4. Clean up associated responses (Optional but recommended)
-    db.responses.delete_many({'survey_id': ObjectId(survey_id)})
+    # 3. Tombstone the survey: every endpoint treats it as gone from now on
+    if not tombstone(db, survey['_id']):
+        return jsonify({"error": "Survey not found"}), 404
+    aggregates.delete(db, survey['_id'])
+    invalidate_survey(get_cache(), survey_id)
+
+    # 4. Responses are removed in the background (see reaper.py)
+    reaper = get_reaper()
+    if reaper is not None:
+        reaper.wake()
+
+    return jsonify({
+        "message": "Survey deleted successfully",
+        "status_url": f"/api/surveys/{survey_id}/deletion"
+    }), 202
+
+@survey_bp.route('/<survey_id>/deletion', methods=['GET'])
+@token_required
+def deletion_status(survey_id):
+    """Progress of the background deletion of a survey's responses."""
+    if not ObjectId.is_valid(survey_id):
+        return jsonify({"error": "Invalid ID"}), 400
+
+    db = get_db()
+    survey = db.surveys.find_one(
+        {'_id': ObjectId(survey_id), 'deleted_at': {'$ne': None}},
+        {'created_by': 1, 'deleted_at': 1, 'deletion': 1, 'response_count': 1}
+    )
 
-    return jsonify({"message": "Survey deleted successfully"}), 200
+    if not survey:
+        return jsonify({"error": "Deletion not found"}), 404
+    if survey['created_by'] != g.user_id:
+        return jsonify({"error": "Access denied"}), 403
+
+    deletion = survey.get('deletion', {})
+    return jsonify({
+        "status": deletion.get('status'),
+        "deleted_responses": deletion.get('deleted_responses', 0),
+        "total_responses": survey.get('response_count', 0),
+        "deleted_at": survey['deleted_at'],
+        "completed_at": deletion.get('completed_at')
+    }), 200
 
 @survey_bp.route('/<survey_id>/status', methods=['PATCH'])
 @token_required
@@ -205,7 +461,7 @@ def toggle_survey_status(survey_id):
     db = get_db()
     
     # 1. Check if survey exists
-    survey = db.surveys.find_one({'_id': ObjectId(survey_id)})
+    survey = db.surveys.find_one({'_id': ObjectId(survey_id), **ACTIVE})
 
     if not survey:
         return jsonify({"error": "Survey not found"}), 404
@@ -219,9 +475,10 @@ def toggle_survey_status(survey_id):
     new_status = not current_status
 
     db.surveys.update_one(
-        {'_id': ObjectId(survey_id)},
-        {'$set': {'is_active': new_status}}
+        {'_id': ObjectId(survey_id), **ACTIVE},
+        {'$set': {'is_active': new_status, 'updated_at': datetime.datetime.utcnow()}}
     )
+    invalidate_survey(get_cache(), survey_id)
 
     return jsonify({
         "message": "Status updated", 
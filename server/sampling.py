@@ -0,0 +1,156 @@
+"""
+Approximate filtered / cross-tab results for very large surveys.
+
+Every response gets a uniform random sampling key ``r`` when it is stored.
+The APPROX_SAMPLE_SIZE responses of a survey with the smallest keys form a
+uniform random sample without replacement: a bottom-k reservoir, kept up to
+date by the (survey_id, r) index instead of by rewriting a reservoir at
+every insert. Reading it costs one index range scan of fixed size,
+whatever the number of responses.
+
+GET /results?filter=&by=&approximate=1, on a survey with at least
+APPROX_RESULTS_MIN_RESPONSES responses, runs results_engine.run_single_pass
+on the sample and scales the counts to the survey's response_count. Every
+estimate comes with 95% bounds (``bounds`` next to ``data``):
+
+- counts (respondents, answers per option / rating value): Wilson score
+  interval of the sampled proportion, with the finite population correction;
+- rating averages: normal interval of the sample mean;
+- rating quantiles (p25 / p50 / p75): read from the sampled rating
+  histogram, with the DKW rank bound. Ratings only take
+  answer_validation.RATING_RANGE values, so the per-value histogram is an
+  exact and mergeable quantile summary: per-segment histograms simply add up.
+
+Responses stored before the sampling key existed get one with
+``backfill`` (``flask rebuild-results``).
+"""
+import math
+import random
+
+import answer_codec
+import results_engine
+
+Z_95 = 1.96
+QUANTILES = {'p25': 0.25, 'p50': 0.5, 'p75': 0.75}
+
+
+def sampling_key():
+    """The ``r`` field of a new response."""
+    return random.random()
+
+
+def backfill(db, survey):
+    """Give a sampling key to the responses of one survey that have none. Returns their number."""
+    return db.responses.update_many(
+        {'survey_id': survey['_id'], 'r': {'$exists': False}},
+        [{'$set': {'r': {'$rand': {}}}}]
+    ).modified_count
+
+
+def sample(db, survey, size):
+    """The ``size`` responses of the survey with the smallest sampling keys."""
+    return list(
+        db.responses.find({'survey_id': survey['_id'], 'r': {'$gte': 0}}, {'_id': 0, **answer_codec.FIELDS})
+        .sort('r', 1)
+        .limit(size)
+    )
+
+
+# --- ESTIMATES ---
+
+class Estimator:
+    """Scale counts observed in a sample of ``k`` responses to a population of ``n``."""
+
+    def __init__(self, k, n):
+        self.k = k
+        self.n = max(n, k)
+        self.fpc = math.sqrt((self.n - k) / (self.n - 1)) if self.n > 1 else 0.0
+
+    def count(self, hits):
+        return round(hits * self.n / self.k)
+
+    def count_bounds(self, hits):
+        """95% Wilson interval of the population count."""
+        p, k, z2 = hits / self.k, self.k, Z_95 ** 2
+        center = (p + z2 / (2 * k)) / (1 + z2 / k)
+        half = Z_95 / (1 + z2 / k) * math.sqrt(p * (1 - p) / k + z2 / (4 * k * k))
+        # Finite population: the interval shrinks to the exact count as k reaches n
+        low = p - (p - max(center - half, 0.0)) * self.fpc
+        high = p + (min(center + half, 1.0) - p) * self.fpc
+        return [math.floor(low * self.n), math.ceil(high * self.n)]
+
+
+def _quantile(histogram, total, q):
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen >= q * total:
+            return value
+    return max(histogram)
+
+
+def _rating(data, bounds, estimator):
+    histogram = data.get('distribution') or {}
+    m = sum(histogram.values())
+    if not m:
+        return
+    mean = sum(v * c for v, c in histogram.items()) / m
+    variance = sum(c * (v - mean) ** 2 for v, c in histogram.items()) / max(m - 1, 1)
+    half = Z_95 * math.sqrt(variance / m) * estimator.fpc
+    bounds['average'] = [round(mean - half, 2), round(mean + half, 2)]
+
+    # Dvoretzky-Kiefer-Wolfowitz: the sampled CDF is within eps of the true one
+    eps = math.sqrt(math.log(2 / 0.05) / (2 * m))
+    data['quantiles'] = {name: _quantile(histogram, m, q) for name, q in QUANTILES.items()}
+    bounds['quantiles'] = {
+        name: [_quantile(histogram, m, max(q - eps, 0.0)), _quantile(histogram, m, min(q + eps, 1.0))]
+        for name, q in QUANTILES.items()
+    }
+
+    bounds['distribution'] = {v: estimator.count_bounds(c) for v, c in histogram.items()}
+    data['distribution'] = {v: estimator.count(c) for v, c in histogram.items()}
+
+
+def scale_results(stats, estimator):
+    """Turn the results of a sample into population estimates with their ``bounds``."""
+    for stat in stats:
+        data = stat['data']
+        bounds = {'total_answers': estimator.count_bounds(stat['total_answers'])}
+        stat['total_answers'] = estimator.count(stat['total_answers'])
+
+        if stat['type'] in results_engine.CHOICE_TYPES or stat['type'] == 'checkbox':
+            bounds['counts'] = {opt: estimator.count_bounds(c) for opt, c in data.items()}
+            stat['data'] = {opt: estimator.count(c) for opt, c in data.items()}
+        elif stat['type'] == 'rating':
+            _rating(data, bounds, estimator)
+        stat['bounds'] = bounds
+    return stats
+
+
+def approximate_results(db, survey, population, size, filters=None, by=None):
+    """
+    Estimated (stats or segments, total_respondents, info) from the sample,
+    like results_engine.compute. ``info`` describes the estimate; it holds the
+    95% bounds of total_respondents. Returns None when nothing is sampled.
+    """
+    responses = sample(db, survey, size)
+    if not responses:
+        return None
+
+    estimator = Estimator(len(responses), population)
+    results, total = results_engine.run_single_pass(survey, responses, filters, by)
+    if by is None:
+        scale_results(results, estimator)
+    else:
+        for segment in results:
+            segment['total_respondents_bounds'] = estimator.count_bounds(segment['total_respondents'])
+            segment['total_respondents'] = estimator.count(segment['total_respondents'])
+            scale_results(segment['results'], estimator)
+
+    info = {
+        "sample_size": estimator.k,
+        "population": estimator.n,
+        "confidence": 0.95,
+        "total_respondents_bounds": estimator.count_bounds(total),
+    }
+    return results, estimator.count(total), info
@@ -0,0 +1,168 @@
+"""
+Searchable free-text answers.
+
+Every answer to a ``text`` question is copied into the ``text_answers``
+collection when its response is recorded:
+
+    {
+        "_id": <ObjectId>,
+        "survey_id": <survey ObjectId>,
+        "q": 3,                              # question position
+        "response_id": <response ObjectId>,
+        "submitted_at": <date>,
+        "text": "Great service, slow delivery",
+        "terms": ["delivery", "great", "service", "slow"]
+    }
+
+The answers of a response are read from its stats update (the ``$push`` of
+aggregates.build_update), so the three write paths (sync, buffered batch,
+ASGI) need nothing more than what they already have.
+
+GET /api/surveys/<id>/questions/<question id>/answers?q=&limit=&after=
+pages through them without ever loading them all:
+
+- no ``q``: newest first, index survey_question_recent;
+- keywords (``q=slow delivery``): MongoDB text index survey_question_text
+  (language-neutral: no stemming or stop words), best textScore first;
+- prefixes (``q=deliv*``): every prefix must start one of the ``terms``
+  (lowercased, accents stripped), index survey_question_terms; combined with
+  keywords they narrow the ranked matches, alone they list newest first.
+
+Pagination is by keyset (see pagination.py): the cursor holds the
+(score or submitted_at, _id) of the last answer returned.
+"""
+import re
+import unicodedata
+
+from pymongo import DESCENDING
+
+import aggregates
+import answer_codec
+from pagination import after_filter, encode_cursor
+
+MAX_TERMS = 200  # per answer
+MAX_QUERY_TERMS = 10
+BATCH_SIZE = 1000
+
+_WORD = re.compile(r'\w+')
+
+
+def tokens(text):
+    """Lowercased words of ``text``, without accents."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return _WORD.findall(''.join(c for c in text if not unicodedata.combining(c)))
+
+
+# --- WRITE SIDE ---
+
+def documents(response, update):
+    """The text_answers documents of a response, given its stats update."""
+    docs = []
+    for path, push in update.get('$push', {}).items():
+        # q.<position>.recent: the text answers (see aggregates.build_update)
+        position = int(path.split('.')[1])
+        for text in push['$each']:
+            docs.append({
+                'survey_id': response['survey_id'],
+                'q': position,
+                'response_id': response['_id'],
+                'submitted_at': response['submitted_at'],
+                'text': text,
+                'terms': sorted(set(tokens(text)))[:MAX_TERMS],
+            })
+    return docs
+
+
+def record(db, response, update):
+    docs = documents(response, update)
+    if docs:
+        db.text_answers.insert_many(docs, ordered=False)
+
+
+def rebuild(db, survey):
+    """
+    Recompute the text_answers of one survey from the raw responses. Returns their number.
+    Ingestion must be paused for the survey: a text answer recorded between the delete
+    and the end of the scan would be stored twice.
+    """
+    db.text_answers.delete_many({'survey_id': survey['_id']})
+
+    count, batch = 0, []
+    cursor = (db.responses.find({'survey_id': survey['_id']},
+                                {'survey_id': 1, 'submitted_at': 1, **answer_codec.FIELDS})
+              .sort('_id', 1).batch_size(BATCH_SIZE))
+    for r in cursor:
+        update = aggregates.build_update(survey, answer_codec.answers_of(survey, r))
+        batch += documents(r, update)
+        if len(batch) >= BATCH_SIZE:
+            db.text_answers.insert_many(batch, ordered=False)
+            count, batch = count + len(batch), []
+    if batch:
+        db.text_answers.insert_many(batch, ordered=False)
+    return count + len(batch)
+
+
+# --- READ SIDE ---
+
+def parse_query(raw):
+    """Split a ``q`` param into (keywords, prefixes). Raises ValueError."""
+    keywords, prefixes = [], []
+    for word in raw.split():
+        target = prefixes if word.endswith('*') else keywords
+        for token in tokens(word):
+            if token not in target:
+                target.append(token)
+    if len(keywords) + len(prefixes) > MAX_QUERY_TERMS:
+        raise ValueError(f"q may contain at most {MAX_QUERY_TERMS} words")
+    return keywords, prefixes
+
+
+def _item(doc):
+    item = {
+        "id": doc['_id'],
+        "response_id": doc['response_id'],
+        "text": doc['text'],
+        "submitted_at": doc['submitted_at']
+    }
+    if 'score' in doc:
+        item['score'] = doc['score']
+    return item
+
+
+def search(db, survey_id, position, keywords=(), prefixes=(), limit=20, after=None):
+    """
+    One page of the answers to question ``position`` of a survey.
+    Returns (answers, next_cursor); ``after`` is a decoded cursor.
+    """
+    query = {'survey_id': survey_id, 'q': position}
+    if prefixes:
+        # Anchored regexes: index bounds on the terms index
+        query['$and'] = [{'terms': {'$regex': '^' + re.escape(p)}} for p in prefixes]
+    projection = {'text': 1, 'response_id': 1, 'submitted_at': 1}
+
+    if keywords:
+        query['$text'] = {'$search': ' '.join(keywords)}
+        pipeline = [
+            {'$match': query},
+            {'$project': {**projection, 'score': {'$meta': 'textScore'}}},
+        ]
+        if after:
+            pipeline.append({'$match': after_filter(after, 'score')})
+        # $sort + $limit only keep the best limit + 1 in memory
+        pipeline += [{'$sort': {'score': -1, '_id': -1}}, {'$limit': limit + 1}]
+        docs = list(db.text_answers.aggregate(pipeline))
+        sort_field = 'score'
+    else:
+        if after:
+            query.update(after_filter(after, 'submitted_at'))
+        docs = list(db.text_answers.find(query, projection)
+                    .sort([('submitted_at', DESCENDING), ('_id', DESCENDING)])
+                    .limit(limit + 1))
+        sort_field = 'submitted_at'
+
+    next_cursor = None
+    if len(docs) > limit:
+        # limit + 1 documents were fetched: there is another page
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1][sort_field], docs[-1]['_id'])
+    return [_item(d) for d in docs], next_cursor
@@ -0,0 +1,222 @@
+"""
+Time-bucketed survey results.
+
+Next to its all-time stats document (aggregates.py), a survey owns one
+document in ``survey_timeseries`` per hour in which it received responses,
+with the same counters:
+
+    {
+        "_id": <ObjectId>,
+        "survey_id": <survey ObjectId>,
+        "granularity": "hour",                 # or "day" once compacted
+        "start": <start of the bucket, naive UTC>,
+        "total": 3,
+        "q": {...},                            # as in survey_stats
+        "merged": [<hourly bucket _id>, ...]   # daily buckets only
+    }
+
+Hourly buckets are updated at ingest time, from the response's
+``submitted_at``, with the very update document that goes to survey_stats
+(one more upsert per response, or one per survey and hour for a buffered
+batch, see ingest.py).
+
+``compact`` folds the hourly buckets older than TIMESERIES_HOURLY_DAYS into
+one daily bucket per survey and day, then deletes them. Each hourly bucket is
+added to its day at most once (``merged``), so an interrupted compaction can
+simply run again. It runs in the reaper thread every
+TIMESERIES_COMPACT_INTERVAL seconds, or with ``flask compact-timeseries``.
+
+``range_results`` serves GET /results?from=&to=&granularity= from the buckets
+of the range: O(buckets x questions), whatever the number of responses.
+``rebuild`` recomputes the buckets of a survey from the raw responses
+(``flask rebuild-results``), with ingestion paused.
+"""
+import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import aggregates
+import answer_codec
+
+GRANULARITIES = {'hour': datetime.timedelta(hours=1), 'day': datetime.timedelta(days=1)}
+# Range used when the query only gives some of from / to / granularity
+DEFAULT_RANGE = datetime.timedelta(days=7)
+MAX_BUCKETS = 1000
+
+
+def bucket_start(at, granularity='hour'):
+    if granularity == 'day':
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_filter(survey_id, start, granularity='hour'):
+    # Unique index survey_granularity_start: concurrent upserts cannot duplicate a bucket
+    return {'survey_id': survey_id, 'granularity': granularity, 'start': start}
+
+
+# --- WRITE SIDE ---
+
+def record(db, survey_id, submitted_at, update):
+    """Fold one response (an update built by aggregates.build_update) into its hourly bucket."""
+    db.survey_timeseries.update_one(
+        bucket_filter(survey_id, bucket_start(submitted_at)), update, upsert=True)
+
+
+def bulk_updates(items):
+    """
+    One UpdateOne per survey and hour for a batch of
+    (survey_id, submitted_at, update) items.
+    """
+    per_bucket = {}
+    for survey_id, submitted_at, update in items:
+        per_bucket.setdefault((survey_id, bucket_start(submitted_at)), []).append(update)
+    return [
+        UpdateOne(bucket_filter(survey_id, start), aggregates.merge_updates(updates), upsert=True)
+        for (survey_id, start), updates in per_bucket.items()
+    ]
+
+
+def _fold_into_day(db, hourly):
+    day_filter = bucket_filter(hourly['survey_id'], bucket_start(hourly['start'], 'day'), 'day')
+    update = aggregates.doc_update(hourly)
+    update.setdefault('$push', {})['merged'] = hourly['_id']
+
+    # A DuplicateKeyError means the daily bucket exists but did not match:
+    # either another worker just created it (try again), or this hour is
+    # already in it (a previous run stopped before deleting the hour)
+    for _ in range(2):
+        try:
+            db.survey_timeseries.update_one(
+                {**day_filter, 'merged': {'$ne': hourly['_id']}}, update, upsert=True)
+            return
+        except DuplicateKeyError:
+            continue
+
+
+def compact(db, hourly_days=14, now=None):
+    """
+    Fold the hourly buckets of the days older than ``hourly_days`` into daily
+    buckets. Returns the number of hourly buckets compacted.
+    """
+    now = now or datetime.datetime.utcnow()
+    cutoff = bucket_start(now - datetime.timedelta(days=hourly_days), 'day')
+
+    compacted = 0
+    cursor = db.survey_timeseries.find({'granularity': 'hour', 'start': {'$lt': cutoff}}).sort('start', 1)
+    for hourly in cursor:
+        _fold_into_day(db, hourly)
+        db.survey_timeseries.delete_one({'_id': hourly['_id']})
+        compacted += 1
+    return compacted
+
+
+def rebuild(db, survey, hourly_days=14, now=None):
+    """
+    Recompute the time buckets of one survey from the raw responses. Returns their number.
+    Ingestion must be paused for the survey: a response recorded during the scan is
+    lost or counted twice, and a bucket upserted between the delete and the insert
+    makes the insert fail on the unique index.
+    """
+    now = now or datetime.datetime.utcnow()
+    cutoff = bucket_start(now - datetime.timedelta(days=hourly_days), 'day')
+
+    buckets = {}
+    cursor = (db.responses.find({'survey_id': survey['_id']}, {'submitted_at': 1, **answer_codec.FIELDS})
+              .sort('_id', 1))
+    for r in cursor:
+        if r.get('submitted_at') is None:
+            continue
+        granularity = 'day' if r['submitted_at'] < cutoff else 'hour'
+        start = bucket_start(r['submitted_at'], granularity)
+        doc = buckets.get((granularity, start))
+        if doc is None:
+            doc = buckets[granularity, start] = {**bucket_filter(survey['_id'], start, granularity),
+                                                 'total': 0, 'q': {}}
+        aggregates.apply_in_memory(doc, aggregates.build_update(survey, answer_codec.answers_of(survey, r)))
+
+    db.survey_timeseries.delete_many({'survey_id': survey['_id']})
+    if buckets:
+        db.survey_timeseries.insert_many(list(buckets.values()))
+    return len(buckets)
+
+
+def delete(db, survey_id):
+    db.survey_timeseries.delete_many({'survey_id': survey_id})
+
+
+# --- READ SIDE ---
+
+def _parse_time(raw):
+    try:
+        at = datetime.datetime.fromisoformat(raw)
+    except ValueError:
+        raise ValueError(f"Invalid date: {raw!r} (expected ISO 8601)")
+    if at.tzinfo is not None:
+        at = at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return at
+
+
+def parse_range(args, now=None):
+    """
+    (start, end, granularity) from the ``from``, ``to`` (ISO 8601, UTC unless
+    an offset is given) and ``granularity`` query params. ``to`` defaults to
+    now, ``from`` to DEFAULT_RANGE before ``to``, ``granularity`` to 'day';
+    ``from`` is rounded down to the start of its bucket. Raises ValueError.
+    """
+    granularity = args.get('granularity') or 'day'
+    if granularity not in GRANULARITIES:
+        raise ValueError("granularity must be 'hour' or 'day'")
+
+    end = _parse_time(args['to']) if args.get('to') else (now or datetime.datetime.utcnow())
+    start = _parse_time(args['from']) if args.get('from') else end - DEFAULT_RANGE
+    start = bucket_start(start, granularity)
+    if start >= end:
+        raise ValueError("from must be before to")
+    if (end - start) / GRANULARITIES[granularity] > MAX_BUCKETS:
+        raise ValueError(f"Range longer than {MAX_BUCKETS} buckets, use a coarser granularity")
+    return start, end, granularity
+
+
+def range_results(db, survey, start, end, granularity):
+    """
+    Results of the responses submitted in [start, end), per bucket and in
+    total: (buckets, results, total_respondents). Each bucket is
+    {start, granularity, total_respondents, results}.
+
+    Hours already compacted only exist as whole days: with granularity='hour'
+    they come as one 'day' bucket, counted if the range includes its start.
+    """
+    cursor = db.survey_timeseries.find(
+        {'survey_id': survey['_id'], 'granularity': {'$in': list(GRANULARITIES)},
+         'start': {'$gte': start, '$lt': end}},
+        {'merged': 0}
+    ).sort('start', 1)
+
+    per_bucket = {}
+    overall = {'total': 0, 'q': {}}
+    for doc in cursor:
+        key = bucket_start(doc['start'], granularity)
+        entry = per_bucket.get(key)
+        if entry is None:
+            entry = per_bucket[key] = {'granularity': doc['granularity'], 'doc': {'total': 0, 'q': {}}}
+        elif doc['granularity'] == 'day':
+            entry['granularity'] = 'day'
+
+        update = aggregates.doc_update(doc)
+        aggregates.apply_in_memory(entry['doc'], update)
+        aggregates.apply_in_memory(overall, update)
+
+    buckets = []
+    for key in sorted(per_bucket):
+        results, total = aggregates.to_results(survey, per_bucket[key]['doc'])
+        buckets.append({
+            "start": key,
+            "granularity": per_bucket[key]['granularity'],
+            "total_respondents": total,
+            "results": results
+        })
+
+    results, total = aggregates.to_results(survey, overall)
+    return buckets, results, total
@@ -0,0 +1,116 @@
+"""
+Worker warm-up: what a new worker would otherwise do during its first live
+requests, done before it accepts any.
+
+gunicorn.conf.py preloads the app (create_app runs once, in the master) and
+calls ``warm_up`` in each worker after the fork, before the worker starts
+accepting connections. asgi.py does the same at lifespan startup, and so
+does ``python app.py``. The steps, each timed:
+
+- models: validate a sample payload against every pydantic schema, which
+  also imports their lazy dependencies (email-validator, idna). When the
+  app is preloaded this already ran in the master (create_app), and the
+  workers share the result;
+- mongo_pool: open the MONGO_MIN_POOL_SIZE connections of the process's
+  client (database.py);
+- indexes: check that every index in indexes.py exists (they are created
+  by ``flask ensure-indexes``). Missing ones are logged, as errors for the
+  unique ones, and never stop the worker;
+- background: start the password hashing processes and the threads of
+  this worker (ingest flusher, live hub, reaper).
+
+A failing step is logged and the worker starts anyway: warm-up only moves
+work earlier. WARM_UP=false skips every step. Timings go to the log and to
+/metrics (METRICS_ENABLED): worker_boot_seconds and
+worker_warm_up_seconds{step} here, and worker_first_request_seconds in
+metrics.py. Compare cold and warm workers with benchmarks/startup.py.
+"""
+import logging
+import os
+import time
+
+import pymongo
+
+import metrics
+from database import mongo
+from indexes import UNIQUE_INDEXES, missing_indexes
+from passwords import hasher
+from validation import SurveyCreateSchema, UserLoginSchema, UserRegisterSchema
+
+logger = logging.getLogger(__name__)
+
+# Per MongoDB step: an unreachable server must not hold the worker past gunicorn's timeout
+MONGO_STEP_TIMEOUT = 5  # seconds
+
+SAMPLES = [
+    (UserRegisterSchema, {'name': 'Warm up', 'email': 'warm-up@example.com', 'password': 'warm-up'}),
+    (UserLoginSchema, {'email': 'warm-up@example.com', 'password': 'warm-up'}),
+    (SurveyCreateSchema, {'title': 'Warm up', 'questions': [
+        {'id': 1, 'text': 'Warm up?', 'type': 'radio', 'options': ['Yes', 'No']}]}),
+]
+
+_boot_started = {}  # pid -> time.perf_counter() at the start of its boot
+_models_ready = False
+
+
+def mark_boot():
+    """Start of this process's boot: gunicorn's post_fork, else create_app."""
+    _boot_started.setdefault(os.getpid(), time.perf_counter())
+
+
+def compile_models():
+    global _models_ready
+    if not _models_ready:
+        for schema, sample in SAMPLES:
+            schema.model_validate(sample)
+        _models_ready = True
+
+
+def _check_indexes():
+    with pymongo.timeout(MONGO_STEP_TIMEOUT):
+        missing = missing_indexes(mongo.db)
+    unique = [name for name in missing if name in UNIQUE_INDEXES]
+    if unique:
+        logger.error("Missing unique indexes, duplicates are NOT rejected (run flask ensure-indexes): %s",
+                     ', '.join(unique))
+    if len(unique) < len(missing):
+        logger.warning("Missing indexes (run flask ensure-indexes): %s",
+                       ', '.join(name for name in missing if name not in UNIQUE_INDEXES))
+
+
+def _start_background(app):
+    hasher.warm_up()
+    for name in ('ingest_buffer', 'live_hub', 'reaper'):
+        component = app.extensions.get(name)
+        if component is not None:
+            component.ensure_started()
+
+
+def warm_up(app):
+    """Run every step in this process. Returns {step: seconds}."""
+    mark_boot()
+    timings = {}
+
+    def step(name, fn):
+        started = time.perf_counter()
+        try:
+            return fn()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+        finally:
+            timings[name] = time.perf_counter() - started
+            metrics.WORKER_WARM_UP.set((('step', name),), timings[name])
+
+    if app.config['WARM_UP']:
+        step('models', compile_models)
+        connections = step('mongo_pool', lambda: mongo.prime_pool(MONGO_STEP_TIMEOUT))
+        step('indexes', _check_indexes)
+        step('background', lambda: _start_background(app))
+        logger.info("Worker %s warmed up: %s, %s Mongo connection(s)", os.getpid(),
+                    ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in timings.items()),
+                    connections)
+
+    boot = time.perf_counter() - _boot_started[os.getpid()]
+    metrics.WORKER_BOOT.set((), boot)
+    logger.info("Worker %s ready in %.0f ms", os.getpid(), boot * 1000)
+    return timings